@@ -14,3 +14,5 @@ python scripts/02_select_hotspots.py --config config/params.v100.yaml
 bash scripts/03_run_rfdiffusion3.sh config/params.v100.yaml
 bash scripts/04_run_proteinmpnn.sh config/params.v100.yaml
 bash scripts/05_run_rf3.sh config/params.v100.yaml
+# 两档漏斗（代替上面的 04/05 及 06）：python scripts/run_funnel.py --params config/params.v100.yaml
+# 多靶点：python scripts/run_campaign.py --params config/params.v100.yaml
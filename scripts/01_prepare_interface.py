@@ -1,18 +1,14 @@
 # scripts/01_prepare_interface.py
 import os, json, argparse
 from Bio.PDB import PDBIO
-from utils import load_structure, best_chain_match, contact_pairs, sasa_by_chain, to_reskey, ChainSelect, residue_center
-try:
-    import yaml
-except:
-    raise SystemExit("Please pip install pyyaml")
+from utils import load_structure, best_chain_match, contact_table, closest_partners, structure_sasa, to_reskey, ChainSelect, residue_center
+from resolve_params import load_params
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--params", required=True, help="config/params.yaml")
 args = parser.parse_args()
 
-with open(args.params) as f:
-    P = yaml.safe_load(f)
+P = load_params(args.params)
 
 paths = P["paths"]
 filters = P["filters"]
@@ -31,42 +27,39 @@ os.makedirs(paths["targets_dir"], exist_ok=True)
 s_m = load_structure(paths["mettl1_pdb"], "M")
 s_c = load_structure(paths["complex_pdb"], "C")
 
-chain_m_in_complex, ident = best_chain_match(s_m, s_c)
+# 链匹配结果按序列哈希缓存在 tmp_root 下，重复运行 / 多靶点批次直接命中
+cache_dir = paths.get("tmp_root", paths["targets_dir"])
+os.makedirs(cache_dir, exist_ok=True)
+chain_m_in_complex, ident = best_chain_match(s_m, s_c, cache_path=os.path.join(cache_dir, "chain_match_cache.json"))
 mettl1_chain_id = chain_m_in_complex.id
 
 chains_complex = [ch for ch in s_c.get_chains()]
+# 所有链只数组化一次，METTL1 对每条链的残基接触一次性算出（WDR4 复用同一张表）
+other_ids = [ch.id for ch in chains_complex if ch.id != mettl1_chain_id]
+chain_atoms, contacts = contact_table(chains_complex, cutoff=contact_cutoff,
+                                      pairs=[(mettl1_chain_id, cid) for cid in other_ids])
 contact_counts = {}
-for ch in chains_complex:
-    if ch.id == mettl1_chain_id:
-        continue
-    pairs = contact_pairs(chain_m_in_complex, ch, cutoff=contact_cutoff)
-    contact_counts[ch.id] = len(pairs)
+for cid in other_ids:
+    ia, ib, d = closest_partners(*contacts[(mettl1_chain_id, cid)])
+    contact_counts[cid] = len(ia)
 
 wdr4_chain_id = max(contact_counts, key=lambda k: contact_counts[k])
 
-# 计算ΔSASA
-sasa_complex = sasa_by_chain(s_c)
+# 计算ΔSASA：复合物与 METTL1/WDR4 单链 SASA 在内存中一次算完（不再写单链 PDB 再回读）
+sasa = structure_sasa(s_c, chain_ids=[mettl1_chain_id, wdr4_chain_id])
+sasa_complex = sasa.by_residue("complex")
+sasa_mono_m = {k: v for k, v in sasa.by_residue("isolated").items() if k[0] == mettl1_chain_id}
 
 io = PDBIO()
-mettl1_only_path = os.path.join(paths["targets_dir"], f"8D58_{mettl1_chain_id}_only.pdb")
-wdr4_only_path   = os.path.join(paths["targets_dir"], f"8D58_{wdr4_chain_id}_only.pdb")
 mettl1_target_path = os.path.join(paths["targets_dir"], "mettl1_target.pdb")
-
-io.set_structure(s_c); io.save(mettl1_only_path, ChainSelect([mettl1_chain_id]))
-io.set_structure(s_c); io.save(wdr4_only_path,   ChainSelect([wdr4_chain_id]))
 io.set_structure(s_c); io.save(mettl1_target_path, ChainSelect([mettl1_chain_id]))
 
-from utils import load_structure as _ls
-sasa_mono_m = sasa_by_chain(_ls(mettl1_only_path, "Mm"))
-sasa_mono_w = sasa_by_chain(_ls(wdr4_only_path, "Ww"))
-
-pairs = contact_pairs(chain_m_in_complex,
-                      [ch for ch in chains_complex if ch.id==wdr4_chain_id][0],
-                      cutoff=contact_cutoff)
+ia, ib, d = closest_partners(*contacts[(mettl1_chain_id, wdr4_chain_id)])
+mettl1_residues = chain_atoms[mettl1_chain_id].residues
 
 mettl1_res_contact = {}
-for resM, resW, d in pairs:
-    keyM = to_reskey(resM)
+for i in ia:
+    keyM = to_reskey(mettl1_residues[i])
     mettl1_res_contact[keyM] = mettl1_res_contact.get(keyM, 0) + 1
 
 deltas = []
@@ -81,9 +74,8 @@ for (ch,resn), sasa_mono in sasa_mono_m.items():
 deltas.sort(key=lambda x: (x[1], x[2]), reverse=True)
 top_pool = deltas[:topsasa_n]
 
-target_structure = _ls(mettl1_target_path, "T")
-target_chain = list(target_structure.get_chains())[0]
-target_len = len([res for res in target_chain.get_residues() if res.id[0]==' '])
+# mettl1_target.pdb 即复合物中的 METTL1 链，长度直接从内存结构统计，不再回读
+target_len = len([res for res in chain_m_in_complex.get_residues() if res.id[0]==' '])
 
 res_dict = {str(res.id[1]).strip(): res for res in chain_m_in_complex.get_residues() if res.id[0]==' '}
 
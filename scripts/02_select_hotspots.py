@@ -2,11 +2,7 @@
 import os, json, argparse, random, sys
 from typing import List
 import numpy as np
-
-try:
-    import yaml
-except Exception:
-    yaml = None
+from resolve_params import load_params, ConfigError
 
 try:
     from scipy.cluster.vq import kmeans2
@@ -17,11 +13,102 @@ def load_yaml(path: str):
     if not os.path.exists(path):
         print(f"[ERROR] 配置文件不存在: {path}", file=sys.stderr)
         sys.exit(1)
-    if yaml is None:
-        print("[ERROR] 需要 PyYAML，请先安装：python -m pip install pyyaml", file=sys.stderr)
+    try:
+        return load_params(path)
+    except ConfigError as e:
+        print(f"[ERROR] {path}: {e}", file=sys.stderr)
         sys.exit(1)
-    with open(path, "r") as f:
-        return yaml.safe_load(f)
+
+def build_conflict_matrix(resnums, min_gap: int) -> np.ndarray:
+    """conflict[i, j] 为 True 表示 i、j 同链序号间隔 < min_gap（序号未知的残基不参与）；对角线置 True，选中即屏蔽自身。"""
+    r = np.asarray(resnums, dtype=int)
+    valid = r > 0
+    conflict = (np.abs(r[:, None] - r[None, :]) < min_gap) & valid[:, None] & valid[None, :]
+    np.fill_diagonal(conflict, True)
+    return conflict
+
+def greedy_select(order: np.ndarray, hs: int, conflict: np.ndarray, is_key: np.ndarray,
+                  label_of: np.ndarray, cluster_order) -> List[int]:
+    """按 order 的优先顺序贪心选取：关键残基（不超过四分之一）-> 按 cluster_order 每簇一个 -> 依次补齐。
+    blocked 掩码随每次选中累积冲突行，不再逐对比较。"""
+    blocked = np.zeros(len(order), dtype=bool)
+    selected: List[int] = []
+
+    def take(i):
+        selected.append(int(i))
+        blocked[:] |= conflict[i]
+
+    # 强制包含部分关键残基（不超过四分之一）
+    for i in order[is_key[order]][: max(1, hs // 4)]:
+        if not blocked[i]:
+            take(i)
+    # 按簇抽取
+    for c in cluster_order:
+        cand = order[(label_of[order] == c) & ~blocked[order]]
+        if len(cand):
+            take(cand[0])
+        if len(selected) >= hs:
+            break
+    # 回退补齐
+    while len(selected) < hs:
+        cand = order[~blocked[order]]
+        if not len(cand):
+            break
+        take(cand[0])
+    return selected
+
+def pairwise_distances(pool_sorted) -> np.ndarray:
+    """候选 coord 两两距离；缺坐标的候选距离取其余距离的中位数（不偏向也不排斥）。"""
+    xyz = np.array([it["coord"] if it.get("coord") not in (None, [0.0, 0.0, 0.0]) else [np.nan] * 3
+                    for it in pool_sorted], dtype=float).reshape(-1, 3)
+    d = np.sqrt(((xyz[:, None, :] - xyz[None, :, :]) ** 2).sum(-1))
+    fill = np.nanmedian(d) if np.isfinite(d).any() else 0.0
+    return np.where(np.isfinite(d), d, fill)
+
+def portfolio_select(keys: np.ndarray, hs: int, conflict: np.ndarray, dist: np.ndarray, weight: float,
+                     usage: np.ndarray = None) -> List[int]:
+    """空间最远点式贪心：先取 keys 最高者，之后每步最大化 (1-w)·得分 + w·到已选集合的最小距离（均归一化到 [0,1]）。
+    usage 为各残基在已接受组合中出现的次数，用于压低高频残基的得分。"""
+    span = keys.max() - keys.min()
+    k = (keys - keys.min()) / span if span > 0 else np.zeros_like(keys)
+    if usage is not None and usage.max() > 0:
+        k = k - 0.5 * usage / usage.max()
+    dmax = dist.max() or 1.0
+    blocked = np.zeros(len(keys), dtype=bool)
+    mind = np.full(len(keys), dmax)
+    selected: List[int] = []
+    while len(selected) < hs and not blocked.all():
+        obj = k if not selected else (1.0 - weight) * k + weight * (mind / dmax)
+        i = int(np.argmax(np.where(blocked, -np.inf, obj)))
+        selected.append(i)
+        blocked |= conflict[i]
+        mind = np.minimum(mind, dist[i])
+    return selected
+
+class OverlapIndex:
+    """已接受组合的重叠检查：残基 × 组合 的关联矩阵，候选组合只需取出自身 hs 行求和即得与全部已接受组合的交集大小，
+    一次向量运算得到精确 Jaccard（热点组合只有十个左右元素，比 64 维 MinHash 签名逐组合比较更省且无漏判）。"""
+    def __init__(self, n: int, max_jaccard: float, capacity: int = 256):
+        self.max_jaccard = max_jaccard
+        self.incidence = np.zeros((n, capacity), dtype=np.uint8)
+        self.sizes = np.zeros(capacity, dtype=np.int32)
+        self.counts = np.zeros(n, dtype=np.int32)
+        self.m = 0
+
+    def max_overlap(self, sel: List[int]) -> float:
+        if self.m == 0:
+            return 0.0
+        inter = self.incidence[sel, :self.m].sum(axis=0, dtype=np.int32)
+        return float((inter / (self.sizes[:self.m] + len(sel) - inter)).max())
+
+    def add(self, sel: List[int]):
+        if self.m == len(self.sizes):
+            self.incidence = np.concatenate([self.incidence, np.zeros_like(self.incidence)], axis=1)
+            self.sizes = np.concatenate([self.sizes, np.zeros_like(self.sizes)])
+        self.incidence[sel, self.m] = 1
+        self.counts[sel] += 1
+        self.sizes[self.m] = len(sel)
+        self.m += 1
 
 def parse_args():
     p = argparse.ArgumentParser(description="从候选界面残基中选取热点组合（由配置文件驱动）")
@@ -32,6 +119,10 @@ def parse_args():
     p.add_argument("--min_gap", type=int, default=None, help="同链序号最小间隔（默认 取 5 或配置覆盖）")
     p.add_argument("--max_sets_per_count", type=int, default=None, help="每种热点数生成的组合套数（默认 1 或配置覆盖）")
     p.add_argument("--num_clusters", type=int, default=4, help="kmeans 聚类簇数")
+    p.add_argument("--portfolio", action="store_true", help="组合多样性模式（默认取 hotspot_portfolio.enabled）")
+    p.add_argument("--max_jaccard", type=float, default=None, help="与已接受组合的 Jaccard 重叠上限（portfolio 模式）")
+    p.add_argument("--diversity_weight", type=float, default=None, help="portfolio 模式下空间分散度权重 0~1")
+    p.add_argument("--sample_temp", type=float, default=None, help="多套组合时得分扰动强度（默认 0.5×得分标准差）")
     return p.parse_args()
 
 def main():
@@ -65,6 +156,10 @@ def main():
     min_gap = args.min_gap if args.min_gap is not None else 5
     max_sets_per_count = args.max_sets_per_count if args.max_sets_per_count is not None else 1
     num_clusters = args.num_clusters
+    pcfg = cfg.get("hotspot_portfolio", {}) or {}
+    portfolio = args.portfolio or bool(pcfg.get("enabled", False))
+    max_jaccard = args.max_jaccard if args.max_jaccard is not None else float(pcfg.get("max_jaccard", 0.5))
+    diversity_weight = args.diversity_weight if args.diversity_weight is not None else float(pcfg.get("diversity_weight", 0.5))
 
     # 读取候选
     with open(candidates_json, "r") as f:
@@ -102,53 +197,72 @@ def main():
     else:
         print("[WARN] 可用于 kmeans 的坐标不足，将回退到序列间隔策略。")
 
-    def too_close(item, sel: List[dict]) -> bool:
-        return any(abs(item["resnum_int"] - s["resnum_int"]) < min_gap for s in sel if item["resnum_int"] > 0 and s["resnum_int"] > 0)
+    # 候选一律用 pool_sorted 中的下标表示：得分、是否关键残基、簇标签都是数组，
+    # 序号间隔冲突预先算成矩阵，选择过程只做布尔掩码运算
+    n = len(pool_sorted)
+    scores = np.array([x.get("delta_sasa", 0.0) + x.get("contact_count", 0.0) + x["preference_score"] + x["key_bonus"]
+                       for x in pool_sorted], dtype=float)
+    is_key = np.array([it["resnum"] in key_residues for it in pool_sorted], dtype=bool)
+    label_of = np.full(n, -1)
+    if labels is not None:
+        label_of[idx_map] = labels
+    conflict = build_conflict_matrix([it["resnum_int"] for it in pool_sorted], min_gap)
+    temp = args.sample_temp if args.sample_temp is not None else 0.5 * float(scores.std() or 1.0)
+
+    if portfolio:
+        dist = pairwise_distances(pool_sorted)
+        print(f"[INFO] portfolio 模式：max_jaccard={max_jaccard}, diversity_weight={diversity_weight}")
 
     out_sets = []
+    n_clusters_used = num_clusters if labels is not None else 0
     for hs in hotspot_counts:
-        generated = 0
-        attempts = 0
-        while generated < max_sets_per_count and attempts < 50:
+        seen = set()
+        accepted = []
+        if portfolio:
+            # 重叠检查按热点数分别进行（不同热点数的组合本来就对应不同的 RFdiffusion 任务）
+            overlap = OverlapIndex(n, max_jaccard)
+        # 第一套沿用原始的确定性顺序（按得分排序、簇按编号）；其余套对得分加 Gumbel 扰动、簇顺序随机，批量生成候选顺序
+        orders = [(np.arange(n), np.arange(n_clusters_used))]
+        attempts = stall = 0
+        max_attempts = max(50, 20 * max_sets_per_count)
+        while len(accepted) < max_sets_per_count and attempts < max_attempts and stall < max(50, max_sets_per_count):
+            if not orders:
+                batch = min(1024, max_attempts - attempts, 2 * (max_sets_per_count - len(accepted)))
+                keys = scores[None, :] + temp * np.random.gumbel(size=(batch, n))
+                orders = [(o, np.random.permutation(n_clusters_used)) for o in np.argsort(-keys, axis=1, kind="stable")]
+            order, cluster_order = orders.pop(0)
             attempts += 1
-            selected = []
-            # 强制包含部分关键残基（不超过四分之一）
-            forced = [it for it in pool_sorted if it["resnum"] in key_residues][: max(1, hs // 4)]
-            for it in forced:
-                if not too_close(it, selected):
-                    selected.append(it)
-
-            # 按簇抽取
-            if labels is not None:
-                for c in range(num_clusters):
-                    cluster_items = [pool_sorted[idx_map[i]] for i in range(len(idx_map)) if labels[i] == c and pool_sorted[idx_map[i]] not in selected]
-                    cluster_items = [it for it in cluster_items if not too_close(it, selected)]
-                    if cluster_items:
-                        selected.append(cluster_items[0])
-                    if len(selected) >= hs:
-                        break
-
-            # 回退补齐
-            i = 0
-            while len(selected) < hs and i < len(pool_sorted):
-                it = pool_sorted[i]
-                i += 1
-                if it in selected:
-                    continue
-                if too_close(it, selected):
-                    continue
-                selected.append(it)
-
-            if len(selected) == hs:
-                out = {
-                    "hotspots": [f"{mettl1_chain_id}:{it['resnum']}" for it in selected],
-                    "hotspot_res_str": ",".join([f"{mettl1_chain_id}:{it['resnum']}" for it in selected]),
-                    "mettl1_chain_id": mettl1_chain_id,
-                    "hotspot_count": hs,
-                    "min_gap": min_gap,
-                }
-                out_sets.append(out)
-                generated += 1
+            if portfolio:
+                # 由候选顺序还原逐候选的优先级，再按空间最远点准则选取；重叠过高的组合直接拒绝
+                keys_i = np.empty(n); keys_i[order] = -np.arange(n)
+                selected = portfolio_select(keys_i, hs, conflict, dist, diversity_weight, overlap.counts)
+                # max_jaccard >= 1 时重叠约束不排除完全相同的组合，去重另行检查
+                ok = len(selected) == hs and overlap.max_overlap(selected) <= max_jaccard and frozenset(selected) not in seen
+                if ok:
+                    overlap.add(selected)
+                    seen.add(frozenset(selected))
+            else:
+                selected = greedy_select(order, hs, conflict, is_key, label_of, cluster_order)
+                ok = len(selected) == hs and frozenset(selected) not in seen
+                if ok:
+                    seen.add(frozenset(selected))
+            if ok:
+                accepted.append(selected)
+                stall = 0
+            else:
+                stall += 1
+        if len(accepted) < max_sets_per_count:
+            print(f"[WARN] hotspot_count={hs}: 仅生成 {len(accepted)}/{max_sets_per_count} 套不重复组合（{attempts} 次尝试）")
+
+        for selected in accepted:
+            out = {
+                "hotspots": [f"{mettl1_chain_id}:{pool_sorted[i]['resnum']}" for i in selected],
+                "hotspot_res_str": ",".join([f"{mettl1_chain_id}:{pool_sorted[i]['resnum']}" for i in selected]),
+                "mettl1_chain_id": mettl1_chain_id,
+                "hotspot_count": hs,
+                "min_gap": min_gap,
+            }
+            out_sets.append(out)
 
     out_path = os.path.join(out_dir, "hotspots_sets.json")
     with open(out_path, "w") as w:
@@ -3,9 +3,13 @@ set -euo pipefail
 
 PARAMS=$1
 
-RFDIFFUSION3_REPO=$(python scripts/get_param_yaml.py "$PARAMS" paths.rfdiffusion3_repo)
-WORKDIR=$(python scripts/get_param_yaml.py "$PARAMS" paths.work_dir)
-TARGETS_DIR=$(python scripts/get_param_yaml.py "$PARAMS" paths.targets_dir)
+# 配置一次性解析（scripts/resolve_params.py），缓存有效时直接 source
+source scripts/load_params.sh
+load_params "$PARAMS"
+
+RFDIFFUSION3_REPO="$P_PATHS_RFDIFFUSION3_REPO"
+WORKDIR="$P_PATHS_WORK_DIR"
+TARGETS_DIR="$P_PATHS_TARGETS_DIR"
 
 OUTDIR="${WORKDIR}/rfdiffusion3_raw"
 TARGET_JSON="${TARGETS_DIR}/interface_candidates.json"
@@ -13,81 +17,53 @@ HOTSETS_JSON="${TARGETS_DIR}/hotspots_sets.json"
 
 mkdir -p "$OUTDIR"
 LOGFILE="$OUTDIR/log.txt"
-: > "$LOGFILE"
+# 追加而非截断：断点续跑时保留上一次运行的日志
+echo "===== $(date '+%F %T') stage 3 run started (params=$PARAMS) =====" >> "$LOGFILE"
 
 test -s "$TARGET_JSON"
 test -s "$HOTSETS_JSON"
 
-BATCH_ID=$(python scripts/get_param_yaml.py "$PARAMS" project.batch_id)
-DESIGNS_PER_COMBO=$(python scripts/get_param_yaml.py "$PARAMS" scale.rfdesigns_per_combo_per_lenbin)
-NEI_RAD=$(python scripts/get_param_yaml.py "$PARAMS" rfdd3.neighborhood_radius)
-MODEL_ONLY=$(python scripts/get_param_yaml.py "$PARAMS" rfdd3.model_only_neighbors)
-T=$(python scripts/get_param_yaml.py "$PARAMS" rfdd3.inference_T || echo 50)
-DIFFUSION_SCHEDULE=$(python scripts/get_param_yaml.py "$PARAMS" rfdd3.diffusion_schedule || echo "linear")
-MODEL_VERSION=$(python scripts/get_param_yaml.py "$PARAMS" rfdd3.model_version || echo "v3")
+NEI_RAD="$P_RFDD3_NEIGHBORHOOD_RADIUS"
+MODEL_ONLY="$P_RFDD3_MODEL_ONLY_NEIGHBORS"
+T="$P_RFDD3_INFERENCE_T"
+DIFFUSION_SCHEDULE="$P_RFDD3_DIFFUSION_SCHEDULE"
+MODEL_VERSION="$P_RFDD3_MODEL_VERSION"
 
-METTL1_TARGET_PDB=$(python -c 'import json,sys; print(json.load(open(sys.argv[1]))["mettl1_target_pdb"])' "$TARGET_JSON")
-TARGET_CHAIN_ID=$(python -c 'import json,sys; print(json.load(open(sys.argv[1]))["mettl1_chain_id"])' "$TARGET_JSON")
+read -r METTL1_TARGET_PDB TARGET_CHAIN_ID < <(python -c 'import json,sys; d=json.load(open(sys.argv[1])); print(d["mettl1_target_pdb"], d["mettl1_chain_id"])' "$TARGET_JSON")
 
 echo "[INFO] target_pdb=$METTL1_TARGET_PDB" | tee -a "$LOGFILE"
 echo "[INFO] target_chain=$TARGET_CHAIN_ID" | tee -a "$LOGFILE"
 test -s "$METTL1_TARGET_PDB"
 
-TARGET_SEGMENTS=$(python -c '
-import sys
-pdb_file, chain_id = sys.argv[1:3]
-
-res_nums = set()
-with open(pdb_file, "r") as f:
-    for line in f:
-        if line.startswith("ATOM") and line[21] == chain_id:
-            try:
-                res_nums.add(int(line[22:26]))
-            except ValueError:
-                pass
-
-if not res_nums:
-    print("")
-    sys.exit()
-
-sorted_res = sorted(list(res_nums))
-
-segments = []
-start_res = sorted_res[0]
-end_res = sorted_res[0]
-
-for i in range(1, len(sorted_res)):
-    if sorted_res[i] == end_res + 1:
-        end_res = sorted_res[i]
-    else:
-        segments.append(f"{start_res}-{end_res}")
-        start_res = sorted_res[i]
-        end_res = sorted_res[i]
-
-segments.append(f"{start_res}-{end_res}")
-final_segments = [f"{chain_id}{s}" for s in segments]
-print("/".join(final_segments))
-' "$METTL1_TARGET_PDB" "$TARGET_CHAIN_ID")
-
-
-if [ -z "$TARGET_SEGMENTS" ]; then
-    echo "[ERROR] Could not determine any residue segments for chain '$TARGET_CHAIN_ID' in PDB '$METTL1_TARGET_PDB'. Exiting." | tee -a "$LOGFILE"
-    exit 1
+# 任务计划：热点组 × 长度区间 × 设计序号 -> 确定性任务清单（长度与种子预先算好）
+TASKS_JSONL="$OUTDIR/tasks.jsonl"
+TASKS_TSV="$OUTDIR/tasks.tsv"
+python scripts/plan_rfd3_tasks.py --params "$PARAMS" --out "$TASKS_JSONL" --tsv "$TASKS_TSV" 2>> "$LOGFILE"
+NTASKS=$(wc -l < "$TASKS_JSONL")
+echo "[INFO] Compiled $NTASKS design tasks into $TASKS_JSONL" | tee -a "$LOGFILE"
+[ "$NTASKS" -gt 0 ]
+
+# 断点续跑：ledger 中已记录且输出仍在的任务跳过；上次中断残留的 .partial / *.tmp 半成品直接清理
+LEDGER="$OUTDIR/ledger.jsonl"
+find "$OUTDIR" -name ".partial" -type d -prune -exec rm -rf {} + 2>/dev/null || true
+find "$OUTDIR" -name "*.pdb.*.tmp" -delete 2>/dev/null || true
+PENDING_TSV="$OUTDIR/tasks.pending.tsv"
+python scripts/ledger.py pending "$LEDGER" "$TASKS_TSV" > "$PENDING_TSV" 2>> "$LOGFILE"
+NPENDING=$(wc -l < "$PENDING_TSV")
+echo "[INFO] $NPENDING / $NTASKS tasks pending (ledger: $LEDGER)" | tee -a "$LOGFILE"
+if [ "$NPENDING" -eq 0 ]; then
+  # 上次可能在最后一个骨架记入 ledger 之后、建立索引之前中断：索引照常重建
+  python scripts/index_backbones.py --params "$PARAMS" > /dev/null 2>> "$LOGFILE" || true
+  echo "[OK] All RFdiffusion3 tasks already complete. Results in $OUTDIR" | tee -a "$LOGFILE"
+  exit 0
 fi
-echo "[INFO] Detected target residue segments for chain $TARGET_CHAIN_ID: $TARGET_SEGMENTS" | tee -a "$LOGFILE"
-
-readarray -t LENBINS < <(python scripts/get_param_yaml.py "$PARAMS" project.length_bins --json | python -c 'import sys,json; bins=json.load(sys.stdin);
-for b in bins: print("{},{}".format(b["min"], b["max"]))')
-echo "[INFO] lenbins=${LENBINS[*]}" | tee -a "$LOGFILE"
-[ ${#LENBINS[@]} -gt 0 ]
 
 # ========================== 核心逻辑修改部分 ==========================
-# 1. Read parameter 'compute.max_concurrent_rf3', interpreted as "number of tasks per GPU"
-# If not set, defaults to 1
-TASKS_PER_GPU=$(python scripts/get_param_yaml.py "$PARAMS" compute.max_concurrent_rf3 2>/dev/null || echo 1)
+# 1. 每个GPU的任务数：rfdd3.tasks_per_gpu（未设置时回退到 compute.max_concurrent_rf3，见 resolve_params.py）
+TASKS_PER_GPU="$P_RFDD3_TASKS_PER_GPU"
 
 # 2. 获取GPU列表和数量
-mapfile -t GPUS < <(python scripts/get_param_yaml.py "$PARAMS" compute.gpus --json | tr -d '[] ' | tr ',' '\n')
+read -r -a GPUS <<< "$P_COMPUTE_GPUS"
 NGPU=${#GPUS[@]}
 
 # 3. 计算总的并发任务上限 (MAXJ)
@@ -107,40 +83,44 @@ echo "[INFO] Total concurrency limit (MAXJ) calculated as: $MAXJ" | tee -a "$LOG
 
 # --- run_one 函数 ---
 run_one() {
-  local k="$1"
-  local OUTP="$2"
-  local LMIN="$3"
-  local LMAX="$4"
+  local n="$1"
+  local TASK_ID="$2"
+  local pref="$3"
+  local CONTIG_STR="$4"
   local HOTSTR="$5"
+  local IHASH="$6"
+  local SEED="$7"
 
   (
     set -e
-    # 当 NGPU > 0 时，此处的逻辑依然正确，它会轮流将任务分配给每个GPU
-    # 当 NGPU = 0 时，GPU_IDX 会是 -1，但 GPUS 数组为空，CUDA_VISIBLE_DEVICES 会被设置为空字符串，不影响CPU运行
-    local GPU_IDX=$(( (k-1) % NGPU ))
-    local GPU_ID="${GPUS[$GPU_IDX]:-}" # 使用默认值防止 NGPU=0 时出错
+    # 按全局启动序号轮流分配 GPU；NGPU = 0 时 CUDA_VISIBLE_DEVICES 为空，在 CPU 上运行
+    local GPU_ID=""
+    if [ "$NGPU" -gt 0 ]; then
+      GPU_ID="${GPUS[$(( (n-1) % NGPU ))]}"
+    fi
     export CUDA_VISIBLE_DEVICES="$GPU_ID"
-    
+
     if [ -n "$GPU_ID" ]; then
-        echo "[INFO] Running design $k on GPU $GPU_ID" >> "$LOGFILE"
+        echo "[INFO] Running design $TASK_ID on GPU $GPU_ID" >> "$LOGFILE"
     else
-        echo "[INFO] Running design $k on CPU" >> "$LOGFILE"
+        echo "[INFO] Running design $TASK_ID on CPU" >> "$LOGFILE"
     fi
 
-    local len
-    len=$(python -c 'import sys,random; seed,lmin,lmax=map(int,sys.argv[1:]); random.seed(100000+seed); print(random.randint(lmin,lmax))' "$k" "$LMIN" "$LMAX")
-    local pref="$OUTP/design_${k}_len${len}"
-
-    local CONTIG_STR="[${TARGET_SEGMENTS}/0 ${len}-${len}/0]"
-    echo "[INFO] Binder Design. Target Segments: ${TARGET_SEGMENTS}, Binder Length: ${len}, Contig: ${CONTIG_STR}" >> "$LOGFILE"
+    echo "[INFO] Binder Design. Contig: ${CONTIG_STR}" >> "$LOGFILE"
     echo "[INFO] Guiding interface towards hotspots: ${HOTSTR}" >> "$LOGFILE"
 
     local GUIDING_POTENTIALS="['type:interface_ncontacts','type:binder_zero_dG']"
-    
+    # 先写到同目录下的 .partial/，成功后原子 rename 到最终位置并记入 ledger
+    # 种子取自任务清单：inference.deterministic 按 design_startnum 播种（torch/numpy/random，与 rfd3_worker.py 相同），
+    # 两种执行模式对同一清单生成相同的骨架；输出文件名随之为 <prefix>_<seed>.pdb，rename 时改回 _0
+    local part
+    part="$(dirname "$pref")/.partial/$(basename "$pref")"
+    mkdir -p "$(dirname "$part")"
+
     set +e
     python "$RFDIFFUSION3_REPO/scripts/run_inference.py" \
       inference.input_pdb="$METTL1_TARGET_PDB" \
-      inference.output_prefix="$pref" \
+      inference.output_prefix="$part" \
       inference.num_designs=1 \
       "contigmap.contigs=${CONTIG_STR}" \
       "ppi.hotspot_res=[$HOTSTR]" \
@@ -151,7 +131,9 @@ run_one() {
       inference.radius="$NEI_RAD" \
       diffuser.T="$T" \
       diffuser.schedule="$DIFFUSION_SCHEDULE" \
-      model.version="$MODEL_VERSION" >> "$LOGFILE" 2>&1
+      model.version="$MODEL_VERSION" \
+      inference.deterministic=True \
+      inference.design_startnum="$SEED" >> "$LOGFILE" 2>&1
     rc=$?
     set -e
 
@@ -160,7 +142,7 @@ run_one() {
       sleep 2
       python "$RFDIFFUSION3_REPO/scripts/run_inference.py" \
         inference.input_pdb="$METTL1_TARGET_PDB" \
-        inference.output_prefix="$pref" \
+        inference.output_prefix="$part" \
         inference.num_designs=1 \
         "contigmap.contigs=${CONTIG_STR}" \
         "ppi.hotspot_res=[$HOTSTR]" \
@@ -171,38 +153,45 @@ run_one() {
         inference.radius="$NEI_RAD" \
         diffuser.T="$T" \
         diffuser.schedule="$DIFFUSION_SCHEDULE" \
-        model.version="$MODEL_VERSION" >> "$LOGFILE" 2>&1 || true
+        model.version="$MODEL_VERSION" \
+        inference.deterministic=True \
+        inference.design_startnum="$SEED" >> "$LOGFILE" 2>&1 || true
+    fi
+
+    if [ -s "${part}_${SEED}.pdb" ]; then
+      if [ -f "${part}_${SEED}.trb" ]; then mv -f "${part}_${SEED}.trb" "${pref}_0.trb"; fi
+      mv -f "${part}_${SEED}.pdb" "${pref}_0.pdb"
+      python scripts/ledger.py record "$LEDGER" "$TASK_ID" "$IHASH" "${pref}_0.pdb"
+    else
+      echo "[WARN] No output for $TASK_ID; will be retried on the next run" >> "$LOGFILE"
     fi
   ) >> "$LOGFILE" 2>&1
 }
 
 export -f run_one
-export RFDIFFUSION3_REPO METTL1_TARGET_PDB MODEL_ONLY NEI_RAD T DIFFUSION_SCHEDULE MODEL_VERSION LOGFILE NGPU GPUS TARGET_CHAIN_ID TARGET_SEGMENTS
-
-# 外循环与并发逻辑
-python -c 'import json,sys; d=json.load(open(sys.argv[1]));
-[print(i, S["hotspot_res_str"], S["hotspot_count"]) for i,S in enumerate(d)]' "$HOTSETS_JSON" | while read -r IDX HOTSTR NOS; do
-  HOTSTR_CONTIG=$(echo "$HOTSTR" | tr -d ':')
-  for lb in "${LENBINS[@]}"; do
-    LMIN=${lb%,*}; LMAX=${lb#*,}
-    OUTP="$OUTDIR/batch-${BATCH_ID}_set-${IDX}_hs-${NOS}_len-${LMIN}-${LMAX}"
-    mkdir -p "$OUTP"
-
-    echo "[INFO] Starting concurrent designs for set $IDX, len $LMIN-$LMAX (DESIGNS_PER_COMBO: $DESIGNS_PER_COMBO)" | tee -a "$LOGFILE"
-    
-    # 这个循环和并发控制逻辑本身是正确的，现在它将使用我们新计算的 MAXJ
-    for (( k=1; k<=$DESIGNS_PER_COMBO; k++ )); do
-      # 当后台任务数量达到 MAXJ 上限时，等待任何一个任务完成
-      while [[ $(jobs -p | wc -l) -ge $MAXJ ]]; do
-        wait -n
-      done
-      # 启动一个新任务到后台
-      run_one "$k" "$OUTP" "$LMIN" "$LMAX" "$HOTSTR_CONTIG" &
-    done
-
-    echo "[INFO] All designs launched for set $IDX, len $LMIN-$LMAX. Waiting for completion..." | tee -a "$LOGFILE"
-    wait
+export RFDIFFUSION3_REPO METTL1_TARGET_PDB MODEL_ONLY NEI_RAD T DIFFUSION_SCHEDULE MODEL_VERSION LOGFILE NGPU GPUS TARGET_CHAIN_ID LEDGER
+
+if [ "$P_RFDD3_PERSISTENT_WORKERS" = "true" ]; then
+  # 常驻 worker 模式：rfd3_worker.py 在每个 GPU 槽位加载一次模型后按队列执行全部任务
+  python scripts/rfd3_worker.py --params "$PARAMS" --tasks "$TASKS_JSONL" --target_pdb "$METTL1_TARGET_PDB" --log "$LOGFILE" --ledger "$LEDGER" || \
+    echo "[WARN] Some persistent-worker tasks failed; see $LOGFILE" | tee -a "$LOGFILE"
+  python scripts/index_backbones.py --params "$PARAMS" > /dev/null 2>> "$LOGFILE" || true
+  echo "[OK] All RFdiffusion3 tasks completed. Results in $OUTDIR" | tee -a "$LOGFILE"
+  exit 0
+fi
+
+# 全局调度：按清单顺序持续填满 MAXJ 个槽位，组合之间没有屏障
+N=0
+while IFS=$'\t' read -r TASK_ID PREF CONTIG_STR HOTSTR LEN SEED IHASH; do
+  while [[ $(jobs -p | wc -l) -ge $MAXJ ]]; do
+    wait -n || true
   done
-done
+  N=$((N+1))
+  run_one "$N" "$TASK_ID" "$PREF" "$CONTIG_STR" "$HOTSTR" "$IHASH" "$SEED" &
+done < "$PENDING_TSV"
+echo "[INFO] All $N designs launched. Waiting for completion..." | tee -a "$LOGFILE"
+wait
+# 骨架清单（链、长度、区段、热点组、长度区间、固定位置），供第 4 阶段及之后直接读取
+python scripts/index_backbones.py --params "$PARAMS" > /dev/null 2>> "$LOGFILE" || true
 
 echo "[OK] All RFdiffusion3 tasks completed. Results in $OUTDIR" | tee -a "$LOGFILE"
@@ -0,0 +1,157 @@
+# scripts/03b_prefilter_backbones.py
+# RFdiffusion3 与 ProteinMPNN 之间的几何预筛：对 rfdiffusion3_raw 下每个骨架计算
+#   clashes     : 靶点–binder 重原子距离 < clash_dist 的原子对数（KDTree 计数）
+#   hotspot_sat : 所属热点组中，CA 距 binder 任一 CA < hotspot_dist 的热点比例
+#   rg          : binder CA 回转半径，上限 rg_coeff * L^0.38
+#   iface_ca    : CA 距靶点任一 CA < interface_ca_dist 的 binder 残基数
+# 结果写入 prefilter.csv，通过者写入 prefilter_pass.txt 供第 4 阶段读取（prefilter.enabled 时）。
+# 靶点/binder 沿用 get_chain_info 的约定：最长链为靶点，次长链为 binder。
+# 热点按序号映射：骨架靶点链残基与 mettl1_target.pdb 的标准残基一一按顺序对应（数目一致时），否则按原编号。
+import os, re, sys, csv, glob, json, argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from utils import cached_structure, struct_cache_dir
+from resolve_params import load_params
+from index_backbones import load_manifest
+
+SET_RE = re.compile(r"_set-(\d+)_")
+NUM_RE = re.compile(r"-?\d+")
+
+def target_and_binder(sa):
+    lens = sorted(((sa.residue_count(c), c) for c in sa.chain_ids()), reverse=True)
+    if len(lens) < 2:
+        return None, None
+    return lens[0][1], lens[1][1]
+
+def hotspot_numbers(hotset, ref_nums, out_nums):
+    """热点 "A:143" / "A143" -> 骨架靶点链上的残基编号。"""
+    nums = [int(NUM_RE.search(h.split(":")[-1]).group()) for h in hotset.get("hotspots", [])]
+    if len(ref_nums) == len(out_nums):
+        pos = {n: i for i, n in enumerate(ref_nums)}
+        return [int(out_nums[pos[n]]) for n in nums if n in pos]
+    return nums
+
+def backbone_metrics(sa, hotset, ref_nums, cfg):
+    """单个骨架的全部指标；坐标只取一次，所有距离判断都是 KDTree 批量查询。"""
+    tcid, bcid = target_and_binder(sa)
+    if tcid is None:
+        return None
+    heavy = sa.heavy_mask()
+    t_all = np.asarray(sa.coords[sa.chain_mask(tcid) & heavy], dtype=np.float64)
+    b_all = np.asarray(sa.coords[sa.chain_mask(bcid) & heavy], dtype=np.float64)
+    t_ca = sa.atom_coords(tcid, "CA")
+    b_ca = sa.atom_coords(bcid, "CA")
+    if len(b_ca) == 0 or len(t_ca) == 0:
+        return None
+
+    t_tree, b_tree = cKDTree(t_all), cKDTree(b_all)
+    clashes = int(t_tree.count_neighbors(b_tree, np.nextafter(cfg["clash_dist"], 0)))  # 严格小于
+
+    t_ca_tree, b_ca_tree = cKDTree(t_ca), cKDTree(b_ca)
+    d_to_target, _ = t_ca_tree.query(b_ca, k=1, distance_upper_bound=cfg["interface_ca_dist"])
+    iface_ca = int(np.isfinite(d_to_target).sum())
+
+    out_nums = sa.res_seq[sa.residue_mask(tcid)].astype(int)
+    hot = hotspot_numbers(hotset, ref_nums, out_nums)
+    t_ca_nums = sa.res_seq[sa.res_index[sa.chain_mask(tcid) & (sa.atom_name == "CA")]].astype(int)
+    hs_ca = t_ca[np.isin(t_ca_nums, hot)]
+    if not hot:
+        hotspot_sat = 1.0  # 骨架不属于任何已知热点组时不做该项判断
+    elif len(hs_ca):
+        d_hs, _ = b_ca_tree.query(hs_ca, k=1, distance_upper_bound=cfg["hotspot_dist"])
+        hotspot_sat = float(np.isfinite(d_hs).mean())
+    else:
+        hotspot_sat = 0.0
+
+    L = len(b_ca)
+    rg = float(np.sqrt(((b_ca - b_ca.mean(axis=0)) ** 2).sum(axis=1).mean()))
+    rg_max = cfg["rg_coeff"] * L ** 0.38
+
+    fails = [k for k, bad in (("clashes", clashes > cfg["max_clashes"]),
+                              ("hotspot_sat", hotspot_sat < cfg["min_hotspot_fraction"]),
+                              ("rg", rg > rg_max),
+                              ("iface_ca", iface_ca < cfg["min_interface_ca"])) if bad]
+    return dict(binder_len=L, clashes=clashes, hotspot_sat=round(hotspot_sat, 3), rg=round(rg, 2),
+                rg_max=round(rg_max, 2), iface_ca=iface_ca, fail_reasons=";".join(fails), pass_prefilter=not fails)
+
+def _worker(args):
+    pdb, hotset, ref_nums, cfg, cache_dir = args
+    try:
+        return pdb, backbone_metrics(cached_structure(pdb, cache_dir), hotset, ref_nums, cfg)
+    except Exception as e:
+        print(f"[WARN] prefilter failed for {pdb}: {e}", file=sys.stderr)
+        return pdb, None
+
+def list_backbones(rfdir):
+    """优先读骨架清单（index_backbones.py），没有清单时扫描目录。"""
+    manifest = load_manifest(rfdir)
+    if manifest:
+        return sorted(manifest)
+    return sorted(p for p in glob.glob(os.path.join(rfdir, "**", "*.pdb"), recursive=True)
+                  if "/traj/" not in p and "/.partial/" not in p)
+
+def parse_args():
+    p = argparse.ArgumentParser(description="RFdiffusion3 骨架几何预筛（clash / 热点满足率 / Rg / 界面 CA 数）")
+    p.add_argument("--params", required=True, help="config/params.yaml")
+    p.add_argument("--processes", type=int, default=None, help="并行进程数（默认 CPU 核数）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    P = load_params(args.params)
+    cfg = P["prefilter"]
+    rfdir = os.path.join(P["paths"]["work_dir"], "rfdiffusion3_raw")
+    targets_dir = P["paths"]["targets_dir"]
+    with open(os.path.join(targets_dir, "hotspots_sets.json")) as f:
+        hotsets = json.load(f)
+    with open(os.path.join(targets_dir, "interface_candidates.json")) as f:
+        cand = json.load(f)
+    cache_dir = struct_cache_dir(P)
+    ref = cached_structure(cand["mettl1_target_pdb"], cache_dir)
+    ref_nums = ref.res_seq[ref.residue_mask(cand["mettl1_chain_id"])].astype(int).tolist()
+
+    pdbs = list_backbones(rfdir)
+    tasks = []
+    for pdb in pdbs:
+        m = SET_RE.search(os.path.basename(os.path.dirname(pdb)))
+        hotset = hotsets[int(m.group(1))] if m and int(m.group(1)) < len(hotsets) else {"hotspots": []}
+        tasks.append((pdb, hotset, ref_nums, cfg, cache_dir))
+    print(f"[INFO] prefilter: {len(tasks)} backbones under {rfdir}")
+
+    if args.processes == 1 or len(tasks) <= 1:
+        results = [_worker(t) for t in tasks]
+    else:
+        from multiprocessing import Pool
+        with Pool(args.processes) as pool:
+            results = pool.map(_worker, tasks, chunksize=max(1, len(tasks) // (4 * (args.processes or os.cpu_count() or 1))))
+
+    cols = ["pdb", "binder_len", "clashes", "hotspot_sat", "rg", "rg_max", "iface_ca", "fail_reasons", "pass_prefilter"]
+    passed = []
+    rejects = dict(error=0, clashes=0, hotspot_sat=0, rg=0, iface_ca=0)
+    tmp_csv = os.path.join(rfdir, "prefilter.csv.tmp")
+    with open(tmp_csv, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=cols)
+        w.writeheader()
+        for pdb, m in results:
+            if m is None:
+                w.writerow(dict(pdb=pdb, fail_reasons="error", pass_prefilter=False))
+                rejects["error"] += 1
+                continue
+            w.writerow(dict(pdb=pdb, **m))
+            if m["pass_prefilter"]:
+                passed.append(pdb)
+            for k in filter(None, m["fail_reasons"].split(";")):
+                rejects[k] += 1
+    os.replace(tmp_csv, os.path.join(rfdir, "prefilter.csv"))
+    tmp_pass = os.path.join(rfdir, "prefilter_pass.txt.tmp")
+    with open(tmp_pass, "w") as f:
+        f.writelines(p + "\n" for p in passed)
+    os.replace(tmp_pass, os.path.join(rfdir, "prefilter_pass.txt"))
+    print(f"[OK] prefilter: {len(passed)}/{len(results)} backbones passed -> {rfdir}/prefilter_pass.txt")
+    # 各项淘汰数（一个骨架可同时不满足多项）
+    print(f"[INFO] prefilter rejects: clashes>{cfg['max_clashes']}: {rejects['clashes']}, "
+          f"hotspot_sat<{cfg['min_hotspot_fraction']}: {rejects['hotspot_sat']}, rg>{cfg['rg_coeff']}*L^0.38: {rejects['rg']}, "
+          f"iface_ca<{cfg['min_interface_ca']}: {rejects['iface_ca']}, unreadable: {rejects['error']}")
+
+if __name__ == "__main__":
+    main()
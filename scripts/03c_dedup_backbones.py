@@ -0,0 +1,109 @@
+# scripts/03c_dedup_backbones.py
+# 骨架结构去重（scale.dedup_rmsd_threshold，<= 0 时关闭）：
+#   1. 每个骨架的靶点 CA 用批量 Kabsch 叠合到同一参考靶点坐标系，binder CA 随之变换
+#   2. 按 (靶点长度, binder 长度) 分桶；桶内在靶点坐标系下直接计算 binder CA RMSD（不再单独叠合 binder，结合姿态不同即视为不同）
+#   3. 贪心 leader 聚类：按预筛质量排序，未归类的骨架成为代表，阈值内的其它骨架并入其簇
+# 粗索引：RMSD <= t 必有 质心距离 <= t 且 |Rg 差| <= t，先用质心 KDTree 取候选、再按 Rg 过滤，只对候选算 RMSD，不做全对比较。
+# 输入为 prefilter_pass.txt（存在时）或全部骨架；输出 dedup_pass.txt（代表）与 dedup_clusters.json（代表 -> 成员）。
+import os, sys, csv, json, argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from utils import cached_structure, struct_cache_dir, kabsch_batch
+from resolve_params import load_params
+
+def load_ca(pdb, cache_dir):
+    """(靶点 CA, binder CA)；链的约定同 get_chain_info：最长链为靶点，次长链为 binder。"""
+    sa = cached_structure(pdb, cache_dir)
+    lens = sorted(((sa.residue_count(c), c) for c in sa.chain_ids()), reverse=True)
+    if len(lens) < 2:
+        return None
+    return sa.atom_coords(lens[0][1], "CA"), sa.atom_coords(lens[1][1], "CA")
+
+def greedy_cluster(binders, threshold):
+    """binders: (n, L, 3)，已在共同靶点坐标系中、按优先级排好序。返回每个骨架所属代表的下标。"""
+    n = len(binders)
+    cent = binders.mean(axis=1)
+    rg = np.sqrt(((binders - cent[:, None, :]) ** 2).sum(axis=2).mean(axis=1))
+    tree = cKDTree(cent)
+    owner = np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        if owner[i] >= 0:
+            continue
+        owner[i] = i
+        cand = np.asarray(tree.query_ball_point(cent[i], threshold), dtype=np.int64)
+        cand = cand[(owner[cand] < 0) & (np.abs(rg[cand] - rg[i]) <= threshold)]
+        if len(cand) == 0:
+            continue
+        rmsd = np.sqrt(((binders[cand] - binders[i]) ** 2).sum(axis=2).mean(axis=1))
+        owner[cand[rmsd <= threshold]] = i
+    return owner
+
+def quality_order(pdbs, prefilter_csv):
+    """预筛指标更好的骨架优先成为代表：热点满足率高、clash 少、界面 CA 多。"""
+    if not os.path.exists(prefilter_csv):
+        return pdbs
+    with open(prefilter_csv) as f:
+        m = {r["pdb"]: r for r in csv.DictReader(f) if r.get("clashes")}
+    def key(p):
+        r = m.get(p)
+        if r is None:
+            return (1, 0.0, 0, 0)
+        return (0, -float(r["hotspot_sat"]), int(r["clashes"]), -int(r["iface_ca"]))
+    return sorted(pdbs, key=key)
+
+def parse_args():
+    p = argparse.ArgumentParser(description="RFdiffusion3 骨架结构去重（靶点坐标系下 binder CA RMSD 贪心聚类）")
+    p.add_argument("--params", required=True, help="config/params.yaml")
+    p.add_argument("--input", default=None, help="骨架列表文件（默认 prefilter_pass.txt，不存在时为全部骨架）")
+    p.add_argument("--threshold", type=float, default=None, help="覆盖 scale.dedup_rmsd_threshold（Å）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    P = load_params(args.params)
+    threshold = args.threshold if args.threshold is not None else P["scale"]["dedup_rmsd_threshold"]
+    rfdir = os.path.join(P["paths"]["work_dir"], "rfdiffusion3_raw")
+    cache_dir = struct_cache_dir(P)
+
+    src = args.input or os.path.join(rfdir, "prefilter_pass.txt")
+    if os.path.exists(src):
+        with open(src) as f:
+            pdbs = [l.strip() for l in f if l.strip()]
+    else:
+        from importlib import import_module
+        pdbs = import_module("03b_prefilter_backbones").list_backbones(rfdir)
+    pdbs = quality_order(pdbs, os.path.join(rfdir, "prefilter.csv"))
+
+    clusters = {}
+    if threshold <= 0:
+        clusters = {p: [p] for p in pdbs}
+    else:
+        buckets = {}
+        for p in pdbs:
+            ca = load_ca(p, cache_dir)
+            if ca is None or len(ca[0]) < 3 or len(ca[1]) == 0:
+                print(f"[WARN] dedup: cannot read target/binder CA from {p}; kept as is", file=sys.stderr)
+                clusters[p] = [p]
+                continue
+            buckets.setdefault((len(ca[0]), len(ca[1])), []).append((p, ca[0], ca[1]))
+        for (nt, nb), items in sorted(buckets.items()):
+            names = [x[0] for x in items]
+            targets = np.stack([x[1] for x in items])
+            binders = np.stack([x[2] for x in items])
+            R, t = kabsch_batch(targets, targets[0])
+            binders = np.einsum("nmj,nij->nmi", binders, R) + t[:, None, :]
+            owner = greedy_cluster(binders, threshold)
+            for i, o in enumerate(owner):
+                clusters.setdefault(names[o], []).append(names[i])
+    keep = [p for p in pdbs if p in clusters]
+
+    with open(os.path.join(rfdir, "dedup_pass.txt.tmp"), "w") as f:
+        f.writelines(p + "\n" for p in keep)
+    os.replace(os.path.join(rfdir, "dedup_pass.txt.tmp"), os.path.join(rfdir, "dedup_pass.txt"))
+    with open(os.path.join(rfdir, "dedup_clusters.json.tmp"), "w") as f:
+        json.dump(clusters, f, indent=1)
+    os.replace(os.path.join(rfdir, "dedup_clusters.json.tmp"), os.path.join(rfdir, "dedup_clusters.json"))
+    print(f"[OK] dedup (RMSD <= {threshold} Å): {len(keep)}/{len(pdbs)} representative backbones -> {rfdir}/dedup_pass.txt")
+
+if __name__ == "__main__":
+    main()
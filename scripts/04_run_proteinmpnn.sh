@@ -5,27 +5,40 @@ set -euo pipefail
 # 这个脚本假定您已经在包含了 GNU Parallel 的 conda 环境中运行
 # 例如:
 # conda activate your_env
-# bash scripts/04_run_proteinmpnn.sh config/params.yaml
+# bash scripts/04_run_proteinmpnn.sh config/params.yaml [initial|refine]
+# refine 档（由 scripts/run_funnel.py 调用）只处理 funnel/refine_backbones.txt 中的入围骨架，
+# 每个骨架采样 mpnn_num_seq_per_backbone_refine 条，输出到 mpnn_seqs_refine/
 # ==============================================================================
 
 PARAMS=$1
-MPNN=$(python scripts/get_param_yaml.py $PARAMS paths.proteinmpnn)
-RFDIR=$(python scripts/get_param_yaml.py $PARAMS paths.work_dir)/rfdiffusion3_raw
-OUTDIR=$(python scripts/get_param_yaml.py $PARAMS paths.work_dir)/mpnn_seqs
+TIER=${2:-initial}
+source scripts/load_params.sh
+load_params "$PARAMS"
+MPNN="$P_PATHS_PROTEINMPNN"
+RFDIR="$P_PATHS_WORK_DIR/rfdiffusion3_raw"
+case "$TIER" in
+  initial) OUTDIR="$P_PATHS_WORK_DIR/mpnn_seqs" ;;
+  refine)  OUTDIR="$P_PATHS_WORK_DIR/mpnn_seqs_refine" ;;
+  *) echo "[ERROR] unknown tier '$TIER' (expected initial or refine)" >&2; exit 1 ;;
+esac
 LOGFILE="$OUTDIR/log.txt"
-mkdir -p "$OUTDIR"; : > "$LOGFILE"
+mkdir -p "$OUTDIR"
+# 追加而非截断：断点续跑时保留上一次运行的日志
+echo "===== $(date '+%F %T') stage 4 ($TIER) run started (params=$PARAMS) =====" >> "$LOGFILE"
+LEDGER="$OUTDIR/ledger.jsonl"
 
-NUMSEQ_INIT=$(python scripts/get_param_yaml.py $PARAMS scale.mpnn_num_seq_per_backbone_initial)
-SEED=$(python scripts/get_param_yaml.py $PARAMS project.seed)
+NUMSEQ_INIT="$P_SCALE_MPNN_NUM_SEQ_PER_BACKBONE_INITIAL"
+SEED="$P_PROJECT_SEED"
+if [ "$TIER" = "refine" ]; then
+  NUMSEQ_INIT="$P_SCALE_MPNN_NUM_SEQ_PER_BACKBONE_REFINE"
+  SEED=$(( P_PROJECT_SEED + 1 ))  # 换种子，避免重复采到初筛已有的序列
+fi
 
 # 函数：发现可用的GPU
 discover_gpus() {
   local arr=()
-  local cfg
-  cfg=$(python scripts/get_param_yaml.py "$PARAMS" compute.gpus --json 2>/dev/null || echo "")
-  if [ -n "$cfg" ] && echo "$cfg" | grep -q '[0-9A-Za-z]'; then
-    cfg=$(echo "$cfg" | tr -d '[]"' | tr ',' ' ')
-    read -r -a arr <<< "$cfg"
+  if [ -n "$P_COMPUTE_GPUS" ]; then
+    read -r -a arr <<< "$P_COMPUTE_GPUS"
   elif [ -n "${CUDA_VISIBLE_DEVICES:-}" ]; then
     IFS=',' read -r -a arr <<< "$CUDA_VISIBLE_DEVICES"
   elif command -v nvidia-smi >/dev/null 2>&1; then
@@ -36,7 +49,7 @@ discover_gpus() {
 
 # ========================== 核心逻辑修正部分 ==========================
 # 1. 读取参数 'compute.max_concurrent_mpnn'，作为“每个GPU希望运行的任务数”
-JOBS_PER_GPU=$(python scripts/get_param_yaml.py "$PARAMS" compute.max_concurrent_mpnn 2>/dev/null || echo "1")
+JOBS_PER_GPU="$P_COMPUTE_MAX_CONCURRENT_MPNN"
 
 # 2. 发现GPU并获取数量
 mapfile -t GPUS < <(discover_gpus)
@@ -61,6 +74,9 @@ process_pdb() {
     set -e
     local gpu="$1"
     local pdb="$2"
+    local ihash="$3"
+    local name="$4"
+    local binder_chain="${5:-}"
     local log_prefix
 
     if [ -n "$gpu" ]; then
@@ -71,27 +87,28 @@ process_pdb() {
       unset CUDA_VISIBLE_DEVICES
     fi
 
-    echo "$log_prefix $(date '+%F %T') Processing $(basename "$pdb")..."
-
-    local outpref="$OUTDIR/$(basename "${pdb%.pdb}")"
-    mkdir -p "$outpref"
+    echo "$log_prefix $(date '+%F %T') Processing $name..."
 
-    local chain_info
-    chain_info=$(python scripts/get_chain_info.py "$pdb")
+    # 输出名用骨架清单中的唯一名（<组合目录>__design_<k>_len<L>_0），不同组合下的同名骨架不会互相覆盖
+    local outpref="$OUTDIR/$name"
+    # 先写到 .partial/ 下的临时目录，成功后整体 rename 为最终目录并记入 ledger
+    local part="$OUTDIR/.partial/$name"
+    rm -rf "$part"; mkdir -p "$part"
 
-    if [ -z "$chain_info" ] || [ "$chain_info" = "SKIP" ]; then
+    # binder 链取自骨架清单（index_backbones.py）；清单中 status=SKIP 的骨架此列为空
+    if [ -z "$binder_chain" ]; then
       echo "$log_prefix Skip $pdb (chain_info issue)"
       return 0
     fi
-
-    local binder_chain
-    binder_chain=$(echo "$chain_info" | awk '{print $2}' | cut -d' ' -f1)
     echo "$log_prefix Binder chain to design: '$binder_chain'"
 
+    # ProteinMPNN 以 PDB 文件名命名输出，经同名软链接传入
+    mkdir -p "$part/in"
+    ln -s "$(realpath "$pdb")" "$part/in/$name.pdb"
     python "$MPNN" \
-      --pdb_path "$pdb" \
+      --pdb_path "$part/in/$name.pdb" \
       --pdb_path_chains "$binder_chain" \
-      --out_folder "$outpref" \
+      --out_folder "$part" \
       --num_seq_per_target "$NUMSEQ_INIT" \
       --sampling_temp "0.35" \
       --seed "$SEED"
@@ -100,6 +117,9 @@ process_pdb() {
     if [ $rc -ne 0 ]; then
       echo "$log_prefix ERROR: MPNN failed for $pdb (rc=$rc)"
     else
+      rm -rf "$part/in" "$outpref"
+      mv "$part" "$outpref"
+      python scripts/ledger.py record "$LEDGER" "$pdb" "$ihash" "$outpref/seqs/$name.fa"
       echo "$log_prefix OK: MPNN for $pdb"
     fi
     return $rc
@@ -108,7 +128,7 @@ process_pdb() {
 
 # 导出函数和变量，让 parallel 可以访问它们
 export -f process_pdb
-export OUTDIR MPNN NUMSEQ_INIT SEED LOGFILE NGPU
+export OUTDIR MPNN NUMSEQ_INIT SEED LOGFILE NGPU LEDGER
 
 # ========================== 传递GPU列表的关键修正 ==========================
 # 将 GPUS 数组转换为一个简单的、空格分隔的字符串并导出。
@@ -118,20 +138,100 @@ export GPUS_STR="${GPUS[*]}"
 # ========================================================================
 
 
-# 查找所有需要处理的PDB文件
-mapfile -t PDBS < <(find "$RFDIR" -name "*.pdb" -not -path "*/traj/*" | sort)
+# 骨架清单：一次性（增量）建索引，骨架列表与 binder 链都从清单读取，不再逐个解析 PDB
+MANIFEST=$(python scripts/index_backbones.py --params "$PARAMS" 2>> "$LOGFILE")
+
+# 查找所有需要处理的PDB文件；prefilter.enabled 时先做几何预筛，只处理 prefilter_pass.txt 中的骨架
+if [ "$TIER" = "refine" ]; then
+  REFINE_LIST="$P_PATHS_WORK_DIR/funnel/refine_backbones.txt"
+  if [ ! -f "$REFINE_LIST" ]; then
+    echo "[ERROR] $REFINE_LIST not found; run scripts/run_funnel.py (select step) first" | tee -a "$LOGFILE"
+    exit 1
+  fi
+  mapfile -t PDBS < "$REFINE_LIST"
+elif [ "$P_PREFILTER_ENABLED" = "true" ]; then
+  python scripts/03b_prefilter_backbones.py --params "$PARAMS" 2>&1 | tee -a "$LOGFILE"
+  mapfile -t PDBS < "$RFDIR/prefilter_pass.txt"
+else
+  mapfile -t PDBS < <(awk -F'\t' 'NR > 1 {print $1}' "$MANIFEST")
+fi
+# 结构去重（scale.dedup_rmsd_threshold > 0）：靶点坐标系下 binder CA RMSD 贪心聚类，每簇只保留一个代表
+if [ "$TIER" = "initial" ] && [ "${#PDBS[@]}" -gt 0 ] && python -c "import sys; sys.exit(not float(sys.argv[1]) > 0)" "$P_SCALE_DEDUP_RMSD_THRESHOLD"; then
+  python scripts/03c_dedup_backbones.py --params "$PARAMS" --input <(printf "%s\n" "${PDBS[@]}") 2>&1 | tee -a "$LOGFILE"
+  mapfile -t PDBS < "$RFDIR/dedup_pass.txt"
+fi
 if [ "${#PDBS[@]}" -eq 0 ]; then
   echo "[WARN] No PDBs found under $RFDIR" | tee -a "$LOGFILE"
   exit 0
 fi
 
+# 断点续跑：以 骨架内容 + 采样参数 为 input_hash，ledger 中已完成且 .fa 仍在的骨架跳过；清理上次中断的半成品
+rm -rf "$OUTDIR/.partial"
+# 旧版按骨架文件名命名的输出目录（不同组合下的同名骨架互相覆盖）不对应清单中任何 name：删除，ledger 中指向它们的骨架随之重新生成
+mapfile -t STALE < <(awk -F'\t' 'NR == FNR {if (FNR > 1) n[$2] = 1; next} !($0 in n)' "$MANIFEST" \
+  <(find "$OUTDIR" -mindepth 1 -maxdepth 1 -type d ! -name '.*' -printf '%f\n'))
+if [ "${#STALE[@]}" -gt 0 ]; then
+  echo "[WARN] Removing ${#STALE[@]} output dirs not named after any manifest backbone (e.g. ${STALE[0]})" | tee -a "$LOGFILE"
+  for d in "${STALE[@]}"; do rm -rf "${OUTDIR:?}/$d"; done
+fi
+mapfile -t PENDING < <(printf "%s\n" "${PDBS[@]}" | python scripts/ledger.py pending-files "$LEDGER" "$NUMSEQ_INIT,$SEED,0.35" 2>> "$LOGFILE")
+echo "[INFO] ${#PENDING[@]} / ${#PDBS[@]} backbones pending (ledger: $LEDGER)" | tee -a "$LOGFILE"
+# 每行追加清单中的唯一名与 binder 链：骨架\tinput_hash\tname\tbinder_chain
+mapfile -t PENDING < <(printf "%s\n" "${PENDING[@]}" | awk -F'\t' -v OFS='\t' 'NR == FNR {if (FNR > 1) {n[$1] = $2; b[$1] = $8}; next} $1 != "" {print $1, $2, n[$1], b[$1]}' "$MANIFEST" -)
+if [ "${#PENDING[@]}" -eq 0 ]; then
+  echo "[OK] All ProteinMPNN tasks already complete. ProteinMPNN sequences -> $OUTDIR" | tee -a "$LOGFILE"
+  exit 0
+fi
+
+# 批量模式：待处理骨架打包为 NGPU × mpnn_shards_per_gpu 个分片，每个分片一个 ProteinMPNN 进程，
+# 输入为 parsed-chain / chain_ids / fixed_positions JSONL，结果回收为与逐个模式相同的 <name>/seqs/<name>.fa
+if [ "$P_COMPUTE_MPNN_BATCHED" = "true" ]; then
+  SHARD_ROOT="$OUTDIR/.partial/shards"
+  NSHARDS=$(( (NGPU > 0 ? NGPU : 1) * P_COMPUTE_MPNN_SHARDS_PER_GPU ))
+  mapfile -t SHARDS < <(printf "%s\n" "${PENDING[@]}" | python scripts/mpnn_batch.py shard --params "$PARAMS" --out "$SHARD_ROOT" --shards "$NSHARDS" 2>> "$LOGFILE")
+  echo "[INFO] Batched ProteinMPNN: ${#PENDING[@]} backbones in ${#SHARDS[@]} shards" | tee -a "$LOGFILE"
+
+  run_shard() {
+    local gpu="$1" shard="$2"
+    (
+      if [ -n "$gpu" ]; then export CUDA_VISIBLE_DEVICES="$gpu"; else unset CUDA_VISIBLE_DEVICES; fi
+      echo "[GPU ${gpu:-CPU}] $(date '+%F %T') Processing $(basename "$shard") ($(wc -l < "$shard/members.tsv") backbones)..."
+      python "$MPNN" \
+        --jsonl_path "$shard/parsed.jsonl" \
+        --chain_id_jsonl "$shard/chain_ids.jsonl" \
+        --fixed_positions_jsonl "$shard/fixed_positions.jsonl" \
+        --out_folder "$shard/out" \
+        --num_seq_per_target "$NUMSEQ_INIT" \
+        --sampling_temp "0.35" \
+        --seed "$SEED" && \
+      python scripts/mpnn_batch.py collect "$shard" "$OUTDIR" "$LEDGER"
+    ) >> "$LOGFILE" 2>&1
+  }
+
+  SHARD_PIDS=()
+  for i in "${!SHARDS[@]}"; do
+    gpu=""
+    [ "$NGPU" -gt 0 ] && gpu="${GPUS[$(( i % NGPU ))]}"
+    run_shard "$gpu" "${SHARDS[$i]}" &
+    SHARD_PIDS+=($!)
+  done
+  NFAIL=0
+  for pid in "${SHARD_PIDS[@]}"; do wait "$pid" || NFAIL=$((NFAIL + 1)); done
+  if [ "$NFAIL" -gt 0 ]; then
+    echo "[WARN] $NFAIL / ${#SHARDS[@]} shards failed; rerun to retry the missing backbones" | tee -a "$LOGFILE"
+  fi
+  echo "[OK] Batched ProteinMPNN finished. ProteinMPNN sequences -> $OUTDIR" | tee -a "$LOGFILE"
+  exit 0
+fi
+
 # ==============================================================================
 # ====================== 使用 GNU Parallel 的并行逻辑 (已修正) ================
 # ==============================================================================
-echo "[INFO] Starting concurrent processing of ${#PDBS[@]} PDBs using GNU Parallel. Concurrency: $MAXJ" | tee -a "$LOGFILE"
+echo "[INFO] Starting concurrent processing of ${#PENDING[@]} PDBs using GNU Parallel. Concurrency: $MAXJ" | tee -a "$LOGFILE"
 
 # 将所有 PDB 文件的路径通过管道传给 parallel
-printf "%s\n" "${PDBS[@]}" | parallel \
+printf "%s\n" "${PENDING[@]}" | parallel \
+    --colsep '\t' \
     --jobs "$MAXJ" \
     --bar \
     --joblog "$OUTDIR/parallel_joblog.txt" \
@@ -152,8 +252,8 @@ printf "%s\n" "${PDBS[@]}" | parallel \
         gpu_to_use=${GPUS_IN_JOB[$gpu_index]}
         # ======================== 修正结束 ====================================
     fi
-    # {} 是 parallel 的占位符，代表输入的每一行（即一个PDB路径）
-    process_pdb "$gpu_to_use" "{}"
+    # {1}/{2}/{3}/{4} 是 parallel 的占位符：PDB 路径、input_hash、唯一名与 binder 链
+    process_pdb "$gpu_to_use" "{1}" "{2}" "{3}" "{4}"
 '
 
 echo "[OK] GNU Parallel finished. ProteinMPNN sequences -> $OUTDIR"
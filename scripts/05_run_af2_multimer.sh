@@ -33,10 +33,13 @@ fi
 
 # ====================== 读取参数与路径 ======================
 PARAMS=${1:?Usage: 05_run_af2_multimer.sh params.yaml}
-OUTROOT=$(python scripts/get_param_yaml.py "$PARAMS" paths.work_dir)
+source scripts/load_params.sh
+load_params "$PARAMS"
+OUTROOT="$P_PATHS_WORK_DIR"
 OUTDIR="$OUTROOT/af2_models"
 MPNN_DIR="$OUTROOT/mpnn_seqs"
-TEMPLATE_SRC=$(python scripts/get_param_yaml.py "$PARAMS" paths.templates_dir)
+TARGETS_DIR="$P_PATHS_TARGETS_DIR"
+TEMPLATE_SRC="$P_PATHS_TEMPLATES_DIR"
 
 RUN_DIR="$OUTDIR/run"
 mkdir -p "$OUTDIR/predictions" "$OUTDIR/logs" "$RUN_DIR"
@@ -44,13 +47,15 @@ TEMPLATES_TMP_ROOT="$OUTDIR/templates_tmp"
 mkdir -p "$TEMPLATES_TMP_ROOT"
 MASTER_LOG="$OUTDIR/log.txt"; : > "$MASTER_LOG"
 
-USE_TEMPLATE=$(python scripts/get_param_yaml.py "$PARAMS" project.use_template)
-NUM_MODELS=$(python scripts/get_param_yaml.py "$PARAMS" af2.with_template.initial.num_models)
-NUM_RECYCLES=$(python scripts/get_param_yaml.py "$PARAMS" af2.with_template.initial.num_recycles)
-AMBER=$(python scripts/get_param_yaml.py "$PARAMS" af2.with_template.initial.amber_relax)
-HALT_ON_FAIL=$(python scripts/get_param_yaml.py "$PARAMS" compute.halt_on_fail 2>/dev/null || echo "false")
+USE_TEMPLATE="$P_PROJECT_USE_TEMPLATE"
+NUM_MODELS="${P_AF2_WITH_TEMPLATE_INITIAL_NUM_MODELS:-}"
+NUM_RECYCLES="${P_AF2_WITH_TEMPLATE_INITIAL_NUM_RECYCLES:-}"
+AMBER="${P_AF2_WITH_TEMPLATE_INITIAL_AMBER_RELAX:-}"
+HALT_ON_FAIL="$P_COMPUTE_HALT_ON_FAIL"
 HALT_ON_FAIL_LOWER=$(echo "$HALT_ON_FAIL" | tr '[:upper:]' '[:lower:]')
-WORKERS_PER_GPU=$(python scripts/get_param_yaml.py "$PARAMS" compute.workers_per_gpu 2>/dev/null || echo 1)
+WORKERS_PER_GPU="$P_COMPUTE_WORKERS_PER_GPU"
+# compute.mem_scheduler：按估计峰值显存准入（scripts/gpu_scheduler.py），workers_per_gpu 变为每 GPU 并发上限
+MEM_SCHED_LOWER=$(echo "$P_COMPUTE_MEM_SCHEDULER" | tr '[:upper:]' '[:lower:]'); GPU_PROBE="$P_COMPUTE_GPU_PROBE"
 
 echo "[INFO] GPU Utilization Strategy: ${WORKERS_PER_GPU} concurrent worker(s) per GPU with private template copies." | tee -a "$MASTER_LOG"
 
@@ -61,82 +66,78 @@ MODEL_FLAG=""; MODEL_TYPE=""
 if echo "$HELP" | grep -q -- "--model-type"; then MODEL_FLAG="--model-type"; MODEL_TYPE="alphafold2_multimer_v3"; elif echo "$HELP" | grep -q -- "--models"; then MODEL_FLAG="--models"; MODEL_TYPE="AlphaFold2-multimer-v3"; fi
 # ====================== GPU 发现与筛选 ======================
 discover_gpus() {
-  local cfg; local arr=(); cfg=$(python scripts/get_param_yaml.py "$PARAMS" compute.gpus --json 2>/dev/null || echo ""); if [[ -n "$cfg" && "$cfg" != "null" ]]; then cfg=$(echo "$cfg" | tr -d '[]"' | tr ',' ' '); read -r -a arr <<< "$cfg"; elif [ -n "${CUDA_VISIBLE_DEVICES:-}" ]; then IFS=',' read -r -a arr <<< "$CUDA_VISIBLE_DEVICES"; elif command -v nvidia-smi >/dev/null 2>&1; then mapfile -t arr < <(nvidia-smi --query-gpu=index --format=csv,noheader 2>/dev/null); fi; printf '%s\n' "${arr[@]}";
+  local arr=(); if [ -n "$P_COMPUTE_GPUS" ]; then read -r -a arr <<< "$P_COMPUTE_GPUS"; elif [ -n "${CUDA_VISIBLE_DEVICES:-}" ]; then IFS=',' read -r -a arr <<< "$CUDA_VISIBLE_DEVICES"; elif command -v nvidia-smi >/dev/null 2>&1; then mapfile -t arr < <(nvidia-smi --query-gpu=index --format=csv,noheader 2>/dev/null); fi; printf '%s\n' ${arr[@]+"${arr[@]}"};
 }
 mapfile -t GPUS < <(discover_gpus)
-MINFREE=$(python scripts/get_param_yaml.py "$PARAMS" compute.min_free_mem_mb_for_gpu)
-VALID_GPUS=()
+MINFREE="$P_COMPUTE_MIN_FREE_MEM_MB_FOR_GPU"
+VALID_GPUS=(); GPU_BUDGET_ARGS=()
+if [[ "$MEM_SCHED_LOWER" == "true" ]]; then
+  # 探测器可替换（compute.gpu_probe），GPU 清单也由探测器给出（compute.gpus / CUDA_VISIBLE_DEVICES 只用于筛选）；预算 = 空闲显存 - gpu_mem_reserve_mb
+  GPU_FILTER="${P_COMPUTE_GPUS:-${CUDA_VISIBLE_DEVICES:-}}"
+  while IFS=$'\t' read -r g budget; do [ -n "$g" ] || continue; VALID_GPUS+=("$g"); GPU_BUDGET_ARGS+=(--gpu_budget "$g=$budget"); done \
+    < <(python scripts/gpu_scheduler.py probe --probe "$GPU_PROBE" --gpus "${GPU_FILTER//,/ }" --min_free "$MINFREE" --reserve "$P_COMPUTE_GPU_MEM_RESERVE_MB" 2>> "$MASTER_LOG" || true)
+else
 for g in "${GPUS[@]:-}"; do
   free=$(nvidia-smi --query-gpu=memory.free --format=csv,noheader,nounits --id="$g" 2>/dev/null || echo "0")
   if [[ "$free" =~ ^[0-9]+$ ]] && [ "$free" -ge "$MINFREE" ]; then echo "[INFO] GPU $g free mem: $free MiB. Accepted." >> "$MASTER_LOG"; VALID_GPUS+=("$g"); else echo "[WARN] GPU $g low or unknown free mem ($free MiB), skipped" >> "$MASTER_LOG"; fi
 done
+fi
 NUM_GPUS=${#VALID_GPUS[@]}
 echo "[INFO] Usable GPUs ($NUM_GPUS): ${VALID_GPUS[*]}" | tee -a "$MASTER_LOG"
 if [ "$NUM_GPUS" -eq 0 ]; then echo "[ERROR] No sufficient GPU memory available." | tee -a "$MASTER_LOG"; exit 1; fi
 # ====================== 生成 METTL1 序列 ======================
-if [ ! -f "./outputs/targets/mettl1_seq.fa" ]; then
+if [ ! -f "$TARGETS_DIR/mettl1_seq.fa" ]; then
   echo "[INFO] METTL1 sequence file not found. Generating..." >> "$MASTER_LOG"
-  python - <<'PY'
-import json; from Bio.PDB import PDBParser, Polypeptide; from Bio.SeqUtils import seq1
-cand_file = "./outputs/targets/interface_candidates.json"
+  python - "$TARGETS_DIR" <<'PY'
+import json, os, sys; sys.path.insert(0, "scripts"); from utils import cached_structure
+targets_dir = sys.argv[1]; cand_file = os.path.join(targets_dir, "interface_candidates.json")
 with open(cand_file) as f: cand = json.load(f)
-pdb = cand["mettl1_target_pdb"]; chain_id = cand["mettl1_chain_id"]
-parser = PDBParser(QUIET=True); structure = parser.get_structure("T", pdb)
-custom_map = {"MSE":"M","SEC":"U","PYL":"O"}; seq_chars=[]
-for r in structure[0][chain_id]:
-    if not Polypeptide.is_aa(r, standard=False): continue
-    resname = r.get_resname().strip()
-    try: seq_chars.append(seq1(resname, custom_map=custom_map))
-    except KeyError: seq_chars.append("X")
-seq = "".join(seq_chars)
-with open("./outputs/targets/mettl1_seq.fa","w") as f: f.write(">METTL1\n"+seq+"\n")
+seq = cached_structure(cand["mettl1_target_pdb"]).sequence(cand["mettl1_chain_id"])
+with open(os.path.join(targets_dir, "mettl1_seq.fa"),"w") as f: f.write(">METTL1\n"+seq+"\n")
 print("[OK] METTL1 seq written.")
 PY
 else
   echo "[INFO] Found existing METTL1 sequence file." >> "$MASTER_LOG"
 fi
-METTL1_SEQ=$(grep -v "^>" ./outputs/targets/mettl1_seq.fa | tr -d '[:space:]' || true)
+METTL1_SEQ=$(grep -v "^>" "$TARGETS_DIR/mettl1_seq.fa" | tr -d '[:space:]' || true)
 if [[ -z "${METTL1_SEQ:-}" ]]; then echo "[ERROR] Empty METTL1 sequence." | tee -a "$MASTER_LOG"; exit 1; fi
 # ====================== 组装 FASTA ======================
-FASTA_DIR="$OUTDIR/fasta_all"; echo "[INFO] Assembling all FASTA files into $FASTA_DIR..." | tee -a "$MASTER_LOG"; rm -rf "$FASTA_DIR"; mkdir -p "$FASTA_DIR"
-find "$MPNN_DIR" -type f -path "*/seqs/*.fa" | sort | while read -r mpnn_multiseq_fa; do
-  [[ ! -s "$mpnn_multiseq_fa" ]] && continue
-  design_backbone_name=$(basename "${mpnn_multiseq_fa%.fa}")
-  awk -v mettl1_seq="$METTL1_SEQ" -v out_dir="$FASTA_DIR" -v backbone_name="$design_backbone_name" \
-      'BEGIN{RS=">";FS="\n"}
-       match($1, /sample=([^, ]+)/, arr) {
-         header=$1; sequence=""; for(i=2;i<=NF;i++){sequence=sequence $i}; gsub(/[ \t\r\n]/,"",sequence);
-         if(sequence==""){next}; sample_id=arr[1]; out_file=out_dir"/"backbone_name"_sample_"sample_id".fa";
-         print ">METTL1:"backbone_name"_sample_"sample_id > out_file; print mettl1_seq":"sequence >> out_file; close(out_file)
-       }' "$mpnn_multiseq_fa"
-done
-mapfile -t ALL_FASTAS < <(find "$FASTA_DIR" -type f -name "*.fa" | sort)
-NUM_FILES=${#ALL_FASTAS[@]}
-if [[ "$NUM_FILES" -eq 0 ]]; then echo "[ERROR] No FASTA files assembled. Check MPNN output and script logic." | tee -a "$MASTER_LOG"; exit 1; fi
-echo "[INFO] Total $NUM_FILES FASTA files correctly assembled." | tee -a "$MASTER_LOG"
+# 全部任务 FASTA 打包为一个序列库 tasks.ffdata/.ffindex（seq_store.py），不再每个样本一个 .fa 文件
+TASK_STORE="$OUTDIR/tasks"; echo "[INFO] Assembling all task sequences into $TASK_STORE.ffdata/.ffindex..." | tee -a "$MASTER_LOG"
+# 相同的 METTL1:binder 序列只生成一个任务，别名映射写入 alias_map.tsv（第 6 阶段展开）
+# mpnn_select.*：按 MPNN 分数预选（每个骨架前 k 条 / 全局分位数），分数与入选情况见 mpnn_selection.tsv
+python scripts/assemble_rf3_inputs.py "$MPNN_DIR" "$TARGETS_DIR/mettl1_seq.fa" "$TASK_STORE" "$OUTDIR/alias_map.tsv" \
+  --top_k "$P_MPNN_SELECT_TOP_K_PER_BACKBONE" --quantile "$P_MPNN_SELECT_SCORE_QUANTILE" \
+  --score_field "$P_MPNN_SELECT_SCORE_FIELD" --selection_out "$OUTDIR/mpnn_selection.tsv" --tasks_out "$RUN_DIR/tasks.tsv" 2>&1 | tee -a "$MASTER_LOG"
+NUM_FILES=$(wc -l < "$RUN_DIR/tasks.tsv" | tr -d '[:space:]')
+if [[ "$NUM_FILES" -eq 0 ]]; then echo "[ERROR] No tasks assembled. Check MPNN output and script logic." | tee -a "$MASTER_LOG"; exit 1; fi
+echo "[INFO] Total $NUM_FILES tasks correctly assembled." | tee -a "$MASTER_LOG"
 
-# ====================== 任务预分配 ======================
-TOTAL_WORKERS=$((NUM_GPUS * WORKERS_PER_GPU))
-echo "[INFO] Pre-distributing $NUM_FILES tasks to $TOTAL_WORKERS total workers ($NUM_GPUS GPUs x $WORKERS_PER_GPU workers/GPU)..." | tee -a "$MASTER_LOG"
-
-for (( i=0; i<TOTAL_WORKERS; i++ )); do
-  gpu_idx=$(( i / WORKERS_PER_GPU ))
-  sub_worker_id=$(( i % WORKERS_PER_GPU ))
-  GPU_ID=${VALID_GPUS[$gpu_idx]}
-  WORKER_INPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_inputs"
-  rm -rf "$WORKER_INPUT_DIR"; mkdir -p "$WORKER_INPUT_DIR"
-done
+# ====================== 靶点特征缓存 ======================
+# target_features.enabled：靶点 MSA 每个战役只算一次（scripts/target_features.py）；每个任务的输入改为复合物 a3m
+# （缓存的靶点 MSA + binder 单序列），colabfold 不再为靶点重新建 MSA
+TARGET_FEATURES=""
+if [[ "$(echo "$P_TARGET_FEATURES_ENABLED" | tr '[:upper:]' '[:lower:]')" == "true" ]]; then
+  TARGET_FEATURES=$(python scripts/target_features.py build --params "$PARAMS" --target_fa "$TARGETS_DIR/mettl1_seq.fa" 2>> "$MASTER_LOG")
+  echo "[INFO] Target features: $TARGET_FEATURES" | tee -a "$MASTER_LOG"
+fi
 
-for (( i=0; i<NUM_FILES; i++ )); do
-  worker_slot_idx=$(( i % TOTAL_WORKERS ))
-  gpu_idx=$(( worker_slot_idx / WORKERS_PER_GPU ))
-  sub_worker_id=$(( worker_slot_idx % WORKERS_PER_GPU ))
-  GPU_ID=${VALID_GPUS[$gpu_idx]}
-  WORKER_INPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_inputs"
-  
-  ABSOLUTE_FASTA_PATH=$(readlink -f "${ALL_FASTAS[$i]}")
-  ln -s "$ABSOLUTE_FASTA_PATH" "$WORKER_INPUT_DIR/"
-done
+# ====================== 共享任务队列 ======================
+# 全部任务进入 SQLite 队列，各 worker 领取直到队列为空（带租约，见 05_run_rf3.sh）
+# 按复合物总长度分桶（compute.length_bucket_width，与 --recompile-padding 一致）：每次领取最多 compute.af2_tasks_per_call 个
+# 同桶任务合成一个多条目 FASTA，一次 colabfold 调用内只在首个任务编译，其余复用
+AF2_TASKS_PER_CALL="$P_COMPUTE_AF2_TASKS_PER_CALL"
+TOTAL_WORKERS=$((NUM_GPUS * WORKERS_PER_GPU))
+QUEUE_DB="$RUN_DIR/queue.sqlite"
+LEASE_S="$P_COMPUTE_TASK_LEASE_S"
+# 显存准入：登记各 GPU 预算与峰值显存模型（上次运行修正后的模型存于 tmp_root，存在时优先）
+MEM_MODEL_FILE="$P_PATHS_TMP_ROOT/mem_model_af2.json"
+CLAIM_POLL=30; [[ "$MEM_SCHED_LOWER" == "true" ]] && CLAIM_POLL=5
+rm -f "$QUEUE_DB" "$QUEUE_DB-journal"
+python scripts/task_queue.py init "$QUEUE_DB" --max_attempts "$P_COMPUTE_TASK_MAX_ATTEMPTS" \
+  --bucket_width "$P_COMPUTE_LENGTH_BUCKET_WIDTH" ${GPU_BUDGET_ARGS[@]+"${GPU_BUDGET_ARGS[@]}"} --mem_model "$P_COMPUTE_MEM_MODEL" \
+  --mem_margin "$P_COMPUTE_MEM_MARGIN" --mem_model_file "$MEM_MODEL_FILE" < "$RUN_DIR/tasks.tsv" 2>&1 | tee -a "$MASTER_LOG"
+echo "[INFO] Queued $NUM_FILES tasks for $TOTAL_WORKERS total workers ($NUM_GPUS GPUs x $WORKERS_PER_GPU workers/GPU)" | tee -a "$MASTER_LOG"
 
 # ====================== 构造参数 ======================
 RELAX_ARGS=()
@@ -152,61 +153,99 @@ INFER_ARGS=(
   --overwrite-existing-results
   --recompile-padding 10
 )
-FLAT_ARGS=( "${INFER_ARGS[@]}" "${RELAX_ARGS[@]}" )
+FLAT_ARGS=( "${INFER_ARGS[@]}" ${RELAX_ARGS[@]+"${RELAX_ARGS[@]}"} )
 
 # ====================== Worker 循环函数 ======================
 run_worker_loop() {
     local gpu_id="$1"
     local worker_id="$2"
-    local input_dir="$3"
-    local output_dir="$4"
-    local template_dir="$5"
-    local colabfold_cmd="$6"
-    shift 6
+    local output_dir="$3"
+    local template_dir="$4"
+    local colabfold_cmd="$5"
+    shift 5
     local flat_args=("$@")
 
     export CUDA_VISIBLE_DEVICES="$gpu_id"
 
-    local num_tasks=$(find "$input_dir" -type l -name "*.fa" 2>/dev/null | wc -l)
-    [[ $num_tasks -eq 0 ]] && { echo "[WORKER $worker_id] No tasks assigned. Exiting."; return; }
-    
     local task_count=0
     local worker_start_time=$(date +%s)
+    local tasks task base_name hb peak
+    local gpu_args=() wrap=() peak_file="$RUN_DIR/peak_${worker_id}"
+    if [[ "$MEM_SCHED_LOWER" == "true" ]]; then
+        # 只领取估计峰值放得进本 GPU 剩余预算的任务；colabfold 经 gpu_scheduler.py exec 运行以采样显存峰值
+        gpu_args=(--gpu "$gpu_id")
+        wrap=(python scripts/gpu_scheduler.py exec --probe "$GPU_PROBE" --peak_out "$peak_file" --)
+    fi
 
-    echo "[WORKER $worker_id] Starting on GPU $gpu_id... Assigned $num_tasks tasks."
+    echo "[WORKER $worker_id] Starting on GPU $gpu_id... Claiming tasks from $QUEUE_DB."
 
-    for fasta_file in "$input_dir"/*.fa; do
-        [[ -L "$fasta_file" ]] || continue
-        task_count=$((task_count + 1))
-        local base_name=$(basename "$fasta_file" .fa)
+    while mapfile -t tasks < <(python scripts/task_queue.py claim "$QUEUE_DB" "$worker_id" --lease "$LEASE_S" --wait --poll "$CLAIM_POLL" \
+                                 --batch "$AF2_TASKS_PER_CALL" --new_process ${gpu_args[@]+"${gpu_args[@]}"}); [[ ${#tasks[@]} -gt 0 ]]; do
+        local names=() batch_in store done_prefix
+        for task in "${tasks[@]}"; do
+            IFS=$'\t' read -r base_name store <<< "$task"
+            names+=( "$base_name" )
+        done
+        if [[ -n "$TARGET_FEATURES" ]]; then
+            # 每个任务一个复合物 a3m（缓存的靶点 MSA + binder），colabfold 以文件名为 jobname
+            batch_in="$RUN_DIR/batch_${worker_id}"; rm -rf "$batch_in"
+            python scripts/target_features.py complex --cache "$TARGET_FEATURES" --store "$store" --out_dir "$batch_in" "${names[@]}"
+            done_prefix=""
+        else
+            # 本批记录从序列库取出，拼成一个多条目 FASTA（jobname 为 FASTA 头 METTL1:<name> 转义后的文件名）
+            batch_in="$RUN_DIR/batch_${worker_id}.fa"
+            python scripts/seq_store.py get "$store" "${names[@]}" > "$batch_in"
+            done_prefix="METTL1_"
+        fi
+        task_count=$((task_count + ${#names[@]}))
         echo "------------------------------------------------------------"
-        echo "[WORKER $worker_id] Processing task $task_count/$num_tasks: $base_name"
+        echo "[WORKER $worker_id] Processing ${#names[@]} task(s) (total $task_count): ${names[*]}"
         
         local task_start_time=$(date +%s)
-        local cmd=( "$colabfold_cmd" )
+        : > "$peak_file"
+        local cmd=( ${wrap[@]+"${wrap[@]}"} "$colabfold_cmd" )
         cmd+=( "${flat_args[@]}" )
         if [[ -n "$template_dir" ]]; then
             cmd+=( --templates --custom-template-path "$template_dir" )
         fi
-        cmd+=( "$fasta_file" "$output_dir" )
+        cmd+=( "$batch_in" "$output_dir" )
 
-        "${cmd[@]}"
-        local exit_code=$?
+        # 续约心跳：每 1/3 租约期续一次；临时的数据库错误不中断续约，任务不再由本 worker 持有时自行退出
+        python scripts/task_queue.py heartbeat "$QUEUE_DB" "$worker_id" "${names[@]}" --lease "$LEASE_S" &
+        hb=$!
+        local exit_code=0
+        "${cmd[@]}" || exit_code=$?
+        kill "$hb" 2>/dev/null || true
+        wait "$hb" 2>/dev/null || true
         local task_end_time=$(date +%s)
         local task_duration=$((task_end_time - task_start_time))
 
         if [[ $exit_code -ne 0 ]]; then
-            echo "[WORKER $worker_id] ERROR: colabfold failed for $base_name with exit code $exit_code. Task duration: ${task_duration}s."
+            echo "[WORKER $worker_id] ERROR: colabfold failed with exit code $exit_code. Batch duration: ${task_duration}s."
         else
-            echo "[WORKER $worker_id] Finished task $task_count/$num_tasks: $base_name. Task duration: ${task_duration}s."
+            echo "[WORKER $worker_id] Finished ${#names[@]} task(s) (total $task_count). Batch duration: ${task_duration}s."
         fi
+        # 同批任务在一个进程内依次运行，整批的显存峰值只记给最长的（同桶内按长度升序，即最后一个）
+        peak=$(cat "$peak_file" 2>/dev/null || true)
+        for n in "${names[@]}"; do
+            local peak_args=()
+            [[ $exit_code -eq 0 && -n "$peak" && "$n" == "${names[-1]}" ]] && peak_args=(--peak_mb "$peak")
+            # colabfold 对每个已完成的条目写 <jobname>.done.txt
+            if [[ $exit_code -eq 0 || -f "$output_dir/${done_prefix}${n}.done.txt" ]]; then
+                python scripts/task_queue.py done "$QUEUE_DB" "$n" "$worker_id" ${peak_args[@]+"${peak_args[@]}"}
+            else
+                python scripts/task_queue.py fail "$QUEUE_DB" "$n" "$worker_id" "exit code $exit_code"
+            fi
+        done
     done
     
     local worker_end_time=$(date +%s)
     local worker_duration=$((worker_end_time - worker_start_time))
-    echo "[WORKER $worker_id] All assigned tasks completed. Total worker time: ${worker_duration}s."
+    rm -f "$peak_file"
+    echo "[WORKER $worker_id] All assigned tasks completed ($task_count tasks). Total worker time: ${worker_duration}s."
 }
 export -f run_worker_loop
+export QUEUE_DB LEASE_S AF2_TASKS_PER_CALL RUN_DIR TARGET_FEATURES MEM_SCHED_LOWER GPU_PROBE CLAIM_POLL
 
 # ====================== 启动 Worker (已修正模板复制逻辑) ======================
 TOTAL_WORKERS=$((NUM_GPUS * WORKERS_PER_GPU))
@@ -216,7 +255,6 @@ for (( i=0; i<NUM_GPUS; i++ )); do
   
   for (( j=0; j<WORKERS_PER_GPU; j++ )); do
     WORKER_ID="gpu_${GPU_ID}_sub_${j}"
-    WORKER_INPUT_DIR="$RUN_DIR/worker_${WORKER_ID}_inputs"
     WORKER_OUTPUT_DIR="$OUTDIR/predictions"
     WORKER_LOG="$OUTDIR/logs/worker_${WORKER_ID}.log"
     TEMPLATE_COPY_DIR=""
@@ -242,13 +280,13 @@ for (( i=0; i<NUM_GPUS; i++ )); do
       COPY_DIRS+=("$TEMPLATE_COPY_DIR")
     fi
 
-    CMD_STR="run_worker_loop $GPU_ID $WORKER_ID $WORKER_INPUT_DIR $WORKER_OUTPUT_DIR $TEMPLATE_COPY_DIR $COLABFOLD ${FLAT_ARGS[*]}"
+    CMD_STR="run_worker_loop $GPU_ID $WORKER_ID $WORKER_OUTPUT_DIR $TEMPLATE_COPY_DIR $COLABFOLD ${FLAT_ARGS[*]}"
     echo "------------------------------------------------------------" | tee -a "$MASTER_LOG"
     echo "[INFO] Starting worker $WORKER_ID for GPU $GPU_ID. Log: $WORKER_LOG" | tee -a "$MASTER_LOG"
     echo "[INFO] Command logic: $CMD_STR" | tee -a "$MASTER_LOG"
     echo "------------------------------------------------------------" | tee -a "$MASTER_LOG"
 
-    run_worker_loop "$GPU_ID" "$WORKER_ID" "$WORKER_INPUT_DIR" "$WORKER_OUTPUT_DIR" "$TEMPLATE_COPY_DIR" "$COLABFOLD" "${FLAT_ARGS[@]}" > "$WORKER_LOG" 2>&1 &
+    run_worker_loop "$GPU_ID" "$WORKER_ID" "$WORKER_OUTPUT_DIR" "$TEMPLATE_COPY_DIR" "$COLABFOLD" "${FLAT_ARGS[@]}" > "$WORKER_LOG" 2>&1 &
     PIDS+=("$!")
     echo "[INFO] Worker $WORKER_ID started, PID=$!" | tee -a "$MASTER_LOG"; sleep 0.2
   done
@@ -280,6 +318,9 @@ trap - EXIT; cleanup EXIT
 grep -L "All assigned tasks completed" "$OUTDIR/logs/worker_"*.log | sed 's/.*\(worker_gpu_.*_sub_.*\)\.log/Worker \1 might have failed or been interrupted./' > "$FAIL_FILE" || true
 FAILS=$(wc -l < "$FAIL_FILE" | tr -d '[:space:]')
 echo "[DONE] All workers finished. Total workers: $TOTAL_WORKERS, Potential Failures: $FAILS" | tee -a "$MASTER_LOG"
+echo "[INFO] Task queue: $(python scripts/task_queue.py stats "$QUEUE_DB")" | tee -a "$MASTER_LOG"
+python scripts/task_queue.py report "$QUEUE_DB" >> "$MASTER_LOG"
+[[ "$MEM_SCHED_LOWER" == "true" ]] && python scripts/task_queue.py save_mem_model "$QUEUE_DB" "$MEM_MODEL_FILE"
 if [[ "$FAILS" -gt 0 ]]; then echo "Please check the following worker logs for details:" | tee -a "$MASTER_LOG"; cat "$FAIL_FILE" | tee -a "$MASTER_LOG"; fi
 
 # ====================== 计时结束与报告 ======================
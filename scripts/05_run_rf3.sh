@@ -9,6 +9,8 @@ PIDS=()
 
 cleanup() {
   local sig=${1:-TERM}
+  # 跟踪 events.jsonl 的下游（publish.py events --follow）以 finished 事件结束，异常退出时也写
+  if [ -n "${EVENTS:-}" ]; then python scripts/publish.py event "$EVENTS" finished 2>/dev/null || true; EVENTS=""; fi
   echo "[CLEANUP] Signal $sig. Killing ${#PIDS[@]} worker(s)..." >&2
   for p in "${PIDS[@]:-}"; do
     if kill -0 "$p" 2>/dev/null; then kill -"$sig" -"$p" 2>/dev/null || true; fi
@@ -21,54 +23,87 @@ cleanup() {
 trap 'cleanup TERM' TERM; trap 'cleanup INT' INT; trap 'cleanup EXIT' EXIT
 
 # ====================== 读取参数与路径 ======================
-PARAMS=${1:?Usage: 05_run_rf3.sh params.yaml}
-OUTROOT=$(python scripts/get_param_yaml.py "$PARAMS" paths.work_dir)
-OUTDIR="$OUTROOT/rf3_models"
-MPNN_DIR="$OUTROOT/mpnn_seqs"
-RF3_REPO=$(python scripts/get_param_yaml.py "$PARAMS" paths.rosettafold3_repo)
+PARAMS=${1:?Usage: 05_run_rf3.sh params.yaml [initial|refine]}
+TIER=${2:-initial}
+source scripts/load_params.sh
+load_params "$PARAMS"
+OUTROOT="$P_PATHS_WORK_DIR"
+case "$TIER" in
+  initial) OUTDIR="$OUTROOT/rf3_models";        MPNN_DIR="$OUTROOT/mpnn_seqs" ;;
+  refine)  OUTDIR="$OUTROOT/rf3_models_refine"; MPNN_DIR="$OUTROOT/mpnn_seqs_refine" ;;
+  *) echo "[ERROR] unknown tier '$TIER' (expected initial or refine)" >&2; exit 1 ;;
+esac
+TARGETS_DIR="$P_PATHS_TARGETS_DIR"
+RF3_REPO="$P_PATHS_ROSETTAFOLD3_REPO"
 
 RUN_DIR="$OUTDIR/run"
 mkdir -p "$OUTDIR/predictions" "$OUTDIR/logs" "$RUN_DIR"
 MASTER_LOG="$OUTDIR/log.txt"; : > "$MASTER_LOG"
-
-USE_TEMPLATE=$(python scripts/get_param_yaml.py "$PARAMS" project.use_template)
-NUM_MODELS=$(python scripts/get_param_yaml.py "$PARAMS" rf3.with_template.initial.num_models)
-NUM_RECYCLES=$(python scripts/get_param_yaml.py "$PARAMS" rf3.with_template.initial.num_recycles)
-USE_TEMPLATES_PARAM=$(python scripts/get_param_yaml.py "$PARAMS" rf3.with_template.initial.use_templates)
-HALT_ON_FAIL=$(python scripts/get_param_yaml.py "$PARAMS" compute.halt_on_fail 2>/dev/null || echo "false")
+# 每个预测完成即发布到 predictions/<任务名>/（scripts/publish.py），事件逐行记入 events.jsonl，下游可在预测进行中处理结果
+EVENTS="$OUTDIR/events.jsonl"; : > "$EVENTS"
+
+USE_TEMPLATE="$P_PROJECT_USE_TEMPLATE"
+if [ "$TIER" = "refine" ]; then
+  NUM_MODELS="${P_RF3_WITH_TEMPLATE_REFINE_NUM_MODELS:-}"
+  NUM_RECYCLES="${P_RF3_WITH_TEMPLATE_REFINE_NUM_RECYCLES:-}"
+  USE_TEMPLATES_PARAM="${P_RF3_WITH_TEMPLATE_REFINE_USE_TEMPLATES:-}"
+else
+  NUM_MODELS="${P_RF3_WITH_TEMPLATE_INITIAL_NUM_MODELS:-}"
+  NUM_RECYCLES="${P_RF3_WITH_TEMPLATE_INITIAL_NUM_RECYCLES:-}"
+  USE_TEMPLATES_PARAM="${P_RF3_WITH_TEMPLATE_INITIAL_USE_TEMPLATES:-}"
+fi
+HALT_ON_FAIL="$P_COMPUTE_HALT_ON_FAIL"
 HALT_ON_FAIL_LOWER=$(echo "$HALT_ON_FAIL" | tr '[:upper:]' '[:lower:]')
-WORKERS_PER_GPU=$(python scripts/get_param_yaml.py "$PARAMS" compute.workers_per_gpu 2>/dev/null || echo 1)
+WORKERS_PER_GPU="$P_COMPUTE_WORKERS_PER_GPU"
+# compute.mem_scheduler：按估计峰值显存准入（scripts/gpu_scheduler.py），workers_per_gpu 变为每 GPU 并发上限
+MEM_SCHED_LOWER=$(echo "$P_COMPUTE_MEM_SCHEDULER" | tr '[:upper:]' '[:lower:]')
+GPU_PROBE="$P_COMPUTE_GPU_PROBE"
 
-echo "[INFO] GPU Utilization Strategy: ${WORKERS_PER_GPU} concurrent worker(s) per GPU." | tee -a "$MASTER_LOG"
+if [[ "$MEM_SCHED_LOWER" == "true" ]]; then
+  echo "[INFO] GPU Utilization Strategy: memory-aware admission, up to ${WORKERS_PER_GPU} concurrent worker(s) per GPU." | tee -a "$MASTER_LOG"
+else
+  echo "[INFO] GPU Utilization Strategy: ${WORKERS_PER_GPU} concurrent worker(s) per GPU." | tee -a "$MASTER_LOG"
+fi
 
 # ====================== GPU 发现与筛选 ======================
 discover_gpus() {
-  local cfg; local arr=()
-  cfg=$(python scripts/get_param_yaml.py "$PARAMS" compute.gpus --json 2>/dev/null || echo "")
-  if [[ -n "$cfg" && "$cfg" != "null" ]]; then
-    cfg=$(echo "$cfg" | tr -d '[]"' | tr ',' ' ')
-    read -r -a arr <<< "$cfg"
+  local arr=()
+  if [ -n "$P_COMPUTE_GPUS" ]; then
+    read -r -a arr <<< "$P_COMPUTE_GPUS"
   elif [ -n "${CUDA_VISIBLE_DEVICES:-}" ]; then
     IFS=',' read -r -a arr <<< "$CUDA_VISIBLE_DEVICES"
   elif command -v nvidia-smi >/dev/null 2>&1; then
     mapfile -t arr < <(nvidia-smi --query-gpu=index --format=csv,noheader 2>/dev/null)
   fi
-  printf '%s\n' "${arr[@]}"
+  printf '%s\n' ${arr[@]+"${arr[@]}"}
 }
 
 mapfile -t GPUS < <(discover_gpus)
-MINFREE=$(python scripts/get_param_yaml.py "$PARAMS" compute.min_free_mem_mb_for_gpu)
+MINFREE="$P_COMPUTE_MIN_FREE_MEM_MB_FOR_GPU"
 VALID_GPUS=()
-
-for g in "${GPUS[@]:-}"; do
-  free=$(nvidia-smi --query-gpu=memory.free --format=csv,noheader,nounits --id="$g" 2>/dev/null || echo "0")
-  if [[ "$free" =~ ^[0-9]+$ ]] && [ "$free" -ge "$MINFREE" ]; then
-    echo "[INFO] GPU $g free mem: $free MiB. Accepted." >> "$MASTER_LOG"
+GPU_BUDGET_ARGS=()
+
+if [[ "$MEM_SCHED_LOWER" == "true" ]]; then
+  # 探测器可替换（compute.gpu_probe，如 fake:0=24576 在无 GPU 环境下测试），GPU 清单也由探测器给出，
+  # compute.gpus / CUDA_VISIBLE_DEVICES 只用于筛选；每个 GPU 的预算 = 空闲显存 - gpu_mem_reserve_mb
+  GPU_FILTER="${P_COMPUTE_GPUS:-${CUDA_VISIBLE_DEVICES:-}}"
+  while IFS=$'\t' read -r g budget; do
+    [ -n "$g" ] || continue
     VALID_GPUS+=("$g")
-  else
-    echo "[WARN] GPU $g low or unknown free mem ($free MiB), skipped" >> "$MASTER_LOG"
-  fi
-done
+    GPU_BUDGET_ARGS+=(--gpu_budget "$g=$budget")
+  done < <(python scripts/gpu_scheduler.py probe --probe "$GPU_PROBE" --gpus "${GPU_FILTER//,/ }" --min_free "$MINFREE" \
+             --reserve "$P_COMPUTE_GPU_MEM_RESERVE_MB" 2>> "$MASTER_LOG" || true)
+else
+  for g in "${GPUS[@]:-}"; do
+    free=$(nvidia-smi --query-gpu=memory.free --format=csv,noheader,nounits --id="$g" 2>/dev/null || echo "0")
+    if [[ "$free" =~ ^[0-9]+$ ]] && [ "$free" -ge "$MINFREE" ]; then
+      echo "[INFO] GPU $g free mem: $free MiB. Accepted." >> "$MASTER_LOG"
+      VALID_GPUS+=("$g")
+    else
+      echo "[WARN] GPU $g low or unknown free mem ($free MiB), skipped" >> "$MASTER_LOG"
+    fi
+  done
+fi
 
 NUM_GPUS=${#VALID_GPUS[@]}
 echo "[INFO] Usable GPUs ($NUM_GPUS): ${VALID_GPUS[*]}" | tee -a "$MASTER_LOG"
@@ -79,37 +114,20 @@ if [ "$NUM_GPUS" -eq 0 ]; then
 fi
 
 # ====================== 生成 METTL1 序列 ======================
-if [ ! -f "./outputs/targets/mettl1_seq.fa" ]; then
+if [ ! -f "$TARGETS_DIR/mettl1_seq.fa" ]; then
   echo "[INFO] METTL1 sequence file not found. Generating..." >> "$MASTER_LOG"
-  python - <<'PY'
-import json
-from Bio.PDB import PDBParser, Polypeptide
-from Bio.SeqUtils import seq1
+  python - "$TARGETS_DIR" <<'PY'
+import json, os, sys
+sys.path.insert(0, "scripts")
+from utils import cached_structure
 
-cand_file = "./outputs/targets/interface_candidates.json"
+targets_dir = sys.argv[1]
+cand_file = os.path.join(targets_dir, "interface_candidates.json")
 with open(cand_file) as f:
     cand = json.load(f)
 
-pdb = cand["mettl1_target_pdb"]
-chain_id = cand["mettl1_chain_id"]
-
-parser = PDBParser(QUIET=True)
-structure = parser.get_structure("T", pdb)
-
-custom_map = {"MSE":"M","SEC":"U","PYL":"O"}
-seq_chars = []
-
-for r in structure[0][chain_id]:
-    if not Polypeptide.is_aa(r, standard=False):
-        continue
-    resname = r.get_resname().strip()
-    try:
-        seq_chars.append(seq1(resname, custom_map=custom_map))
-    except KeyError:
-        seq_chars.append("X")
-
-seq = "".join(seq_chars)
-with open("./outputs/targets/mettl1_seq.fa","w") as f:
+seq = cached_structure(cand["mettl1_target_pdb"]).sequence(cand["mettl1_chain_id"])
+with open(os.path.join(targets_dir, "mettl1_seq.fa"),"w") as f:
     f.write(">METTL1\n"+seq+"\n")
 print("[OK] METTL1 seq written.")
 PY
@@ -117,92 +135,105 @@ else
   echo "[INFO] Found existing METTL1 sequence file." >> "$MASTER_LOG"
 fi
 
-METTL1_SEQ=$(grep -v "^>" ./outputs/targets/mettl1_seq.fa | tr -d '[:space:]' || true)
+METTL1_SEQ=$(grep -v "^>" "$TARGETS_DIR/mettl1_seq.fa" | tr -d '[:space:]' || true)
 if [[ -z "${METTL1_SEQ:-}" ]]; then
   echo "[ERROR] Empty METTL1 sequence." | tee -a "$MASTER_LOG"
   exit 1
 fi
 
-# ====================== 组装 FASTA ======================
-FASTA_DIR="$OUTDIR/fasta_all"
-echo "[INFO] Assembling all FASTA files into $FASTA_DIR..." | tee -a "$MASTER_LOG"
-rm -rf "$FASTA_DIR"
-mkdir -p "$FASTA_DIR"
+# ====================== 组装任务序列库 ======================
+# 全部任务 FASTA 打包为一个序列库 tasks.ffdata/.ffindex（seq_store.py），不再每个样本一个 .fa 文件
+TASK_STORE="$OUTDIR/tasks"
+echo "[INFO] Assembling all task sequences into $TASK_STORE.ffdata/.ffindex..." | tee -a "$MASTER_LOG"
 
-find "$MPNN_DIR" -type f -path "*/seqs/*.fa" | sort | while read -r mpnn_multiseq_fa; do
-  [[ ! -s "$mpnn_multiseq_fa" ]] && continue
-  design_backbone_name=$(basename "${mpnn_multiseq_fa%.fa}")
-  
-  awk -v mettl1_seq="$METTL1_SEQ" -v out_dir="$FASTA_DIR" -v backbone_name="$design_backbone_name" \
-      'BEGIN{RS=">";FS="\n"}
-       match($1, /sample=([^, ]+)/, arr) {
-         header=$1; sequence=""; for(i=2;i<=NF;i++){sequence=sequence $i}; gsub(/[ \t\r\n]/,"",sequence);
-         if(sequence==""){next}; sample_id=arr[1]; out_file=out_dir"/"backbone_name"_sample_"sample_id".fa";
-         print ">METTL1:"backbone_name"_sample_"sample_id > out_file; print mettl1_seq":"sequence >> out_file; close(out_file)
-       }' "$mpnn_multiseq_fa"
-done
+# 一次流式读取全部 MPNN 输出；相同的 METTL1:binder 序列只生成一个任务，别名映射写入 alias_map.tsv（第 6 阶段展开）
+# mpnn_select.*：按 MPNN 分数预选（每个骨架前 k 条 / 全局分位数），分数与入选情况见 mpnn_selection.tsv
+python scripts/assemble_rf3_inputs.py "$MPNN_DIR" "$TARGETS_DIR/mettl1_seq.fa" "$TASK_STORE" "$OUTDIR/alias_map.tsv" \
+  --top_k "$P_MPNN_SELECT_TOP_K_PER_BACKBONE" --quantile "$P_MPNN_SELECT_SCORE_QUANTILE" \
+  --score_field "$P_MPNN_SELECT_SCORE_FIELD" --selection_out "$OUTDIR/mpnn_selection.tsv" --tasks_out "$RUN_DIR/tasks.tsv" 2>&1 | tee -a "$MASTER_LOG"
 
-mapfile -t ALL_FASTAS < <(find "$FASTA_DIR" -type f -name "*.fa" | sort)
-NUM_FILES=${#ALL_FASTAS[@]}
+NUM_FILES=$(wc -l < "$RUN_DIR/tasks.tsv" | tr -d '[:space:]')
 
 if [[ "$NUM_FILES" -eq 0 ]]; then
-  echo "[ERROR] No FASTA files assembled. Check MPNN output and script logic." | tee -a "$MASTER_LOG"
+  echo "[ERROR] No tasks assembled. Check MPNN output and script logic." | tee -a "$MASTER_LOG"
   exit 1
 fi
 
-echo "[INFO] Total $NUM_FILES FASTA files correctly assembled." | tee -a "$MASTER_LOG"
+echo "[INFO] Total $NUM_FILES tasks correctly assembled." | tee -a "$MASTER_LOG"
+
+# ====================== 靶点特征缓存 ======================
+# target_features.enabled：靶点 MSA / 模板检索每个战役只算一次（scripts/target_features.py）。
+# 只有安装的 run_rf3.py 读取缓存时才构建：常驻 worker 传给 load_model(target_features=...)，
+# 否则以 --target_features <缓存目录> 传给 run_rf3.py；两者都没有时跳过（不做无人使用的 MSA / 模板检索）
+RF3_TARGET_FEATURES=""
+if [[ "$(echo "$P_TARGET_FEATURES_ENABLED" | tr '[:upper:]' '[:lower:]')" == "true" ]]; then
+  TF_CONSUMER=$(python -c "import sys; sys.path.insert(0, 'scripts'); from rf3_worker import target_features_consumer as c; \
+print(c(sys.argv[1], sys.argv[2].lower() == 'true'))" "$RF3_REPO" "$P_RF3_PERSISTENT_WORKERS")
+  if [ -n "$TF_CONSUMER" ]; then
+    RF3_TARGET_FEATURES=$(python scripts/target_features.py build --params "$PARAMS" --target_fa "$TARGETS_DIR/mettl1_seq.fa" 2>> "$MASTER_LOG")
+    echo "[INFO] Target features ($TF_CONSUMER): $RF3_TARGET_FEATURES" | tee -a "$MASTER_LOG"
+  else
+    echo "[WARN] target_features.enabled but $RF3_REPO/run_rf3.py reads no target features (no --target_features flag / load_model(target_features=...)); cache not built" | tee -a "$MASTER_LOG"
+  fi
+fi
+export RF3_TARGET_FEATURES
 
-# ====================== 任务预分配 ======================
+# ====================== 共享任务队列 ======================
+# 不再按 i % TOTAL_WORKERS 预先分配：全部任务进入 SQLite 队列，各 worker 领取直到队列为空；
+# 领取带租约（compute.task_lease_s），运行期间定期续约，worker 崩溃后租约过期由其他 worker 接手。
+# 按复合物总长度分桶（compute.length_bucket_width），worker 连续领取同桶任务；编译复用率见 log.txt 末尾。
+# 显存准入时登记各 GPU 预算与峰值显存模型（compute.mem_model 为先验；上次运行修正后的模型存于 tmp_root，存在时优先）
 TOTAL_WORKERS=$((NUM_GPUS * WORKERS_PER_GPU))
-echo "[INFO] Pre-distributing $NUM_FILES tasks to $TOTAL_WORKERS total workers ($NUM_GPUS GPUs x $WORKERS_PER_GPU workers/GPU)..." | tee -a "$MASTER_LOG"
-
-for (( i=0; i<TOTAL_WORKERS; i++ )); do
-  gpu_idx=$(( i / WORKERS_PER_GPU ))
-  sub_worker_id=$(( i % WORKERS_PER_GPU ))
-  GPU_ID=${VALID_GPUS[$gpu_idx]}
-  WORKER_INPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_inputs"
-  rm -rf "$WORKER_INPUT_DIR"
-  mkdir -p "$WORKER_INPUT_DIR"
-done
-
-for (( i=0; i<NUM_FILES; i++ )); do
-  worker_slot_idx=$(( i % TOTAL_WORKERS ))
-  gpu_idx=$(( worker_slot_idx / WORKERS_PER_GPU ))
-  sub_worker_id=$(( worker_slot_idx % WORKERS_PER_GPU ))
-  GPU_ID=${VALID_GPUS[$gpu_idx]}
-  WORKER_INPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_inputs"
-  
-  ABSOLUTE_FASTA_PATH=$(readlink -f "${ALL_FASTAS[$i]}")
-  ln -s "$ABSOLUTE_FASTA_PATH" "$WORKER_INPUT_DIR/"
-done
+QUEUE_DB="$RUN_DIR/queue.sqlite"
+LEASE_S="$P_COMPUTE_TASK_LEASE_S"
+MEM_MODEL_FILE="$P_PATHS_TMP_ROOT/mem_model_rf3.json"
+CLAIM_POLL=30; [[ "$MEM_SCHED_LOWER" == "true" ]] && CLAIM_POLL=5
+rm -f "$QUEUE_DB" "$QUEUE_DB-journal"
+python scripts/task_queue.py init "$QUEUE_DB" --max_attempts "$P_COMPUTE_TASK_MAX_ATTEMPTS" \
+  --bucket_width "$P_COMPUTE_LENGTH_BUCKET_WIDTH" ${GPU_BUDGET_ARGS[@]+"${GPU_BUDGET_ARGS[@]}"} --mem_model "$P_COMPUTE_MEM_MODEL" \
+  --mem_margin "$P_COMPUTE_MEM_MARGIN" --mem_model_file "$MEM_MODEL_FILE" < "$RUN_DIR/tasks.tsv" 2>&1 | tee -a "$MASTER_LOG"
+echo "[INFO] Queued $NUM_FILES tasks for $TOTAL_WORKERS workers ($NUM_GPUS GPUs x $WORKERS_PER_GPU workers/GPU)" | tee -a "$MASTER_LOG"
 
 # ====================== Worker 函数 ======================
 run_rf3_worker() {
   local gpu_id=$1
   local sub_worker_id=$2
-  local worker_input_dir=$3
-  local worker_output_dir=$4
-  local worker_log=$5
-  
+  local worker_output_dir=$3
+  local worker_log=$4
+  local worker="gpu_${gpu_id}_sub_${sub_worker_id}"
+
   export CUDA_VISIBLE_DEVICES=$gpu_id
-  
+
   echo "[INFO] Worker GPU ${gpu_id} sub ${sub_worker_id} started at $(date)" >> "$worker_log"
-  
-  # Find all FASTA files for this worker
-  mapfile -t WORKER_FASTAS < <(find "$worker_input_dir" -type f -name "*.fa" | sort)
-  local num_worker_files=${#WORKER_FASTAS[@]}
-  
-  echo "[INFO] Worker has ${num_worker_files} files to process" >> "$worker_log"
-  
-  for fasta in "${WORKER_FASTAS[@]}"; do
-    local basename_fa=$(basename "$fasta")
-    local target_name="${basename_fa%.fa}"
+
+  local task target_name store hb rc peak n=0
+  local gpu_args=() wrap=() peak_file="$RUN_DIR/peak_${worker}"
+  if [[ "$MEM_SCHED_LOWER" == "true" ]]; then
+    gpu_args=(--gpu "$gpu_id")
+    # 经 gpu_scheduler.py exec 运行 RF3，采样其进程树的显存峰值
+    wrap=(python scripts/gpu_scheduler.py exec --probe "$GPU_PROBE" --peak_out "$peak_file" --)
+  fi
+  # 运行中的任务从序列库取出到 worker 私有目录（文件名仍为 <任务名>.fa），任务结束即删除
+  local input_dir="$RUN_DIR/input_${worker}" fasta
+  mkdir -p "$input_dir"
+  # --wait：队列里只剩他人租约中的任务时继续等待，以便接手崩溃 worker 的过期租约
+  # 每个任务单独启动 run_rf3.py，因此每次领取都按新进程计编译（--new_process）
+  # 显存准入：只领取估计峰值放得进本 GPU 剩余预算的任务，放不下时每 CLAIM_POLL 秒重试
+  while task=$(python scripts/task_queue.py claim "$QUEUE_DB" "$worker" --lease "$LEASE_S" --wait --poll "$CLAIM_POLL" \
+                 --new_process ${gpu_args[@]+"${gpu_args[@]}"}); [ -n "$task" ]; do
+    IFS=$'\t' read -r target_name store <<< "$task"
+    n=$((n + 1))
     local prediction_dir="$worker_output_dir/${target_name}"
-    
-    echo "[INFO] Processing $basename_fa" >> "$worker_log"
-    
+
+    echo "[INFO] Processing ${target_name}.fa (task $n)" >> "$worker_log"
+
     mkdir -p "$prediction_dir"
-    
+    fasta="$input_dir/${target_name}.fa"
+
+    # 续约心跳：每 1/3 租约期续一次；临时的数据库错误不中断续约，任务不再由本 worker 持有时自行退出
+    python scripts/task_queue.py heartbeat "$QUEUE_DB" "$worker" "$target_name" --lease "$LEASE_S" 2>> "$worker_log" &
+    hb=$!
+
     # Run RosettaFold3 inference
     # NOTE: This command structure is based on common RF3 interfaces.
     # Adjust the script path and parameters according to your RosettaFold3 installation.
@@ -210,45 +241,78 @@ run_rf3_worker() {
     #   - python "$RF3_REPO/run_rosettafold.py" ...
     #   - python "$RF3_REPO/inference.py" ...
     # Check your RosettaFold3 documentation for the exact command format.
-    python "$RF3_REPO/run_rf3.py" \
-      --input_fasta "$fasta" \
-      --output_dir "$prediction_dir" \
-      --num_models "$NUM_MODELS" \
-      --num_recycles "$NUM_RECYCLES" \
-      --use_templates "$USE_TEMPLATES_PARAM" \
-      >> "$worker_log" 2>&1 || {
-        echo "[ERROR] RF3 failed for $basename_fa" >> "$worker_log"
-        if [[ "$HALT_ON_FAIL_LOWER" == "true" ]]; then
-          echo "[ERROR] halt_on_fail=true, exiting worker" >> "$worker_log"
-          return 1
-        fi
-      }
-    
-    echo "[INFO] Completed $basename_fa" >> "$worker_log"
+    rc=0
+    : > "$peak_file"
+    python scripts/seq_store.py get "$store" "$target_name" > "$fasta" 2>> "$worker_log" || rc=$?
+    if [ "$rc" -eq 0 ]; then
+      ${wrap[@]+"${wrap[@]}"} python "$RF3_REPO/run_rf3.py" ${RF3_TARGET_FEATURES:+--target_features "$RF3_TARGET_FEATURES"} \
+        --input_fasta "$fasta" \
+        --output_dir "$prediction_dir" \
+        --num_models "$NUM_MODELS" \
+        --num_recycles "$NUM_RECYCLES" \
+        --use_templates "$USE_TEMPLATES_PARAM" \
+        >> "$worker_log" 2>&1 || rc=$?
+    fi
+    rm -f "$fasta"
+    # worker 暂存目录（run/ 下）与 predictions/ 在同一文件系统，rename 原子发布，附完成标记与事件记录
+    if [ "$rc" -eq 0 ]; then
+      python scripts/publish.py publish "$prediction_dir" "$OUTDIR/predictions" "$target_name" --events "$EVENTS" \
+        --worker "$worker" >> "$worker_log" 2>&1 || rc=$?
+    fi
+    kill "$hb" 2>/dev/null || true
+    wait "$hb" 2>/dev/null || true
+
+    if [ "$rc" -ne 0 ]; then
+      echo "[ERROR] RF3 failed for ${target_name}.fa (rc=$rc)" >> "$worker_log"
+      # 丢弃不完整的输出：任务回到队列后可能由其他 worker 重做
+      rm -rf "$prediction_dir"
+      python scripts/task_queue.py fail "$QUEUE_DB" "$target_name" "$worker" "rc=$rc"
+      if [[ "$HALT_ON_FAIL_LOWER" == "true" ]]; then
+        echo "[ERROR] halt_on_fail=true, exiting worker" >> "$worker_log"
+        return 1
+      fi
+      continue
+    fi
+    peak=$(cat "$peak_file" 2>/dev/null || true)
+    python scripts/task_queue.py done "$QUEUE_DB" "$target_name" "$worker" ${peak:+--peak_mb "$peak"}
+
+    echo "[INFO] Completed ${target_name}.fa" >> "$worker_log"
   done
-  
-  echo "[INFO] Worker GPU ${gpu_id} sub ${sub_worker_id} completed at $(date)" >> "$worker_log"
+
+  rm -f "$peak_file"
+  echo "[INFO] Worker GPU ${gpu_id} sub ${sub_worker_id} completed $n tasks at $(date)" >> "$worker_log"
 }
 
 export -f run_rf3_worker
-export RF3_REPO NUM_MODELS NUM_RECYCLES USE_TEMPLATES_PARAM HALT_ON_FAIL_LOWER
+export RF3_REPO NUM_MODELS NUM_RECYCLES USE_TEMPLATES_PARAM HALT_ON_FAIL_LOWER QUEUE_DB LEASE_S OUTDIR RUN_DIR EVENTS MEM_SCHED_LOWER GPU_PROBE CLAIM_POLL
 
 # ====================== 启动所有 Workers ======================
-echo "[INFO] Starting all workers..." | tee -a "$MASTER_LOG"
+PERSISTENT_LOWER=$(echo "$P_RF3_PERSISTENT_WORKERS" | tr '[:upper:]' '[:lower:]')
+HALT_ARG=""; [[ "$HALT_ON_FAIL_LOWER" == "true" ]] && HALT_ARG="--halt_on_fail"
+echo "[INFO] Starting all workers (persistent: $PERSISTENT_LOWER)..." | tee -a "$MASTER_LOG"
 
 for (( i=0; i<TOTAL_WORKERS; i++ )); do
   gpu_idx=$(( i / WORKERS_PER_GPU ))
   sub_worker_id=$(( i % WORKERS_PER_GPU ))
   GPU_ID=${VALID_GPUS[$gpu_idx]}
   
-  WORKER_INPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_inputs"
   WORKER_OUTPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_outputs"
   WORKER_LOG="$OUTDIR/logs/worker_gpu_${GPU_ID}_sub_${sub_worker_id}.log"
   
-  mkdir -p "$WORKER_OUTPUT_DIR"
+  # 暂存目录只存放运行中的任务（完成即发布），上次运行残留的都是被中断任务的不完整输出
+  rm -rf "$WORKER_OUTPUT_DIR"; mkdir -p "$WORKER_OUTPUT_DIR"
   : > "$WORKER_LOG"
   
-  run_rf3_worker "$GPU_ID" "$sub_worker_id" "$WORKER_INPUT_DIR" "$WORKER_OUTPUT_DIR" "$WORKER_LOG" &
+  GPU_ARGS=(); [[ "$MEM_SCHED_LOWER" == "true" ]] && GPU_ARGS=(--gpu "$GPU_ID" --probe "$GPU_PROBE")
+  if [[ "$PERSISTENT_LOWER" == "true" ]]; then
+    # 常驻 worker：进程与 RF3 模型只初始化一次，队列中的任务逐个流过同一进程
+    CUDA_VISIBLE_DEVICES="$GPU_ID" python scripts/rf3_worker.py --queue "$QUEUE_DB" --worker "gpu_${GPU_ID}_sub_${sub_worker_id}" \
+      --output_dir "$WORKER_OUTPUT_DIR" --rf3_repo "$RF3_REPO" --num_models "$NUM_MODELS" --num_recycles "$NUM_RECYCLES" \
+      --use_templates "$USE_TEMPLATES_PARAM" --lease "$LEASE_S" --poll "$CLAIM_POLL" ${HALT_ARG} --log "$WORKER_LOG" ${GPU_ARGS[@]+"${GPU_ARGS[@]}"} \
+      --publish_dir "$OUTDIR/predictions" --events "$EVENTS" &
+  else
+    run_rf3_worker "$GPU_ID" "$sub_worker_id" "$WORKER_OUTPUT_DIR" "$WORKER_LOG" &
+  fi
   PIDS+=($!)
   
   echo "[INFO] Launched worker for GPU $GPU_ID sub $sub_worker_id (PID: ${PIDS[-1]})" | tee -a "$MASTER_LOG"
@@ -258,7 +322,7 @@ done
 echo "[INFO] Waiting for all workers to complete..." | tee -a "$MASTER_LOG"
 
 FAILED_COUNT=0
-for pid in "${PIDS[@]}"; do
+for pid in ${PIDS[@]+"${PIDS[@]}"}; do
   if wait "$pid"; then
     echo "[INFO] Worker PID $pid completed successfully" >> "$MASTER_LOG"
   else
@@ -268,28 +332,12 @@ for pid in "${PIDS[@]}"; do
 done
 
 # ====================== 收集结果 ======================
-echo "[INFO] Collecting all predictions into $OUTDIR/predictions..." | tee -a "$MASTER_LOG"
-
-for (( i=0; i<TOTAL_WORKERS; i++ )); do
-  gpu_idx=$(( i / WORKERS_PER_GPU ))
-  sub_worker_id=$(( i % WORKERS_PER_GPU ))
-  GPU_ID=${VALID_GPUS[$gpu_idx]}
-  WORKER_OUTPUT_DIR="$RUN_DIR/worker_gpu_${GPU_ID}_sub_${sub_worker_id}_outputs"
-  
-  if [ -d "$WORKER_OUTPUT_DIR" ]; then
-    find "$WORKER_OUTPUT_DIR" -mindepth 1 -maxdepth 1 -type d | while read -r pred_dir; do
-      target_name=$(basename "$pred_dir")
-      dest="$OUTDIR/predictions/$target_name"
-      
-      if [ -d "$dest" ]; then
-        echo "[WARN] Destination $dest already exists, merging..." >> "$MASTER_LOG"
-        cp -r "$pred_dir"/* "$dest/"
-      else
-        mv "$pred_dir" "$dest"
-      fi
-    done
-  fi
-done
+# 各预测已由 worker 逐个发布到 predictions/（不再在此统一 mv / cp -r 合并）；暂存目录里剩下的只会是被中断任务的不完整输出
+LEFTOVER=$(find "$RUN_DIR" -mindepth 2 -maxdepth 2 -path "$RUN_DIR/worker_*_outputs/*" -type d | wc -l | tr -d '[:space:]')
+if [ "$LEFTOVER" -gt 0 ]; then
+  echo "[WARN] $LEFTOVER unpublished partial prediction dir(s) left under $RUN_DIR/worker_*_outputs" | tee -a "$MASTER_LOG"
+fi
+echo "[INFO] Published predictions this run: $(grep -c '"event": "published"' "$EVENTS" || true) (events: $EVENTS)" | tee -a "$MASTER_LOG"
 
 # ====================== 完成 ======================
 SCRIPT_END_TIME=$(date +%s)
@@ -297,6 +345,9 @@ ELAPSED=$((SCRIPT_END_TIME - SCRIPT_START_TIME))
 
 echo "[INFO] All RF3 workers completed." | tee -a "$MASTER_LOG"
 echo "[INFO] Failed workers: $FAILED_COUNT" | tee -a "$MASTER_LOG"
+echo "[INFO] Task queue: $(python scripts/task_queue.py stats "$QUEUE_DB")" | tee -a "$MASTER_LOG"
+python scripts/task_queue.py report "$QUEUE_DB" >> "$MASTER_LOG"
+[[ "$MEM_SCHED_LOWER" == "true" ]] && python scripts/task_queue.py save_mem_model "$QUEUE_DB" "$MEM_MODEL_FILE"
 echo "[INFO] Total time: ${ELAPSED}s" | tee -a "$MASTER_LOG"
 echo "[INFO] Results in: $OUTDIR/predictions" | tee -a "$MASTER_LOG"
 
@@ -1,32 +1,34 @@
 # scripts/06_rank_designs.py
 # 增强：加入界面遮挡率、clash-free分布、BSA分层阈值、两档过滤与加权排名
-import os, json, glob, math
+import os, json, glob, math, argparse
 import numpy as np
 import pandas as pd
-from Bio.PDB import PDBParser, PDBIO, Select
-import freesasa
-try:
-    import yaml
-except:
-    raise SystemExit("Please pip install pyyaml")
-
-PARAMS = "config/params.yaml"
-with open(PARAMS) as f:
-    P = yaml.safe_load(f)
-
-pred_dir = os.path.join(P["paths"]["work_dir"], "rf3_models", "predictions")
+from utils import (ChainAtoms, nearest_distances, sasa_delta, sasa_inputs_from_arrays,
+                   cached_structure, struct_cache_dir)
+from resolve_params import load_params
+from assemble_rf3_inputs import read_alias_map
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--params", default="config/params.yaml", help="config/params.yaml（campaign 模式下为各靶点的派生配置）")
+ap.add_argument("--stage", default="initial", choices=["initial", "refine"], help="漏斗档位：决定读取的预测目录与 filters.<stage> 阈值")
+ARGS = ap.parse_args()
+PARAMS, STAGE = ARGS.params, ARGS.stage
+P = load_params(PARAMS)
+
+pred_dir = os.path.join(P["paths"]["work_dir"], "rf3_models" if STAGE == "initial" else "rf3_models_refine", "predictions")
 report_dir = P["paths"]["reports_dir"]
 os.makedirs(report_dir, exist_ok=True)
 
-FILT = P["filters"]["initial"]  # 或根据阶段切换到 refine
+FILT = P["filters"][STAGE]
 WEI  = P["ranking"]["weights"]
 NORM = P["ranking"]["norm"]
 
 REFERENCE = P["paths"]["reference_complex_for_mask"]
+# 所有结构经 utils.cached_structure 读取：每个文件只解析一次，各指标共用同一份数组
+CACHE_DIR = struct_cache_dir(P)
 # 从参考复合物中提取WDR4界面残基集合，用于遮挡率评估
-parser = PDBParser(QUIET=True)
-ref = parser.get_structure("R", REFERENCE)
-ref_chains = list(ref.get_chains())
+ref = cached_structure(REFERENCE, CACHE_DIR)
+ref_chains = ref.chain_ids()
 # 简化：取非METTL1链为“WDR4面”的接触残基集合
 mettl1_chain_id = None
 # 若有targets json则读
@@ -34,32 +36,23 @@ try:
     cand = json.load(open(os.path.join(P["paths"]["targets_dir"], "interface_candidates.json")))
     mettl1_chain_id = cand["mettl1_chain_id"]
 except:
-    mettl1_chain_id = ref_chains[0].id
+    mettl1_chain_id = ref_chains[0]
 
-def get_interface_mask(struct):
+def get_interface_mask(sa):
     # 返回目标界面点云（以WDR4接触面CA坐标）用于遮挡率估计
-    chains = list(struct.get_chains())
+    chains = sa.chain_ids()
     if len(chains) < 2:
         return np.zeros((0,3))
     # 选择METTL1链和另一条链
-    ch_m = [ch for ch in chains if ch.id == mettl1_chain_id]
-    if len(ch_m)==0: ch_m = [chains[0]]
-    ch_m = ch_m[0]
-    ch_o = [ch for ch in chains if ch.id != ch_m.id]
+    ch_m = mettl1_chain_id if mettl1_chain_id in chains else chains[0]
+    ch_o = [ch for ch in chains if ch != ch_m]
     if len(ch_o)==0: return np.zeros((0,3))
     ch_o = ch_o[0]
     # 界面：<8Å的残基CA
-    from scipy.spatial import cKDTree
-    A = np.array([a.coord for r in ch_m.get_residues() for a in r.get_atoms() if a.name=='CA'])
-    B = np.array([a.coord for r in ch_o.get_residues() for a in r.get_atoms() if a.name=='CA'])
+    A = sa.atom_coords(ch_m, "CA", standard_only=False)
+    B = sa.atom_coords(ch_o, "CA", standard_only=False)
     if len(A)==0 or len(B)==0: return np.zeros((0,3))
-    tree = cKDTree(A)
-    mask_pts=[]
-    for b in B:
-        d, idx = tree.query(b, k=1)
-        if d < 8.0:
-            mask_pts.append(b)
-    return np.array(mask_pts)
+    return B[nearest_distances(B, A) < 8.0]
 
 ref_mask = get_interface_mask(ref)
 
@@ -77,78 +70,42 @@ def get_pae_from_json(pae_json):
     # 简化：全均值
     return float(np.mean(d))
 
-def interface_bsa(pdbfile):
-    s = parser.get_structure("X", pdbfile)
-    chains = list(s.get_chains())
+def interface_bsa(sa):
+    chains = sa.chain_ids()
     if len(chains) < 2:
         return 0.0
     ch1, ch2 = chains[0], chains[1]
-
-    def sasa_of(struct):
-        tmp = f"tmp_sasa_{os.getpid()}.pdb"
-        io = PDBIO(); io.set_structure(struct); io.save(tmp)
-        fs = freesasa.Structure(tmp)
-        tot = freesasa.calc(fs).totalArea()
-        os.remove(tmp)
-        return tot
-
-    # complex
-    sc = sasa_of(s)
-    class OneChain(Select):
-        def __init__(self, cid): self.cid = cid
-        def accept_chain(self, chain): return chain.id == self.cid
-    io = PDBIO(); io.set_structure(s)
-    tmpA = f"tmpA_{os.getpid()}.pdb"; tmpB=f"tmpB_{os.getpid()}.pdb"
-    io.save(tmpA, OneChain(ch1.id)); io.save(tmpB, OneChain(ch2.id))
-    sa = sasa_of(parser.get_structure("A", tmpA))
-    sb = sasa_of(parser.get_structure("B", tmpB))
-    os.remove(tmpA); os.remove(tmpB)
-    return (sa + sb - sc) / 2.0
+    # 复合物与两条单链 SASA 直接由坐标数组计算，不写临时 PDB
+    return sasa_delta(*sasa_inputs_from_arrays(sa), chain_ids=[ch1, ch2]).buried_area(ch1, ch2)
 
 def plddt_interface_mean(rank_json, pdbfile):
     # 这里简化：直接用全局plddt均值代替界面plddt；可在后续细化
     iptm, plddt_mean = get_metrics_from_json(rank_json)
     return plddt_mean
 
-def clash_stats(pdbfile):
+def clash_stats(sa):
     # 计算界面最近原子距离分布（简化）
-    s = parser.get_structure("C", pdbfile)
-    chains = list(s.get_chains())
+    chains = sa.chain_ids()
     if len(chains) < 2: return (np.inf, np.inf)
-    A = [a for r in chains[0].get_residues() for a in r.get_atoms() if a.element != 'H']
-    B = [a for r in chains[1].get_residues() for a in r.get_atoms() if a.element != 'H']
-    ds=[]
-    for a in A:
-      ac = a.coord
-      mind = min(np.linalg.norm(ac - b.coord) for b in B)
-      ds.append(mind)
-    if len(ds)==0: return (np.inf, np.inf)
+    A = ChainAtoms.from_arrays(sa, chains[0], standard_only=False)
+    B = ChainAtoms.from_arrays(sa, chains[1], standard_only=False)
+    if len(A)==0 or len(B)==0: return (np.inf, np.inf)
+    ds = nearest_distances(A.coords, B)
     return (float(np.percentile(ds, 5)), float(np.median(ds)))
 
-def coverage_score(pdbfile, ref_mask_pts):
+def coverage_score(sa, ref_mask_pts):
     # 估算遮挡率：binder的表面CA点（或全部CA）对ref_mask的近邻覆盖比例
-    s = parser.get_structure("C", pdbfile)
-    chains = list(s.get_chains())
+    chains = sa.chain_ids()
     if len(chains) < 2 or len(ref_mask_pts)==0: return 0.0
-    binder = chains[1]
-    B = np.array([a.coord for r in binder.get_residues() for a in r.get_atoms() if a.name=='CA'])
+    B = sa.atom_coords(chains[1], "CA", standard_only=False)
     if len(B)==0: return 0.0
-    from scipy.spatial import cKDTree
-    tree = cKDTree(B)
-    covered=0
-    for p in ref_mask_pts:
-        d, idx = tree.query(p, k=1)
-        if d < 8.0:  # 8Å 视为覆盖
-            covered += 1
+    covered = int(np.count_nonzero(nearest_distances(ref_mask_pts, B) < 8.0))  # 8Å 视为覆盖
     return covered / len(ref_mask_pts)
 
-def length_of_binder(pdbfile):
-    s = parser.get_structure("L", pdbfile)
-    chains = list(s.get_chains())
+def length_of_binder(sa):
+    chains = sa.chain_ids()
     if len(chains)<2: return 0
-    binder = chains[1]
-    L = len([r for r in binder.get_residues() if r.id[0]==' '])
-    return L
+    return sa.residue_count(chains[1])
 
 def bsa_threshold_by_len(L, stage="initial"):
     cfg = P["filters"][stage]["bsa_min_by_len"]
@@ -166,14 +123,15 @@ for rankjson in glob.glob(os.path.join(pred_dir, "**/*ranking_debug.json"), recu
     pdbs = glob.glob(os.path.join(model_dir, "*.pdb"))
     if not pdbs: continue
     pdbf = pdbs[0]
+    sa = cached_structure(pdbf, CACHE_DIR)
     iptm, plddt_mean = get_metrics_from_json(rankjson)
     paei = get_pae_from_json(pae_jsons[0]) if pae_jsons else float('inf')
-    bsa = interface_bsa(pdbf)
-    Lb = length_of_binder(pdbf)
-    thr_bsa = bsa_threshold_by_len(Lb, stage="initial")
+    bsa = interface_bsa(sa)
+    Lb = length_of_binder(sa)
+    thr_bsa = bsa_threshold_by_len(Lb, stage=STAGE)
     plddt_int = plddt_interface_mean(rankjson, pdbf)
-    p5, med = clash_stats(pdbf)
-    cov = coverage_score(pdbf, ref_mask)
+    p5, med = clash_stats(sa)
+    cov = coverage_score(sa, ref_mask)
 
     passed = (iptm >= FILT["iptm_min"] and
               paei <= FILT["pae_inter_max"] and
@@ -195,11 +153,22 @@ for rankjson in glob.glob(os.path.join(pred_dir, "**/*ranking_debug.json"), recu
         iptm=iptm, paei=paei, bsa=bsa, plddt_int=plddt_int,
         clash_p5=p5, clash_median=med, coverage=cov,
         binder_len=Lb, bsa_thr=thr_bsa,
-        pass_initial=passed, score=score
+        **{f"pass_{STAGE}": passed}, score=score
     ))
 
-df = pd.DataFrame(rows).sort_values(["pass_initial","score","bsa","iptm","coverage"], ascending=[False,False,False,False,False])
-outcsv = os.path.join(report_dir, "af2_ranked_initial.csv")
+# 第 5 阶段把相同的 METTL1:binder 序列合并为一个预测任务（alias_map.tsv）；这里把结果展开回每个原始 MPNN 样本
+aliases = {}
+for sample, canon in read_alias_map(os.path.join(os.path.dirname(pred_dir), "alias_map.tsv")).items():
+    aliases.setdefault(canon, []).append(sample)
+fanned = []
+for r in rows:
+    canon = os.path.relpath(r["model_dir"], pred_dir).split(os.sep)[0]
+    for name in aliases.get(canon, [canon]):
+        fanned.append(dict(r, design=name, canonical=canon))
+rows = fanned
+
+df = pd.DataFrame(rows).sort_values([f"pass_{STAGE}","score","bsa","iptm","coverage"], ascending=[False,False,False,False,False])
+outcsv = os.path.join(report_dir, f"af2_ranked_{STAGE}.csv")
 df.to_csv(outcsv, index=False)
 print(df.head(20))
 print(f"[OK] Ranking written to {outcsv}")
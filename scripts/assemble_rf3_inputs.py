@@ -0,0 +1,131 @@
+# scripts/assemble_rf3_inputs.py
+# 第 5 阶段输入组装：一次流式读取所有 <mpnn_dir>/*/seqs/*.fa，每个 MPNN 样本对应一条 "METTL1:binder" 复合物序列。
+# 完全相同的复合物序列（不同样本/骨架间常见：采样温度低、种子固定）只生成一个 RF3 任务：
+#   <store>.ffdata/.ffindex      : 打包序列库（seq_store.py），每个规范任务一条 FASTA 记录，键为首次出现的样本名
+#                                  （<骨架>_sample_<id>），记录格式同原 awk 组装的 .fa
+#   <alias_map>                  : 每个样本一行 "sample\tcanonical\tseq_sha1"（规范任务指向自身），第 6 阶段据此把结果展开到全部别名
+#   --tasks_out                  : 每个规范任务一行 "task\t序列库绝对路径前缀\t复合物总长度"，供任务队列按长度分桶
+# 预选（可选）：按 FASTA 头中的 MPNN 分数（score / global_score，越低越好）只保留每个骨架前 --top_k 条、
+# 和/或全局分数不高于 --quantile 分位数的样本，其余样本不进入 RF3；全部样本的分数与是否入选写入 --selection_out。
+#
+#   python scripts/assemble_rf3_inputs.py <mpnn_dir> <target_seq_fa> <store> <alias_map>
+#          [--top_k N] [--quantile Q] [--score_field score] [--selection_out mpnn_selection.tsv] [--tasks_out tasks.tsv]
+import os, re, sys, glob, hashlib, argparse
+import numpy as np
+from seq_store import SeqStoreWriter
+
+SAMPLE_RE = re.compile(r"sample=([^, ]+)")
+
+def read_fasta(path):
+    """(header, sequence) 生成器；序列去掉所有空白。"""
+    header, chunks = None, []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(chunks)
+                header, chunks = line[1:].rstrip("\n"), []
+            else:
+                chunks.append("".join(line.split()))
+    if header is not None:
+        yield header, "".join(chunks)
+
+def mpnn_samples(mpnn_dir, score_field="score"):
+    """(样本名, 骨架名, binder 序列, MPNN 分数)，按文件路径排序；不含 sample= 的记录（原始序列）跳过，缺分数记为 inf。"""
+    score_re = re.compile(rf"(?:^|[\s,]){re.escape(score_field)}=([^,\s]+)")
+    for fa in sorted(glob.glob(os.path.join(mpnn_dir, "*", "seqs", "*.fa"))):
+        if "/.partial/" in fa or os.path.getsize(fa) == 0:
+            continue
+        backbone = os.path.basename(fa)[:-3]
+        for header, seq in read_fasta(fa):
+            m = SAMPLE_RE.search(header)
+            if m and seq:
+                sm = score_re.search(header)
+                try:
+                    score = float(sm.group(1)) if sm else float("inf")
+                except ValueError:
+                    score = float("inf")
+                yield f"{backbone}_sample_{m.group(1)}", backbone, seq, score
+
+def preselect(samples, top_k=0, quantile=1.0):
+    """返回入选样本名集合：每个骨架分数最低的 top_k 条（0 为不限），且分数不高于全局 quantile 分位数（1.0 为不限）。"""
+    keep = {s[0] for s in samples}
+    if top_k > 0:
+        by_bb = {}
+        for name, bb, _, score in samples:
+            by_bb.setdefault(bb, []).append((score, name))
+        keep = {name for v in by_bb.values() for _, name in sorted(v)[:top_k]}
+    if quantile < 1.0 and samples:
+        scores = np.array([s[3] for s in samples])
+        finite = scores[np.isfinite(scores)]
+        thr = float(np.quantile(finite, quantile)) if len(finite) else float("inf")
+        keep &= {s[0] for s in samples if s[3] <= thr}
+    return keep
+
+def read_alias_map(path):
+    """sample -> canonical；文件不存在时返回空字典（每个预测即自身）。"""
+    out = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 2:
+                    out[cols[0]] = cols[1]
+    return out
+
+def assemble(mpnn_dir, target_seq, store, alias_map, top_k=0, quantile=1.0, score_field="score", selection_out=None,
+             tasks_out=None):
+    os.makedirs(os.path.dirname(os.path.abspath(store)), exist_ok=True)
+    samples = list(mpnn_samples(mpnn_dir, score_field))
+    keep = preselect(samples, top_k, quantile)
+    if selection_out:
+        with open(f"{selection_out}.tmp", "w") as f:
+            f.write(f"sample\tbackbone\t{score_field}\tselected\n")
+            for name, bb, _, score in samples:
+                f.write(f"{name}\t{bb}\t{score}\t{name in keep}\n")
+        os.replace(f"{selection_out}.tmp", selection_out)
+    canonical = {}
+    n_samples = 0
+    tmp = f"{alias_map}.tmp"
+    tt = open(f"{tasks_out}.tmp", "w") if tasks_out else None
+    with open(tmp, "w") as am, SeqStoreWriter(store) as sw:
+        for name, _, seq, _ in samples:
+            if name not in keep:
+                continue
+            n_samples += 1
+            pair = f"{target_seq}:{seq}"
+            h = hashlib.sha1(pair.encode()).hexdigest()
+            if h not in canonical:
+                canonical[h] = name
+                sw.add(name, f">METTL1:{name}\n{pair}\n")
+                if tt:
+                    tt.write(f"{name}\t{os.path.abspath(store)}\t{len(target_seq) + len(seq)}\n")
+            am.write(f"{name}\t{canonical[h]}\t{h}\n")
+    os.replace(tmp, alias_map)
+    if tt:
+        tt.close()
+        os.replace(f"{tasks_out}.tmp", tasks_out)
+    return len(samples), n_samples, len(canonical)
+
+def main():
+    ap = argparse.ArgumentParser(description="第 5 阶段输入组装：MPNN 分数预选 + 相同序列合并")
+    ap.add_argument("mpnn_dir"); ap.add_argument("target_seq_fa")
+    ap.add_argument("store", help="打包序列库路径前缀（写出 <store>.ffdata / <store>.ffindex）"); ap.add_argument("alias_map")
+    ap.add_argument("--top_k", type=int, default=0, help="每个骨架保留分数最低的前 k 条（0 为不限）")
+    ap.add_argument("--quantile", type=float, default=1.0, help="只保留分数不高于该全局分位数的样本（1.0 为不限）")
+    ap.add_argument("--score_field", default="score", help="FASTA 头中的分数字段（score 或 global_score）")
+    ap.add_argument("--selection_out", default=None, help="全部样本分数与入选情况的 TSV")
+    ap.add_argument("--tasks_out", default=None, help="规范任务列表 TSV（任务名、FASTA 路径、复合物总长度）")
+    args = ap.parse_args()
+    target_seq = "".join(s for _, s in read_fasta(args.target_seq_fa))
+    if not target_seq:
+        print(f"[ERROR] Empty target sequence in {args.target_seq_fa}", file=sys.stderr)
+        sys.exit(1)
+    n_all, n, n_unique = assemble(args.mpnn_dir, target_seq, args.store, args.alias_map,
+                                  args.top_k, args.quantile, args.score_field, args.selection_out, args.tasks_out)
+    if n < n_all:
+        print(f"[INFO] MPNN score preselection ({args.score_field}, top_k={args.top_k}, quantile={args.quantile}): {n}/{n_all} samples kept")
+    print(f"[INFO] {n} MPNN samples -> {n_unique} unique METTL1:binder tasks ({n - n_unique} duplicates aliased, map: {args.alias_map})")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 # scripts/clash_check.py
-# 保持原始（轻量预筛）
+# 轻量 clash 计数（批量预筛见 03b_prefilter_backbones.py）
 import sys
 from Bio.PDB import PDBParser
 import numpy as np
+from scipy.spatial import cKDTree
 
 def calculate_clash(pdb_file, clash_threshold=1.5):
     parser = PDBParser(QUIET=True)
@@ -10,16 +11,12 @@ def calculate_clash(pdb_file, clash_threshold=1.5):
     chains = list(structure.get_chains())
     if len(chains) < 2:
         return 0
-    target_atoms = [atom for res in chains[0].get_residues() for atom in res if atom.element != 'H']
-    binder_atoms = [atom for res in chains[1].get_residues() for atom in res if atom.element != 'H']
-    clash_count = 0
-    for t_atom in target_atoms:
-        t_coord = t_atom.coord
-        for b_atom in binder_atoms:
-            dist = np.linalg.norm(t_coord - b_atom.coord)
-            if dist < clash_threshold:
-                clash_count += 1
-    return clash_count
+    target_atoms = np.array([atom.coord for res in chains[0].get_residues() for atom in res if atom.element != 'H']).reshape(-1, 3)
+    binder_atoms = np.array([atom.coord for res in chains[1].get_residues() for atom in res if atom.element != 'H']).reshape(-1, 3)
+    if len(target_atoms) == 0 or len(binder_atoms) == 0:
+        return 0
+    # 原子对计数用 KDTree 一次完成（距离严格小于阈值，与原双重循环一致）
+    return int(cKDTree(target_atoms).count_neighbors(cKDTree(binder_atoms), np.nextafter(clash_threshold, 0)))
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -1,20 +1,26 @@
 # scripts/get_chain_info.py
-# 保持原始逻辑
+# 默认输出保持原始逻辑（"目标链 binder链" 或 SKIP）；结构经 utils.cached_structure 读取，重复调用不再重新解析
+#   --segments CHAIN : 输出该链标准残基的连续区段，如 A36-55/A75-169
+#   --seq CHAIN      : 输出该链单字母序列
 import sys
-from Bio.PDB import PDBParser
+from utils import cached_structure
 
 if len(sys.argv) < 2:
-    print("Usage: python get_chain_info.py <pdb_file>")
+    print("Usage: python get_chain_info.py <pdb_file> [--segments CHAIN | --seq CHAIN]")
     sys.exit(1)
 
 pdb_file = sys.argv[1]
-p = PDBParser(QUIET=True)
-s = p.get_structure("X", pdb_file)
-chains = list(s.get_chains())
-lens = []
-for ch in chains:
-    nres = sum(1 for r in ch.get_residues() if r.id[0] == " ")
-    lens.append((ch.id, nres))
+sa = cached_structure(pdb_file)
+
+if len(sys.argv) >= 4 and sys.argv[2] == "--segments":
+    chain_id = sys.argv[3]
+    print("/".join(f"{chain_id}{a}-{b}" for a, b in sa.segments(chain_id)))
+    sys.exit(0)
+if len(sys.argv) >= 4 and sys.argv[2] == "--seq":
+    print(sa.sequence(sys.argv[3]))
+    sys.exit(0)
+
+lens = [(cid, sa.residue_count(cid)) for cid in sa.chain_ids()]
 lens.sort(key=lambda x: x[1], reverse=True)
 if len(lens) < 2:
     print("SKIP")
@@ -0,0 +1,196 @@
+# scripts/gpu_scheduler.py
+# 第 5 阶段显存感知准入（compute.mem_scheduler）：不再对任意长度的复合物都固定并发 workers_per_gpu 个 worker，
+# 而是按复合物总长度 L 估计每个任务的峰值显存 peak_mb = (a + b*L + c*L^2) * margin，在每个 GPU 的显存预算内装箱：
+#   预算   = 启动时空闲显存 - compute.gpu_mem_reserve_mb（低于 min_free_mem_mb_for_gpu 的 GPU 不用）
+#   准入   = worker 只领取估计值不超过本 GPU 剩余预算的任务（记账在 task_queue.py 的领取事务内完成）；
+#            GPU 上没有运行中的任务时总会放行一个任务，超出预算的长任务独占该 GPU
+#   并发   = workers_per_gpu 变为每 GPU 并发上限，短任务多时跑满上限，长任务多时自动少跑
+#   修正   = 任务完成时上报观测峰值，按全部观测重新拟合二次模型（观测到的长度不足 3 个时按比例缩放先验），
+#            拟合结果取观测/预测比的 95 分位放大，使模型偏向上包络；可存盘供下次运行作为先验
+# 资源探测可替换（compute.gpu_probe）：
+#   nvidia-smi              : 真实 GPU（--query-gpu 取空闲显存，--query-compute-apps 采样进程显存）
+#   fake:0=24576,1=16384    : 假 GPU 清单（id=空闲 MiB），用于在无 GPU 环境下检验调度
+#   <module>:<Class>        : 自定义探测器，提供 gpus() -> [(id, 空闲 MiB)] 与 process_mb(pids) -> MiB 或 None
+#
+#   python scripts/gpu_scheduler.py probe --probe SPEC [--gpus "0 1"] [--min_free MB] [--reserve MB] : 每个可用 GPU 一行 "gpu\t预算 MiB"
+#   python scripts/gpu_scheduler.py exec --probe SPEC --peak_out F -- cmd ...  : 运行命令并采样其进程树的显存峰值（MiB）写入 F
+import os, sys, json, argparse, subprocess, importlib
+import numpy as np
+
+DEFAULT_COEFFS = (3000.0, 2.0, 0.03)
+MAX_OBS = 2000
+
+class MemModel:
+    """峰值显存（MiB）关于复合物总长度的二次模型；prior 为先验系数，obs 为 [(长度, 观测峰值)]。"""
+    def __init__(self, coeffs=DEFAULT_COEFFS, margin=1.15, prior=None, obs=None):
+        self.coeffs = [float(x) for x in coeffs]
+        self.prior = [float(x) for x in (prior or coeffs)]
+        self.margin = float(margin)
+        self.obs = [tuple(o) for o in (obs or [])][-MAX_OBS:]
+
+    def raw(self, length, coeffs=None):
+        a, b, c = self.coeffs if coeffs is None else coeffs
+        return a + b * length + c * length * length
+
+    def predict(self, length):
+        return self.raw(length or 0) * self.margin
+
+    def refit(self, obs=()):
+        """用已有观测加上 obs 重新拟合；返回 self。"""
+        self.obs = (self.obs + [tuple(o) for o in obs])[-MAX_OBS:]
+        if not self.obs:
+            return self
+        L = np.array([o[0] for o in self.obs], dtype=float)
+        y = np.array([o[1] for o in self.obs], dtype=float)
+        coef = None
+        if len(np.unique(L)) >= 3:
+            X = np.stack([np.ones_like(L), L, L * L], axis=1)
+            coef = np.linalg.lstsq(X, y, rcond=None)[0]
+            # 负的二次项或截距外推到长复合物时会低估，退回按比例缩放先验
+            if coef[0] < 0 or coef[2] < 0:
+                coef = None
+        if coef is None:
+            coef = np.array(self.prior)
+        pred = np.maximum(self.raw(L, coef), 1.0)
+        coef = coef * float(np.quantile(y / pred, 0.95))
+        self.coeffs = [float(x) for x in coef]
+        return self
+
+    def to_dict(self):
+        return dict(coeffs=self.coeffs, prior=self.prior, margin=self.margin, obs=self.obs)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["coeffs"], d.get("margin", 1.15), d.get("prior"), d.get("obs"))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+def parse_coeffs(text):
+    vals = [float(x) for x in text.replace(",", " ").split()]
+    if len(vals) != 3:
+        raise ValueError(f"memory model needs 3 coefficients (a b c), got {text!r}")
+    return vals
+
+# ====================== 资源探测 ======================
+def process_tree(pid):
+    """pid 及其全部子孙进程（读 /proc）。"""
+    children = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(d))
+    out, todo = set(), [pid]
+    while todo:
+        p = todo.pop()
+        if p not in out:
+            out.add(p)
+            todo.extend(children.get(p, []))
+    return out
+
+class NvidiaSmiProbe:
+    def gpus(self):
+        out = subprocess.run(["nvidia-smi", "--query-gpu=index,memory.free", "--format=csv,noheader,nounits"],
+                             capture_output=True, text=True, check=True).stdout
+        rows = []
+        for line in out.splitlines():
+            cols = [c.strip() for c in line.split(",")]
+            if len(cols) == 2 and cols[1].isdigit():
+                rows.append((cols[0], int(cols[1])))
+        return rows
+
+    def process_mb(self, pids):
+        """pids 在各 GPU 上占用的显存之和；容器内 PID 命名空间不一致等原因查不到时返回 None。"""
+        try:
+            out = subprocess.run(["nvidia-smi", "--query-compute-apps=pid,used_memory", "--format=csv,noheader,nounits"],
+                                 capture_output=True, text=True, timeout=30).stdout
+        except (OSError, subprocess.SubprocessError):
+            return None
+        used = [int(m) for p, m in (l.split(",") for l in out.splitlines() if l.count(",") == 1)
+                if p.strip().isdigit() and int(p) in pids and m.strip().isdigit()]
+        return sum(used) if used else None
+
+class FakeProbe:
+    """fake:0=24576,1=16384 —— 固定的 GPU 清单，不采样进程显存。"""
+    def __init__(self, spec):
+        self.inventory = []
+        for item in spec.split(","):
+            gpu, _, mb = item.partition("=")
+            self.inventory.append((gpu.strip(), int(mb)))
+
+    def gpus(self):
+        return list(self.inventory)
+
+    def process_mb(self, pids):
+        return None
+
+PROBES = {"nvidia-smi": lambda arg: NvidiaSmiProbe(), "fake": FakeProbe}
+
+def make_probe(spec):
+    name, _, arg = (spec or "nvidia-smi").partition(":")
+    if name in PROBES:
+        return PROBES[name](arg)
+    # <module>:<Class>（scripts/ 下的模块或已安装的包）
+    return getattr(importlib.import_module(name), arg)()
+
+def gpu_budgets(probe, gpus=None, min_free=0, reserve=0):
+    """[(gpu, 空闲 MiB, 预算 MiB)]；只保留 gpus 中（为空则全部）且空闲显存不低于 min_free 的 GPU。"""
+    out = []
+    for gpu, free in probe.gpus():
+        if gpus and gpu not in gpus:
+            continue
+        ok = free >= min_free and free - reserve > 0
+        print(f"[{'INFO' if ok else 'WARN'}] GPU {gpu} free mem: {free} MiB. {'Accepted' if ok else 'Skipped'}.", file=sys.stderr)
+        if ok:
+            out.append((gpu, free, free - reserve))
+    return out
+
+def run_sampled(cmd, probe, interval=2.0):
+    """运行 cmd，按 interval 采样其进程树显存；返回 (返回码, 峰值 MiB 或 None)。"""
+    proc = subprocess.Popen(cmd)
+    peak = None
+    while True:
+        try:
+            rc = proc.wait(timeout=interval)
+            break
+        except subprocess.TimeoutExpired:
+            mb = probe.process_mb(process_tree(proc.pid))
+            if mb is not None:
+                peak = max(peak or 0, mb)
+    return rc, peak
+
+def main():
+    ap = argparse.ArgumentParser(description="第 5 阶段显存感知准入：GPU 预算探测与进程显存峰值采样")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("probe"); p.add_argument("--probe", default="nvidia-smi")
+    p.add_argument("--gpus", default="", help="只考虑这些 GPU（空格分隔，空为探测到的全部）")
+    p.add_argument("--min_free", type=int, default=0); p.add_argument("--reserve", type=int, default=0)
+    p = sub.add_parser("exec"); p.add_argument("--probe", default="nvidia-smi"); p.add_argument("--peak_out", required=True)
+    p.add_argument("--interval", type=float, default=2.0); p.add_argument("command", nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+    probe = make_probe(args.probe)
+    if args.cmd == "probe":
+        for gpu, _, budget in gpu_budgets(probe, args.gpus.split(), args.min_free, args.reserve):
+            print(f"{gpu}\t{budget}")
+    else:
+        cmd = args.command[1:] if args.command[:1] == ["--"] else args.command
+        rc, peak = run_sampled(cmd, probe, args.interval)
+        with open(args.peak_out, "w") as f:
+            f.write(f"{peak}\n" if peak is not None else "")
+        sys.exit(rc)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# scripts/index_backbones.py
+# 骨架清单（manifest）：对 rfdiffusion3_raw 下的骨架一次性建索引，下游阶段直接读清单，不再逐个起子进程解析 PDB。
+#   backbone_manifest.tsv            : 每个骨架一行（列见 COLUMNS）；target/binder 链沿用 get_chain_info 的约定；
+#                                      name 为相对 rfdiffusion3_raw 的路径（目录分隔符换成 "__"，去掉 .pdb），
+#                                      各组合目录下的 design_<k>_len<L>_0 同名，name 才唯一（第 4 阶段输出名、第 5 阶段样本名沿用）
+#   backbone_fixed_positions.jsonl   : 每行 {"pdb", "name", "fixed_positions": {链: [固定位置]}}，
+#                                      ProteinMPNN 语义（链内 1 起始序号）：靶点链全部固定，binder 链全部可设计
+# 热点组与长度区间取自第 3 阶段 tasks.jsonl（按 output_prefix 对应），没有时按目录名 _set-<i>_..._len-<a>-<b> 解析。
+# 增量：mtime/大小未变的骨架沿用上次的行，只对新增或改动的文件建索引（进程池）。
+#
+#   python scripts/index_backbones.py --params config/params.yaml [--processes N]   （打印清单路径）
+import os, re, sys, csv, json, argparse
+from utils import cached_structure, struct_cache_dir
+from resolve_params import load_params
+
+COLUMNS = ["pdb", "name", "mtime_ns", "size", "status", "chain_lens", "target_chain", "binder_chain",
+           "target_len", "binder_len", "target_segments", "hotspot_set", "len_bin"]
+MANIFEST = "backbone_manifest.tsv"
+FIXED_POS = "backbone_fixed_positions.jsonl"
+COMBO_RE = re.compile(r"_set-(\d+)_.*_len-(\d+-\d+)$")
+
+def list_backbones(rfdir):
+    out = []
+    for root, dirs, files in os.walk(rfdir):
+        dirs[:] = sorted(d for d in dirs if d not in ("traj", ".partial"))
+        out.extend(os.path.join(root, f) for f in files if f.endswith(".pdb"))
+    return sorted(out)
+
+def backbone_name(pdb, rfdir):
+    """骨架的唯一名：<组合目录>__design_<k>_len<L>_0。"""
+    return os.path.relpath(pdb, rfdir)[:-4].replace(os.sep, "__")
+
+def task_meta(rfdir):
+    """output_prefix_0.pdb -> (热点组序号, 长度区间)，来自 tasks.jsonl。"""
+    meta = {}
+    path = os.path.join(rfdir, "tasks.jsonl")
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                t = json.loads(line)
+                m = COMBO_RE.search(t["combo"])
+                if m:
+                    meta[t["output_prefix"] + "_0.pdb"] = (m.group(1), m.group(2))
+    return meta
+
+def index_one(args):
+    pdb, cache_dir = args
+    st = os.stat(pdb)
+    row = dict(pdb=pdb, mtime_ns=st.st_mtime_ns, size=st.st_size, status="SKIP")
+    try:
+        sa = cached_structure(pdb, cache_dir)
+        lens = [(c, sa.residue_count(c)) for c in sa.chain_ids()]
+    except Exception as e:
+        print(f"[WARN] index failed for {pdb}: {e}", file=sys.stderr)
+        return row, None
+    row["chain_lens"] = ";".join(f"{c}:{n}" for c, n in lens)
+    ranked = sorted(lens, key=lambda x: x[1], reverse=True)
+    if len(ranked) < 2:
+        return row, None
+    (tc, tn), (bc, bn) = ranked[0], ranked[1]
+    row.update(status="ok", target_chain=tc, binder_chain=bc, target_len=tn, binder_len=bn,
+               target_segments="/".join(f"{tc}{a}-{b}" for a, b in sa.segments(tc)))
+    fixed = {tc: list(range(1, tn + 1)), bc: []}
+    return row, fixed
+
+def load_manifest(rfdir):
+    """pdb -> 行（字符串字段）；清单不存在时返回空字典。"""
+    path = os.path.join(rfdir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="") as f:
+        return {r["pdb"]: r for r in csv.DictReader(f, delimiter="\t")}
+
+def load_fixed_positions(rfdir):
+    out = {}
+    path = os.path.join(rfdir, FIXED_POS)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                e = json.loads(line)
+                out[e["pdb"]] = e["fixed_positions"]
+    return out
+
+def build(rfdir, cache_dir, processes=None):
+    old, old_fixed = load_manifest(rfdir), load_fixed_positions(rfdir)
+    meta = task_meta(rfdir)
+    pdbs = list_backbones(rfdir)
+    rows, fixed, todo = {}, {}, []
+    for p in pdbs:
+        st = os.stat(p)
+        r = old.get(p)
+        if r and r["mtime_ns"] == str(st.st_mtime_ns) and r["size"] == str(st.st_size) \
+                and (r["status"] != "ok" or p in old_fixed):
+            rows[p] = r
+            if p in old_fixed:
+                fixed[p] = old_fixed[p]
+        else:
+            todo.append((p, cache_dir))
+    if len(todo) > 1 and processes != 1:
+        from multiprocessing import Pool
+        with Pool(processes) as pool:
+            results = pool.map(index_one, todo, chunksize=max(1, len(todo) // (4 * (processes or os.cpu_count() or 1))))
+    else:
+        results = [index_one(t) for t in todo]
+    for row, fx in results:
+        rows[row["pdb"]] = row
+        if fx is not None:
+            fixed[row["pdb"]] = fx
+    for p, r in rows.items():
+        r["name"] = backbone_name(p, rfdir)
+        m = meta.get(p)
+        if m is None:
+            mm = COMBO_RE.search(os.path.basename(os.path.dirname(p)))
+            m = mm.groups() if mm else ("", "")
+        r["hotspot_set"], r["len_bin"] = m
+
+    tmp = os.path.join(rfdir, MANIFEST + ".tmp")
+    with open(tmp, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=COLUMNS, delimiter="\t", extrasaction="ignore")
+        w.writeheader()
+        for p in pdbs:
+            w.writerow(rows[p])
+    os.replace(tmp, os.path.join(rfdir, MANIFEST))
+    tmp = os.path.join(rfdir, FIXED_POS + ".tmp")
+    with open(tmp, "w") as f:
+        for p in pdbs:
+            if p in fixed:
+                f.write(json.dumps(dict(pdb=p, name=rows[p]["name"], fixed_positions=fixed[p])) + "\n")
+    os.replace(tmp, os.path.join(rfdir, FIXED_POS))
+    return len(pdbs), len(todo)
+
+def main():
+    ap = argparse.ArgumentParser(description="RFdiffusion3 骨架清单（链、长度、区段、热点组、长度区间、固定位置）")
+    ap.add_argument("--params", required=True, help="config/params.yaml")
+    ap.add_argument("--processes", type=int, default=None, help="并行进程数（默认 CPU 核数）")
+    args = ap.parse_args()
+    P = load_params(args.params)
+    rfdir = os.path.join(P["paths"]["work_dir"], "rfdiffusion3_raw")
+    n, n_new = build(rfdir, struct_cache_dir(P), args.processes)
+    print(f"[OK] backbone manifest: {n} backbones ({n_new} indexed, {n - n_new} unchanged) -> {rfdir}/{MANIFEST}", file=sys.stderr)
+    print(os.path.join(rfdir, MANIFEST))
+
+if __name__ == "__main__":
+    main()
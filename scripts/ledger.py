@@ -0,0 +1,85 @@
+# scripts/ledger.py
+# 完成记录（ledger）：追加写入的 JSONL，每行 {"task_id", "input_hash", "outputs", "time"}。
+# 任务视为已完成当且仅当：ledger 中有相同 task_id 与 input_hash 的记录，且记录的输出文件全部存在。
+# 输出一律先写到临时路径再原子 rename，ledger 在 rename 之后才追加，因此中断时留下的半成品不会被当作完成。
+#
+#   python scripts/ledger.py pending <ledger> <tasks.tsv>                  : 打印未完成的任务行（第 1 列 task_id，最后一列 input_hash）
+#   python scripts/ledger.py pending-files <ledger> <key> [file...]       : 以文件内容 + key 作 input_hash，打印未完成的 "文件\thash"（未给文件时从 stdin 逐行读取）
+#   python scripts/ledger.py record <ledger> <task_id> <input_hash> <output>...
+import os, sys, json, time, hashlib
+
+def input_hash(*parts):
+    """任意可 JSON 序列化的输入 -> 稳定的 sha1。"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def file_input_hash(path, key=""):
+    h = hashlib.sha1(key.encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Ledger:
+    def __init__(self, path, load=True):
+        self.path = path
+        self.entries = {}
+        if load and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时可能留下不完整的最后一行
+                    self.entries[e["task_id"]] = e
+
+    def done(self, task_id, ihash):
+        e = self.entries.get(task_id)
+        return bool(e) and e["input_hash"] == ihash and all(os.path.exists(p) for p in e["outputs"])
+
+    def record(self, task_id, ihash, outputs):
+        e = dict(task_id=task_id, input_hash=ihash, outputs=list(outputs), time=round(time.time(), 1))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # O_APPEND 单次 write：多个并发写入者各自的行不会交错
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(e) + "\n").encode())
+        finally:
+            os.close(fd)
+        self.entries[task_id] = e
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: ledger.py {pending|pending-files|record} <ledger> ...", file=sys.stderr)
+        sys.exit(1)
+    cmd, path = sys.argv[1], sys.argv[2]
+    if cmd == "record":
+        Ledger(path, load=False).record(sys.argv[3], sys.argv[4], sys.argv[5:])
+    elif cmd == "pending":
+        L = Ledger(path)
+        n_done = 0
+        with open(sys.argv[3]) as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if L.done(cols[0], cols[-1]):
+                    n_done += 1
+                else:
+                    sys.stdout.write(line)
+        print(f"[INFO] ledger {path}: {n_done} tasks already complete", file=sys.stderr)
+    elif cmd == "pending-files":
+        L = Ledger(path)
+        key = sys.argv[3]
+        n_done = 0
+        files = sys.argv[4:] or [l.strip() for l in sys.stdin if l.strip()]
+        for p in files:
+            h = file_input_hash(p, key)
+            if L.done(p, h):
+                n_done += 1
+            else:
+                print(f"{p}\t{h}")
+        print(f"[INFO] ledger {path}: {n_done} tasks already complete", file=sys.stderr)
+    else:
+        print(f"[ERROR] unknown command {cmd}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
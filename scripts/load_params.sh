@@ -0,0 +1,30 @@
+# scripts/load_params.sh
+# 供各 bash 阶段 source：load_params <params.yaml>
+# 缓存 .<name>.env 比 yaml 与 resolve_params.py（SCHEMA）都新时直接 source（毫秒级，不启动 Python）；否则调用 resolve_params.py 校验并重建缓存。
+
+# env 缓存路径，与 resolve_params.py 的 cache_paths() 一致：配置所在目录可写时在配置旁，
+# 否则在 $TMPDIR/prev_nn_params/ 下，文件名前加配置绝对路径 sha1 的前 16 位
+params_env_path() {
+  local abs d base
+  abs=$(realpath -ms "$1")
+  d=$(dirname "$abs"); base=$(basename "$abs")
+  if [ ! -w "$d" ]; then
+    d="${TMPDIR:-${TEMP:-${TMP:-/tmp}}}/prev_nn_params"
+    base="$(printf '%s' "$abs" | sha1sum | cut -c1-16)_$base"
+  fi
+  echo "$d/.$base.env"
+}
+
+load_params() {
+  local params="$1"
+  local env_file
+  env_file=$(params_env_path "$params")
+  if [ ! -f "$env_file" ] || [ "$params" -nt "$env_file" ] || [ scripts/resolve_params.py -nt "$env_file" ]; then
+    env_file=$(python scripts/resolve_params.py "$params" --env) || return 1
+  fi
+  # shellcheck disable=SC1090
+  source "$env_file"
+  # 结构缓存目录（utils.struct_cache_dir 优先读此变量）：不带 params 的调用方（内联 python、get_chain_info.py）
+  # 与带 params 的脚本用同一个 paths.tmp_root/struct_cache；已设置时保留用户的值
+  export STRUCT_CACHE_DIR="${STRUCT_CACHE_DIR:-$(realpath -m "$P_PATHS_TMP_ROOT/struct_cache")}"
+}
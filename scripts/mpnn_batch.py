@@ -0,0 +1,138 @@
+# scripts/mpnn_batch.py
+# ProteinMPNN 批量模式（compute.mpnn_batched）：多个骨架合成一个分片，每个分片只启动一次 protein_mpnn_run.py（模型只加载一次）
+#   shard   : 从 stdin 读 "骨架\tinput_hash"，写出 N 个分片目录，每个含
+#               parsed.jsonl          : ProteinMPNN parse_multiple_chains 格式（由结构缓存生成，不重新解析 PDB）
+#               chain_ids.jsonl       : {name: [[binder 链], [其余链]]}，与逐个模式的 --pdb_path_chains 一致
+#               fixed_positions.jsonl : {name: {链: [固定位置]}}，取自骨架清单的 backbone_fixed_positions.jsonl
+#               members.tsv           : 骨架路径、name（骨架清单中的唯一名 <组合目录>__design_<k>_len<L>_0）、input_hash
+#             打印各分片目录
+#   collect : 分片运行完后把 <shard>/out/seqs/<name>.fa 移到 <outdir>/<name>/seqs/<name>.fa（与逐个模式相同的布局）并记入 ledger
+#
+#   python scripts/mpnn_batch.py shard --params P --out DIR --shards N < pending.tsv
+#   python scripts/mpnn_batch.py collect <shard_dir> <outdir> <ledger>
+import os, sys, json, argparse
+import numpy as np
+from utils import cached_structure, struct_cache_dir
+from ledger import Ledger
+from index_backbones import load_manifest, load_fixed_positions, backbone_name
+
+BB_ATOMS = ("N", "CA", "C", "O")
+AA3 = {"ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H", "ILE": "I",
+       "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P", "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V"}
+
+def parse_chains(sa, name):
+    """结构缓存 -> ProteinMPNN 解析格式。与 parse_PDB 一致：编号缺口补 "-" 与 NaN 坐标，非标准氨基酸记为 X。"""
+    out = {"name": name, "num_of_chains": 0, "seq": ""}
+    seqs = []
+    ri_atoms = sa.res_index
+    for cid in sa.chain_ids():
+        rmask = sa.residue_mask(cid)
+        ridx = np.nonzero(rmask)[0]
+        if len(ridx) == 0:
+            continue
+        nums = sa.res_seq[ridx].astype(int)
+        xyz = np.full((len(ridx), len(BB_ATOMS), 3), np.nan)
+        pos = np.full(len(sa.res_seq), -1, dtype=np.int64)
+        pos[ridx] = np.arange(len(ridx))
+        amask = rmask[ri_atoms]
+        for j, an in enumerate(BB_ATOMS):
+            m = amask & (sa.atom_name == an)
+            xyz[pos[ri_atoms[m]], j] = sa.coords[m]
+        letters = [AA3.get(str(rn).strip(), "X") for rn in sa.res_name[ridx]]
+        # 编号缺口：按 min..max 展开
+        span = nums.max() - nums.min() + 1
+        if span > len(nums) and len(set(nums.tolist())) == len(nums):
+            full = np.full((span, len(BB_ATOMS), 3), np.nan)
+            full[nums - nums.min()] = xyz
+            seq = ["-"] * span
+            for k, n in enumerate(nums):
+                seq[n - nums.min()] = letters[k]
+            xyz, letters = full, seq
+        seq = "".join(letters)
+        out[f"seq_chain_{cid}"] = seq
+        out[f"coords_chain_{cid}"] = {f"{an}_chain_{cid}": xyz[:, j].round(3).tolist() for j, an in enumerate(BB_ATOMS)}
+        out["num_of_chains"] += 1
+        seqs.append(seq)
+    out["seq"] = "".join(seqs)
+    return out
+
+def assign_shards(items, n):
+    """轮询分配（name 取自骨架清单，已含组合目录，各分片内不会重名）。"""
+    shards = [[] for _ in range(max(1, n))]
+    for k, it in enumerate(items):
+        shards[k % len(shards)].append(it)
+    return [s for s in shards if s]
+
+def write_shards(pending, out_dir, n_shards, cache_dir, rfdir):
+    manifest, fixed_all = load_manifest(rfdir), load_fixed_positions(rfdir)
+    items = []
+    for pdb, ihash in pending:
+        items.append((pdb, manifest.get(pdb, {}).get("name") or backbone_name(pdb, rfdir), ihash))
+    dirs = []
+    for i, members in enumerate(assign_shards(items, n_shards)):
+        d = os.path.join(out_dir, f"shard_{i:03d}")
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, "parsed.jsonl"), "w") as fp, \
+             open(os.path.join(d, "members.tsv"), "w") as fm:
+            chain_ids, fixed = {}, {}
+            for pdb, name, ihash in members:
+                bcid = manifest.get(pdb, {}).get("binder_chain")
+                if not bcid:
+                    print(f"[WARN] Skip {pdb} (chain_info issue)", file=sys.stderr)
+                    continue
+                parsed = parse_chains(cached_structure(pdb, cache_dir), name)
+                others = [k[len("seq_chain_"):] for k in parsed if k.startswith("seq_chain_") and k != f"seq_chain_{bcid}"]
+                fp.write(json.dumps(parsed) + "\n")
+                chain_ids[name] = [[bcid], others]
+                fixed[name] = fixed_all.get(pdb, {bcid: []})
+                fm.write(f"{pdb}\t{name}\t{ihash}\n")
+        with open(os.path.join(d, "chain_ids.jsonl"), "w") as f:
+            f.write(json.dumps(chain_ids) + "\n")
+        with open(os.path.join(d, "fixed_positions.jsonl"), "w") as f:
+            f.write(json.dumps(fixed) + "\n")
+        if chain_ids:
+            dirs.append(d)
+    return dirs
+
+def collect(shard_dir, outdir, ledger_path):
+    L = Ledger(ledger_path, load=False)
+    n_ok = n_miss = 0
+    with open(os.path.join(shard_dir, "members.tsv")) as f:
+        for line in f:
+            pdb, name, ihash = line.rstrip("\n").split("\t")
+            src = os.path.join(shard_dir, "out", "seqs", f"{name}.fa")
+            if not os.path.exists(src):
+                print(f"[ERROR] MPNN output missing for {pdb}", file=sys.stderr)
+                n_miss += 1
+                continue
+            dst = os.path.join(outdir, name, "seqs", f"{name}.fa")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            L.record(pdb, ihash, [dst])
+            n_ok += 1
+    print(f"[OK] {os.path.basename(shard_dir)}: {n_ok} backbones collected, {n_miss} missing")
+    return 1 if n_miss else 0
+
+def main():
+    ap = argparse.ArgumentParser(description="ProteinMPNN 批量模式：分片输入生成与结果回收")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("shard")
+    s.add_argument("--params", required=True)
+    s.add_argument("--out", required=True, help="分片根目录")
+    s.add_argument("--shards", type=int, default=1, help="分片数（通常为 GPU 数 × compute.mpnn_shards_per_gpu）")
+    c = sub.add_parser("collect")
+    c.add_argument("shard_dir"); c.add_argument("outdir"); c.add_argument("ledger")
+    args = ap.parse_args()
+
+    if args.cmd == "shard":
+        from resolve_params import load_params
+        P = load_params(args.params)
+        pending = [l.rstrip("\n").split("\t")[:2] for l in sys.stdin if l.strip()]
+        rfdir = os.path.join(P["paths"]["work_dir"], "rfdiffusion3_raw")
+        for d in write_shards(pending, args.out, args.shards, struct_cache_dir(P), rfdir):
+            print(d)
+    else:
+        sys.exit(collect(args.shard_dir, args.outdir, args.ledger))
+
+if __name__ == "__main__":
+    main()
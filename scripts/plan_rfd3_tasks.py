@@ -0,0 +1,90 @@
+# scripts/plan_rfd3_tasks.py
+# 第 3 阶段任务计划编译：热点组 × 长度区间 × 设计序号 展开为一份确定性的 JSONL 任务清单。
+# 长度与原脚本逐个设计调用的 random.seed(100000+k); randint(lmin, lmax) 完全一致（输出文件名不变），
+# 种子由 task_id 的 crc32 得到，同一配置重复编译结果逐字节相同。
+# input_hash 覆盖任务参数、rfdd3 配置与靶点 PDB 内容，供 ledger.py 判断断点续跑时哪些任务可以跳过。
+#   --out  : JSONL，每行一个任务（rfd3_worker.py 输入）
+#   --tsv  : 可选，同一清单的制表符分隔视图 task_id, output_prefix, contig, hotspots, length, seed, input_hash（供 bash 调度读取）
+import os, sys, json, zlib, random, argparse
+
+from utils import cached_structure, struct_cache_dir, file_sha1
+from ledger import input_hash
+from resolve_params import load_params
+
+# 只影响调度、不影响输出的 rfdd3 键，不计入 input_hash
+SCHEDULING_KEYS = ("persistent_workers", "persistent_slots_per_gpu", "tasks_per_gpu")
+
+def design_length(k, lmin, lmax):
+    rng = random.Random(100000 + k)
+    return rng.randint(lmin, lmax)
+
+def compile_plan(hotsets, lenbins, per_combo, batch_id, outdir, segments, context=None):
+    """返回任务列表；顺序为 热点组 -> 长度区间 -> k，与原先的嵌套循环一致。
+    context 为影响输出但不属于单个任务的输入（模型配置、靶点哈希），并入每个任务的 input_hash。"""
+    tasks = []
+    for idx, S in enumerate(hotsets):
+        hot = S["hotspot_res_str"].replace(":", "")
+        for b in lenbins:
+            lmin, lmax = int(b["min"]), int(b["max"])
+            combo = f"batch-{batch_id}_set-{idx}_hs-{S['hotspot_count']}_len-{lmin}-{lmax}"
+            for k in range(1, per_combo + 1):
+                L = design_length(k, lmin, lmax)
+                task_id = f"{combo}/design_{k}"
+                t = dict(task_id=task_id,
+                         combo=combo,
+                         output_prefix=os.path.join(outdir, combo, f"design_{k}_len{L}"),
+                         contig=f"[{segments}/0 {L}-{L}/0]",
+                         hotspots=hot,
+                         length=L,
+                         seed=zlib.crc32(task_id.encode()) & 0x7FFFFFFF)
+                t["input_hash"] = input_hash(t, context)
+                tasks.append(t)
+    return tasks
+
+def write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def parse_args():
+    p = argparse.ArgumentParser(description="编译第 3 阶段确定性任务清单")
+    p.add_argument("--params", required=True, help="config/params.yaml")
+    p.add_argument("--out", default=None, help="清单输出路径（默认 <work_dir>/rfdiffusion3_raw/tasks.jsonl）")
+    p.add_argument("--tsv", default=None, help="同时写出 TSV 视图")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    P = load_params(args.params)
+    targets_dir = P["paths"]["targets_dir"]
+    outdir = os.path.join(P["paths"]["work_dir"], "rfdiffusion3_raw")
+    with open(os.path.join(targets_dir, "interface_candidates.json")) as f:
+        cand = json.load(f)
+    with open(os.path.join(targets_dir, "hotspots_sets.json")) as f:
+        hotsets = json.load(f)
+
+    chain = cand["mettl1_chain_id"]
+    segs = cached_structure(cand["mettl1_target_pdb"], struct_cache_dir(P)).segments(chain)
+    if not segs:
+        print(f"[ERROR] no residue segments for chain {chain} in {cand['mettl1_target_pdb']}", file=sys.stderr)
+        sys.exit(1)
+    segments = "/".join(f"{chain}{a}-{b}" for a, b in segs)
+
+    tasks = compile_plan(hotsets, P["project"]["length_bins"], int(P["scale"]["rfdesigns_per_combo_per_lenbin"]),
+                         P["project"]["batch_id"], outdir, segments,
+                         context=dict(rfdd3={k: v for k, v in P["rfdd3"].items() if k not in SCHEDULING_KEYS},
+                                      target=file_sha1(cand["mettl1_target_pdb"])))
+    for combo in dict.fromkeys(t["combo"] for t in tasks):
+        os.makedirs(os.path.join(outdir, combo), exist_ok=True)
+
+    out = args.out or os.path.join(outdir, "tasks.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    write_atomic(out, "".join(json.dumps(t) + "\n" for t in tasks))
+    if args.tsv:
+        cols = ("task_id", "output_prefix", "contig", "hotspots", "length", "seed", "input_hash")
+        write_atomic(args.tsv, "".join("\t".join(str(t[c]) for c in cols) + "\n" for t in tasks))
+    print(f"[OK] {len(tasks)} tasks ({len(hotsets)} hotspot sets x {len(P['project']['length_bins'])} length bins) -> {out}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
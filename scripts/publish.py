@@ -0,0 +1,92 @@
+# scripts/publish.py
+# 第 5 阶段结果增量发布：每个预测完成后立即从 worker 暂存目录原子地移入最终位置 <dest_root>/<task>/，
+# 不再等全部 worker 结束后统一 mv / cp -r 合并（最慢的 worker 拖住排名，cp 合并使 I/O 翻倍）。
+#   1. 在暂存目录内写完成标记 .published（json：任务、worker、时间；点文件，不影响第 6 阶段的 glob）
+#   2. rename 到 <dest_root>/<task>（暂存目录与 predictions 在同一文件系统，读者要么看不到、要么看到完整目录）；
+#      目标已存在（重做的任务 / 上次运行的结果）时先把旧目录 rename 到旁边再换入，随后删除旧目录；
+#      跨文件系统（EXDEV）时退回复制到 <dest_root>/.<task>.tmp 再 rename
+#   3. 向 events.jsonl 追加一行 {"event": "published", "task", "path", "worker", "time"}（flock 串行追加）
+# 下游（排名等）可跟踪 events.jsonl，在预测进行中增量处理结果；第 5 阶段结束时追加 {"event": "finished"}。
+#
+#   python scripts/publish.py publish <stage_dir> <dest_root> <task> --events F [--worker W]
+#   python scripts/publish.py event <events.jsonl> <name>             : 追加一条事件（如 started / finished）
+#   python scripts/publish.py events <events.jsonl> [--follow]        : 每行打印一个已发布结果的路径；--follow 持续等待直到 finished
+import os, json, time, errno, fcntl, shutil, argparse
+
+MARKER = ".published"
+
+def append_event(events, event, **fields):
+    rec = dict(event=event, time=time.time(), **fields)
+    os.makedirs(os.path.dirname(os.path.abspath(events)), exist_ok=True)
+    with open(events, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(rec) + "\n")
+        f.flush()
+    return rec
+
+def publish(stage_dir, dest_root, task, events=None, worker=""):
+    """把 stage_dir 原子地发布为 dest_root/task，返回最终路径。"""
+    dest = os.path.join(dest_root, task)
+    with open(os.path.join(stage_dir, MARKER), "w") as f:
+        json.dump(dict(task=task, worker=worker, time=time.time()), f)
+    os.makedirs(dest_root, exist_ok=True)
+    old = None
+    if os.path.exists(dest):
+        old = os.path.join(dest_root, f".{task}.old.{os.getpid()}")
+        os.rename(dest, old)
+    try:
+        os.rename(stage_dir, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            if old:
+                os.rename(old, dest)
+            raise
+        tmp = os.path.join(dest_root, f".{task}.tmp.{os.getpid()}")
+        shutil.copytree(stage_dir, tmp)
+        os.rename(tmp, dest)
+        shutil.rmtree(stage_dir)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+    if events:
+        append_event(events, "published", task=task, path=os.path.abspath(dest), worker=worker)
+    return dest
+
+def iter_events(events, offset=0):
+    """(事件, 下一次读取的偏移)；只返回完整的行（正在追加的半行留到下次）。"""
+    if not os.path.exists(events):
+        return
+    with open(events, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            yield json.loads(line), offset
+
+def main():
+    ap = argparse.ArgumentParser(description="第 5 阶段结果增量发布（同文件系统 rename + 完成标记 + 事件记录）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("publish"); p.add_argument("stage_dir"); p.add_argument("dest_root"); p.add_argument("task")
+    p.add_argument("--events", default=None); p.add_argument("--worker", default="")
+    p = sub.add_parser("event"); p.add_argument("events"); p.add_argument("name")
+    p = sub.add_parser("events"); p.add_argument("events"); p.add_argument("--follow", action="store_true")
+    p.add_argument("--poll", type=float, default=5.0)
+    args = ap.parse_args()
+    if args.cmd == "publish":
+        print(publish(args.stage_dir, args.dest_root, args.task, args.events, args.worker))
+    elif args.cmd == "event":
+        append_event(args.events, args.name)
+    else:
+        offset = 0
+        while True:
+            for ev, offset in iter_events(args.events, offset):
+                if ev["event"] == "published":
+                    print(ev["path"], flush=True)
+                elif ev["event"] == "finished":
+                    return
+            if not args.follow:
+                return
+            time.sleep(args.poll)
+
+if __name__ == "__main__":
+    main()
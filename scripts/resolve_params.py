@@ -0,0 +1,218 @@
+# scripts/resolve_params.py
+# 配置一次性解析：按 SCHEMA 校验类型、补齐默认值，结果缓存在配置文件旁边（以 mtime/大小为键）：
+#   config/.params.yaml.resolved.json : Python 阶段（load_params）直接读取，缓存有效时无需解析 YAML
+#   config/.params.yaml.env           : bash 阶段经 scripts/load_params.sh source，缓存有效时不启动解释器
+# 变量命名：P_<键路径大写，点换成下划线>，如 paths.work_dir -> P_PATHS_WORK_DIR；
+# 标量列表以空格连接（compute.gpus -> "0 1 2 3"），其余列表/字典输出 JSON；布尔值统一为 true/false。
+# 缓存键另含 SCHEMA 指纹；配置目录不可写时缓存落到 $TMPDIR/prev_nn_params/。
+#
+# 用法：python scripts/resolve_params.py <params.yaml> [--env | --json]   （打印缓存文件路径）
+import os, sys, json, shlex, hashlib, tempfile
+
+REQUIRED = object()
+
+def _default_tasks_per_gpu(P):
+    return P["compute"]["max_concurrent_rf3"]
+
+# 键路径 -> (类型, 默认值)；默认值为 REQUIRED 表示必须提供，为函数时由已解析的其它键推出
+SCHEMA = {
+    "project.batch_id": (str, REQUIRED),
+    "project.seed": (int, 42),
+    "project.use_template": (bool, True),
+    "project.hotspot_count_grid": (list, [8, 12]),
+    "project.length_bins": (list, REQUIRED),
+    "paths.work_dir": (str, REQUIRED),
+    "paths.targets_dir": (str, REQUIRED),
+    "paths.reports_dir": (str, REQUIRED),
+    "paths.tmp_root": (str, "./outputs/tmp"),
+    "paths.templates_dir": (str, "./data/templates"),
+    "paths.rfdiffusion3_repo": (str, "./external/RFdiffusion3"),
+    "paths.proteinmpnn": (str, "./external/ProteinMPNN/protein_mpnn_run.py"),
+    "paths.rosettafold3_repo": (str, "./external/RosettaFold3"),
+    "scale.rfdesigns_per_combo_per_lenbin": (int, 50),
+    "scale.mpnn_num_seq_per_backbone_initial": (int, 5),
+    "scale.mpnn_num_seq_per_backbone_refine": (int, 50),
+    "scale.keep_backbone_top_fraction": (float, 0.2),
+    "scale.max_backbones_refine": (int, 500),
+    "scale.dedup_rmsd_threshold": (float, 0.0),
+    "rfdd3.model_only_neighbors": (bool, True),
+    "rfdd3.neighborhood_radius": (float, 11.0),
+    "rfdd3.inference_T": (int, 50),
+    "rfdd3.diffusion_schedule": (str, "linear"),
+    "rfdd3.model_version": (str, "v3"),
+    "rfdd3.persistent_workers": (bool, False),
+    "rfdd3.persistent_slots_per_gpu": (int, 1),
+    "rf3.persistent_workers": (bool, False),
+    "target_features.enabled": (bool, False),
+    "target_features.msa_source": (str, ""),
+    "target_features.cache_dir": (str, ""),
+    "prefilter.enabled": (bool, False),
+    "prefilter.clash_dist": (float, 3.0),
+    "prefilter.max_clashes": (int, 2),
+    "prefilter.hotspot_dist": (float, 10.0),
+    "prefilter.min_hotspot_fraction": (float, 0.3),
+    "prefilter.rg_coeff": (float, 3.0),
+    "prefilter.interface_ca_dist": (float, 10.0),
+    "prefilter.min_interface_ca": (int, 8),
+    "mpnn_select.top_k_per_backbone": (int, 0),
+    "mpnn_select.score_quantile": (float, 1.0),
+    "mpnn_select.score_field": (str, "score"),
+    "compute.gpus": (list, []),
+    "compute.halt_on_fail": (bool, False),
+    "compute.workers_per_gpu": (int, 1),
+    "compute.max_concurrent_rf3": (int, 1),
+    "compute.max_concurrent_mpnn": (int, 1),
+    "compute.mpnn_batched": (bool, False),
+    "compute.mpnn_shards_per_gpu": (int, 1),
+    "compute.min_free_mem_mb_for_gpu": (int, 0),
+    "compute.task_lease_s": (int, 900),
+    "compute.task_max_attempts": (int, 2),
+    "compute.length_bucket_width": (int, 10),
+    "compute.af2_tasks_per_call": (int, 8),
+    "compute.mem_scheduler": (bool, False),
+    "compute.gpu_probe": (str, "nvidia-smi"),
+    "compute.mem_model": (list, [3000.0, 2.0, 0.03]),
+    "compute.mem_margin": (float, 1.15),
+    "compute.gpu_mem_reserve_mb": (int, 1024),
+    # 第 3 阶段每 GPU 并发数；原先直接借用 compute.max_concurrent_rf3，未设置时仍回退到它
+    "rfdd3.tasks_per_gpu": (int, _default_tasks_per_gpu),
+}
+
+# SCHEMA 变化时缓存随之失效
+SCHEMA_VERSION = hashlib.sha1(repr([(k, t.__name__, d if not callable(d) else d.__name__)
+                                    for k, (t, d) in SCHEMA.items() if d is not REQUIRED]).encode()).hexdigest()[:12]
+
+class ConfigError(ValueError):
+    pass
+
+def _coerce(key, typ, v):
+    if typ is bool:
+        if isinstance(v, bool):
+            return v
+        if isinstance(v, str) and v.lower() in ("true", "false"):
+            return v.lower() == "true"
+    elif typ is int:
+        if isinstance(v, int) and not isinstance(v, bool):
+            return v
+        if isinstance(v, float) and v.is_integer():
+            return int(v)
+    elif typ is float:
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return float(v)
+    elif typ is str:
+        if isinstance(v, (str, int, float)) and not isinstance(v, bool):
+            return str(v)
+    elif isinstance(v, typ):
+        return v
+    raise ConfigError(f"{key}: expected {typ.__name__}, got {type(v).__name__} ({v!r})")
+
+def resolve(P):
+    """校验并补齐 SCHEMA 中的键，返回新的配置树（未声明的键原样保留）。"""
+    P = json.loads(json.dumps(P or {}))
+    errors, derived = [], []
+    for key, (typ, default) in SCHEMA.items():
+        *parents, leaf = key.split(".")
+        node = P
+        for k in parents:
+            if not isinstance(node.get(k), dict):
+                node[k] = {}
+            node = node[k]
+        if node.get(leaf) is None:
+            if default is REQUIRED:
+                errors.append(f"{key}: required")
+            elif callable(default):
+                derived.append((node, leaf, key, typ, default))
+            else:
+                node[leaf] = default
+            continue
+        try:
+            node[leaf] = _coerce(key, typ, node[leaf])
+        except ConfigError as e:
+            errors.append(str(e))
+    if errors:
+        raise ConfigError("invalid config:\n  " + "\n  ".join(errors))
+    for node, leaf, key, typ, default in derived:
+        node[leaf] = _coerce(key, typ, default(P))
+    return P
+
+def _env_name(path):
+    return "P_" + "_".join("".join(c if c.isalnum() else "_" for c in k) for k in path).upper()
+
+def _env_value(v):
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, list) and all(isinstance(x, (str, int, float)) and not isinstance(x, bool) for x in v):
+        return " ".join(str(x) for x in v)
+    if isinstance(v, (list, dict)):
+        return json.dumps(v)
+    return "" if v is None else str(v)
+
+def to_env(P, path=()):
+    """展开为 (变量名, 值) 列表；字典递归展开，同时给出整体 JSON 以便按需读取子树。"""
+    out = []
+    for k, v in P.items():
+        p = path + (str(k),)
+        if isinstance(v, dict):
+            out.extend(to_env(v, p))
+        out.append((_env_name(p), _env_value(v)))
+    return out
+
+def cache_paths(params_path):
+    """(json 缓存, env 缓存) 路径；load_params.sh 的 params_env_path 按同样规则计算 env 路径，改动时两处同步。"""
+    d, base = os.path.split(os.path.abspath(params_path))
+    if not os.access(d, os.W_OK):
+        d = os.path.join(tempfile.gettempdir(), "prev_nn_params")
+        base = hashlib.sha1(os.path.abspath(params_path).encode()).hexdigest()[:16] + "_" + base
+        os.makedirs(d, exist_ok=True)
+    return os.path.join(d, f".{base}.resolved.json"), os.path.join(d, f".{base}.env")
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _write_env(env_path, P, params_path):
+    lines = [f"# generated by scripts/resolve_params.py from {os.path.abspath(params_path)}; do not edit\n"]
+    lines += [f"{k}={shlex.quote(v)}\n" for k, v in to_env(P)]
+    _write_atomic(env_path, "".join(lines))
+
+def load_params(params_path):
+    """读取并校验配置；缓存（json + env）与源文件 mtime/大小一致时直接复用。"""
+    st = os.stat(params_path)
+    key = [st.st_mtime_ns, st.st_size, SCHEMA_VERSION]
+    json_path, env_path = cache_paths(params_path)
+    try:
+        with open(json_path) as f:
+            cached = json.load(f)
+        if cached.get("source") == key and os.path.exists(env_path):
+            if os.path.getmtime(env_path) < os.path.getmtime(__file__):
+                _write_env(env_path, cached["params"], params_path)  # 让 load_params.sh 的 mtime 快速路径重新生效
+            return cached["params"]
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import yaml
+    except Exception:
+        raise SystemExit("Please pip install pyyaml")
+    with open(params_path) as f:
+        P = resolve(yaml.safe_load(f))
+    _write_env(env_path, P, params_path)
+    _write_atomic(json_path, json.dumps({"source": key, "params": P}))
+    return P
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: resolve_params.py <params.yaml> [--env | --json]", file=sys.stderr)
+        sys.exit(1)
+    try:
+        load_params(sys.argv[1])
+    except ConfigError as e:
+        print(f"[ERROR] {sys.argv[1]}: {e}", file=sys.stderr)
+        sys.exit(1)
+    json_path, env_path = cache_paths(sys.argv[1])
+    print(json_path if "--json" in sys.argv[2:] else env_path)
+
+if __name__ == "__main__":
+    main()
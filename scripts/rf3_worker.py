@@ -0,0 +1,252 @@
+# scripts/rf3_worker.py
+# 常驻 RosettaFold3 worker（rf3.persistent_workers）：每个 GPU 子 worker 一个进程，解释器、CUDA 上下文与模型只初始化一次，
+# 之后从第 5 阶段共享队列（task_queue.py）逐个领取任务（记录取自打包序列库 seq_store.py），每个预测写入 <output_dir>/<task_id>/；
+# 给出 --publish_dir 时每个完成的预测立即原子地发布到 <publish_dir>/<task_id>/ 并记入 --events（publish.py）；
+# 单个任务失败只把该任务交回队列（或记为 failed），不影响后续任务。
+#
+# 与 RF3 安装的接口（$RF3_REPO/run_rf3.py 作为模块导入一次）：
+#   运行中的任务记录写到队列目录下 input_<worker>/<task_id>.fa，任务结束即删除
+#   - 若模块提供 load_model(num_models, num_recycles, use_templates) 与 predict(model, input_fasta, output_dir)，
+#     权重只加载一次，之后每个任务只调用 predict；load_model 接受 target_features 参数时传入靶点特征缓存
+#     （target_features.py 的缓存目录：target.a3m / target.hhr / meta.json），靶点部分只加载一次
+#   - 否则每个任务在同一进程内调用 main()，sys.argv 与逐任务模式的命令行相同（省去进程启动与 import，权重由 run_rf3.py 自行决定是否缓存）；
+#     run_rf3.py 有 --target_features 参数时同样传入靶点特征缓存
+#   05_run_rf3.sh 用 target_features_consumer() 判断安装的 run_rf3.py 是否读取缓存，不读取时不构建缓存
+# --mock 使用 CPU 假预测器（写出 ranking_debug.json / pae.json / 模型 PDB，格式与第 6 阶段读取的一致），用于在无 GPU 环境下检验批处理与错误处理。
+# --gpu：显存准入（compute.mem_scheduler，见 gpu_scheduler.py），只领取估计峰值放得进本 GPU 剩余预算的任务，完成时上报观测峰值
+#   （torch 已加载时取 max_memory_reserved，否则由 --probe 采样本进程显存；假预测器按固定的二次式给出合成峰值）。
+#
+#   python scripts/rf3_worker.py --queue run/queue.sqlite --worker gpu_0_sub_0 --output_dir DIR --rf3_repo R \
+#          [--num_models N --num_recycles N --use_templates true] [--lease S] [--halt_on_fail] [--mock [--mock_fail PAT]]
+#          [--gpu G --probe nvidia-smi] [--publish_dir predictions --events events.jsonl]
+import os, sys, json, time, shutil, hashlib, argparse, threading, traceback
+import ast, inspect, importlib.util
+import numpy as np
+
+from task_queue import TaskQueue, heartbeat
+from seq_store import SeqStore
+from gpu_scheduler import make_probe
+from publish import publish
+
+def read_pair(fasta):
+    """组装好的任务 FASTA（>METTL1:<name> / 靶点:binder）-> (靶点序列, binder 序列)。"""
+    with open(fasta) as f:
+        seq = "".join(l.strip() for l in f if not l.startswith(">"))
+    target, _, binder = seq.partition(":")
+    return target, binder
+
+def target_features_consumer(repo, persistent=False):
+    """run_rf3.py 读取靶点特征缓存的入口（解析源码，不导入）："load_model"（常驻 worker 且 load_model 有 target_features 参数）、
+    "--target_features"（命令行参数，逐任务模式或常驻 worker 的 main() 路径）或 ""（不读取）。"""
+    try:
+        with open(os.path.join(repo, "run_rf3.py")) as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError):
+        return ""
+    funcs = {n.name: n for n in tree.body if isinstance(n, ast.FunctionDef)}
+    if persistent and "load_model" in funcs and "predict" in funcs:
+        a = funcs["load_model"].args
+        return "load_model" if "target_features" in [x.arg for x in a.args + a.kwonlyargs] else ""
+    flag = any(isinstance(n, ast.Constant) and n.value == "--target_features" for n in ast.walk(tree))
+    return "--target_features" if flag else ""
+
+class RF3Model:
+    def __init__(self, repo, num_models, num_recycles, use_templates, target_features=""):
+        path = os.path.join(os.path.abspath(repo), "run_rf3.py")
+        sys.path.insert(0, os.path.dirname(path))
+        spec = importlib.util.spec_from_file_location("run_rf3", path)
+        self.mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.mod)
+        self.opts = dict(num_models=num_models, num_recycles=num_recycles, use_templates=use_templates)
+        self.target_features = target_features
+        self.model = None
+        if hasattr(self.mod, "load_model") and hasattr(self.mod, "predict"):
+            kw = dict(self.opts)
+            if target_features and "target_features" in inspect.signature(self.mod.load_model).parameters:
+                kw["target_features"] = target_features
+            self.model = self.mod.load_model(**kw)
+
+    def predict(self, task_id, fasta, output_dir):
+        if self.model is not None:
+            self.mod.predict(self.model, fasta, output_dir)
+            return
+        argv = ["--input_fasta", fasta, "--output_dir", output_dir]
+        for k, v in self.opts.items():
+            argv += [f"--{k}", str(v)]
+        if self.target_features:
+            argv += ["--target_features", self.target_features]
+        # main() 从 sys.argv 读参数（argparse 的默认行为）；以 sys.exit 结束时按返回码判断
+        saved, sys.argv = sys.argv, ["run_rf3.py"] + argv
+        try:
+            rc = self.mod.main()
+        except SystemExit as e:
+            rc = e.code
+        finally:
+            sys.argv = saved
+        if rc not in (None, 0):
+            raise RuntimeError(f"run_rf3.main returned {rc}")
+
+class MockModel:
+    """CPU 假预测器：按序列哈希生成确定的 iptm/pLDDT/PAE，模型 PDB 为两条直线主链（靶点链 A、binder 链 B，相距 10 Å）。"""
+    def __init__(self, num_models=1, delay=0.0, fail=None):
+        self.num_models = max(1, int(num_models or 1))
+        self.delay = delay
+        self.fail = fail
+        self.last_peak_mb = None
+
+    def predict(self, task_id, fasta, output_dir):
+        time.sleep(self.delay)
+        if self.fail and self.fail in task_id:
+            raise RuntimeError(f"mock failure for {task_id}")
+        target, binder = read_pair(fasta)
+        rng = np.random.default_rng(int(hashlib.sha1(f"{target}:{binder}".encode()).hexdigest()[:8], 16))
+        n = len(target) + len(binder)
+        self.last_peak_mb = 2500.0 + 3.0 * n + 0.05 * n * n
+        lines, serial = [], 0
+        for cid, seq, y in (("A", target, 0.0), ("B", binder, 10.0)):
+            for i in range(len(seq)):
+                for an, el, dx in (("N", "N", 0.0), ("CA", "C", 1.46), ("C", "C", 2.0), ("O", "O", 2.6)):
+                    serial += 1
+                    lines.append("ATOM  %5d  %-3s GLY %s%4d    %8.3f%8.3f%8.3f  1.00 80.00           %s\n"
+                                 % (serial, an, cid, i + 1, 3.8 * i + dx, y, 0.0, el))
+        with open(os.path.join(output_dir, "model_0.pdb"), "w") as f:
+            f.writelines(lines)
+            f.write("END\n")
+        with open(os.path.join(output_dir, "ranking_debug.json"), "w") as f:
+            json.dump({"iptm": round(float(rng.uniform(0.3, 0.9)), 3),
+                       "plddt": rng.uniform(60, 95, n).round(2).tolist(), "num_models": self.num_models}, f)
+        with open(os.path.join(output_dir, "model_0_pae.json"), "w") as f:
+            json.dump(rng.uniform(2, 20, (n, n)).round(2).tolist(), f)
+
+class PeakMeter:
+    """单个任务期间本进程的显存峰值（MiB）；取不到时为 None。"""
+    def __init__(self, probe, interval=2.0):
+        self.probe, self.interval = probe, interval
+        self.torch = sys.modules.get("torch")
+        if self.torch is not None and not self.torch.cuda.is_available():
+            self.torch = None
+
+    def __enter__(self):
+        self.peak, self._stop = None, threading.Event()
+        if self.torch is not None:
+            self.torch.cuda.reset_peak_memory_stats()
+        elif self.probe is not None:
+            self._t = threading.Thread(target=self._sample, daemon=True)
+            self._t.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            mb = self.probe.process_mb({os.getpid()})
+            if mb is not None:
+                self.peak = max(self.peak or 0, mb)
+
+    def __exit__(self, *_):
+        self._stop.set()
+        if self.torch is not None:
+            self.peak = self.torch.cuda.max_memory_reserved() / 2 ** 20
+        elif self.probe is not None:
+            self._t.join()
+
+def run(args, log):
+    t0 = time.time()
+    try:
+        if args.mock:
+            model = MockModel(args.num_models, args.mock_delay, args.mock_fail)
+        else:
+            model = RF3Model(args.rf3_repo, args.num_models, args.num_recycles, args.use_templates, args.target_features)
+    except Exception:
+        # 未领取任何任务，队列中的任务留给其他 worker
+        print(f"[ERROR] worker {args.worker} could not load RF3:\n{traceback.format_exc(limit=3)}", file=log, flush=True)
+        return 2
+    print(f"[INFO] worker {args.worker} ready, model load {time.time() - t0:.1f}s", file=log, flush=True)
+
+    q = TaskQueue(args.queue)
+    # 只有启用显存准入（--gpu）时才需要测量峰值
+    probe = make_probe(args.probe) if args.gpu is not None and not args.mock else None
+    stores = {}
+    input_dir = os.path.join(os.path.dirname(os.path.abspath(args.queue)), f"input_{args.worker}")
+    os.makedirs(input_dir, exist_ok=True)
+    n_ok = n_fail = 0
+    first = True
+    while True:
+        tasks = q.claim(args.worker, args.lease, 1, new_process=first, gpu=args.gpu)
+        if not tasks:
+            # 只剩他人租约中的任务时等待，以便接手崩溃 worker 的过期租约
+            if q.outstanding() == 0:
+                break
+            time.sleep(args.poll)
+            continue
+        first = False
+        task_id, store = tasks[0]
+        if store not in stores:
+            stores[store] = SeqStore(store)
+        fasta = os.path.join(input_dir, f"{task_id}.fa")
+        out = os.path.join(args.output_dir, task_id)
+        os.makedirs(out, exist_ok=True)
+        stop = threading.Event()
+        hb = threading.Thread(target=heartbeat, args=(args.queue, args.worker, [task_id], args.lease, stop), daemon=True)
+        hb.start()
+        t1 = time.time()
+        try:
+            with open(fasta, "w") as f:
+                f.write(stores[store].get(task_id))
+            with PeakMeter(probe) as meter:
+                model.predict(task_id, fasta, out)
+            peak = getattr(model, "last_peak_mb", None) or meter.peak
+            if args.publish_dir:
+                publish(out, args.publish_dir, task_id, args.events, args.worker)
+            err = None
+        except Exception:
+            err = traceback.format_exc(limit=3)
+        if os.path.exists(fasta):
+            os.remove(fasta)
+        stop.set()
+        hb.join()
+        if err is None:
+            q.done(task_id, args.worker, peak if args.gpu is not None else None)
+            n_ok += 1
+            print(f"[INFO] Completed {task_id}.fa ({time.time() - t1:.1f}s)", file=log, flush=True)
+            continue
+        n_fail += 1
+        # 丢弃不完整的输出：任务回到队列后可能由其他 worker 重做
+        shutil.rmtree(out, ignore_errors=True)
+        q.fail(task_id, args.worker, err.strip().splitlines()[-1])
+        print(f"[ERROR] RF3 failed for {task_id}.fa:\n{err}", file=log, flush=True)
+        if args.halt_on_fail:
+            print("[ERROR] halt_on_fail=true, exiting worker", file=log, flush=True)
+            return 1
+    print(f"[INFO] worker {args.worker} finished: ok={n_ok}, failed={n_fail}, total {time.time() - t0:.1f}s", file=log, flush=True)
+    return 0
+
+def parse_args():
+    p = argparse.ArgumentParser(description="常驻 RosettaFold3 worker：模型只加载一次，从共享队列逐个执行预测任务")
+    p.add_argument("--queue", required=True, help="task_queue.py 队列文件")
+    p.add_argument("--worker", required=True, help="worker 名（gpu_<id>_sub_<k>）")
+    p.add_argument("--output_dir", required=True, help="预测输出根目录，每个任务写入 <output_dir>/<task_id>/")
+    p.add_argument("--rf3_repo", default="./external/RosettaFold3")
+    p.add_argument("--num_models", default="")
+    p.add_argument("--num_recycles", default="")
+    p.add_argument("--use_templates", default="")
+    p.add_argument("--target_features", default=os.environ.get("RF3_TARGET_FEATURES", ""),
+                   help="靶点特征缓存目录（target_features.py build 的输出；默认取环境变量 RF3_TARGET_FEATURES）")
+    p.add_argument("--lease", type=float, default=900.0)
+    p.add_argument("--poll", type=float, default=30.0)
+    p.add_argument("--publish_dir", default=None, help="完成的预测立即发布到 <publish_dir>/<task_id>/（与 output_dir 同一文件系统）")
+    p.add_argument("--events", default=None, help="发布事件记录（JSONL）")
+    p.add_argument("--gpu", default=None, help="所在 GPU：启用显存准入（队列 init 时须登记该 GPU 的预算）")
+    p.add_argument("--probe", default="nvidia-smi", help="显存探测器（gpu_scheduler.make_probe）")
+    p.add_argument("--halt_on_fail", action="store_true", help="任一任务失败时退出 worker")
+    p.add_argument("--log", default=None, help="追加写入的日志文件（默认 stdout）")
+    p.add_argument("--mock", action="store_true", help="使用 CPU 假预测器（测试批处理与错误处理）")
+    p.add_argument("--mock_fail", default=None, help="假预测器：任务名包含该字符串时抛出异常")
+    p.add_argument("--mock_delay", type=float, default=0.0, help="假预测器每个任务的耗时（秒）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    log = open(args.log, "a") if args.log else sys.stdout
+    sys.exit(run(args, log))
+
+if __name__ == "__main__":
+    main()
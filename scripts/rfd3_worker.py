@@ -0,0 +1,247 @@
+# scripts/rfd3_worker.py
+# 常驻 RFdiffusion3 推理 worker：每个 GPU 槽位一个进程，模型权重与靶点特征只加载一次，
+# 之后从共享队列中逐个领取设计任务（contig、长度、热点、种子），每完成一个立即写出 PDB。
+#
+# 任务文件为 JSONL，每行一个任务：
+#   {"task_id": "...", "output_prefix": ".../design_3_len72", "contig": "[A36-55/0 72-72/0]",
+#    "hotspots": "A143,A264", "length": 72, "seed": 3}
+# 输出命名与 run_inference.py 一致：<output_prefix>_0.pdb（先写临时文件再 rename；--ledger 时完成后追加记录）
+#
+# --fake_model 使用 CPU 上的假模型（写出靶点 + 直线 binder 骨架），用于在无 GPU 环境下检验队列逻辑。
+import os, sys, copy, json, time, random, argparse, traceback
+import multiprocessing as mp
+
+from resolve_params import load_params
+from ledger import Ledger
+
+def base_overrides(P, target_pdb):
+    """与 03_run_rfdiffusion3.sh 中 run_inference.py 的公共参数一致。"""
+    rf = P.get("rfdd3", {})
+    return [
+        f"inference.input_pdb={target_pdb}",
+        "inference.num_designs=1",
+        "potentials.guiding_potentials=['type:interface_ncontacts','type:binder_zero_dG']",
+        "potentials.guide_scale=2.0",
+        "denoiser.noise_scale_ca=1",
+        f"inference.model_only_neighbors={str(rf.get('model_only_neighbors', True)).lower()}",
+        f"inference.radius={rf.get('neighborhood_radius', 11.0)}",
+        f"diffuser.T={rf.get('inference_T', 50)}",
+        f"diffuser.schedule={rf.get('diffusion_schedule', 'linear')}",
+        f"model.version={rf.get('model_version', 'v3')}",
+    ]
+
+def task_overrides(task):
+    return [
+        f"inference.output_prefix={task['output_prefix']}",
+        f"contigmap.contigs={task['contig']}",
+        f"ppi.hotspot_res=[{task['hotspots']}]",
+    ]
+
+def cache_target_parse(iu):
+    """sampler.initialize() 每次都经 iu.process_target 重新解析靶点 PDB：按 (路径, mtime, 参数) 缓存解析结果，
+    之后的任务只取副本（sample_init 会在其上构建 contig 映射）。"""
+    orig = iu.process_target
+    if getattr(orig, "cached", False):
+        return
+    cache = {}
+    def process_target(pdb_path, *a, **kw):
+        key = (os.path.abspath(pdb_path), os.path.getmtime(pdb_path), a, tuple(sorted(kw.items())))
+        if key not in cache:
+            cache[key] = orig(pdb_path, *a, **kw)
+        return copy.deepcopy(cache[key])
+    process_target.cached = True
+    iu.process_target = process_target
+
+class RFdiffusionModel:
+    """直接驱动 run_inference.py 内部使用的 sampler：首个任务构建 sampler（加载权重），
+    之后每个任务仅以新的 contig/热点配置调用 sampler.initialize()，权重检查点不变时不会重新加载；
+    靶点 PDB 的解析（process_target）按 input_pdb 缓存，整个 worker 只做一次。"""
+    def __init__(self, repo, overrides):
+        sys.path.insert(0, os.path.abspath(repo))
+        from hydra import initialize_config_dir, compose
+        self._compose = compose
+        initialize_config_dir(config_dir=os.path.abspath(os.path.join(repo, "config", "inference")), version_base=None)
+        self.overrides = overrides
+        self.sampler = None
+
+    def run(self, task):
+        import numpy as np
+        import torch
+        from rfdiffusion.inference import utils as iu
+        from rfdiffusion.util import writepdb
+
+        cache_target_parse(iu)
+        conf = self._compose(config_name="base", overrides=self.overrides + task_overrides(task))
+        if self.sampler is None:
+            self.sampler = iu.sampler_selector(conf)
+        else:
+            self.sampler.initialize(conf)
+        seed = int(task["seed"])
+        torch.manual_seed(seed); np.random.seed(seed); random.seed(seed)
+
+        sampler = self.sampler
+        x_init, seq_init = sampler.sample_init()
+        x_t, seq_t = torch.clone(x_init), torch.clone(seq_init)
+        stack = []
+        for t in range(int(sampler.t_step_input), sampler.inf_conf.final_step - 1, -1):
+            px0, x_t, seq_t, plddt = sampler.sample_step(t=t, x_t=x_t, seq_init=seq_t, final_step=sampler.inf_conf.final_step)
+            stack.append(x_t)
+        final_xyz = stack[-1]
+        is_mask = torch.argmax(seq_init, dim=-1) == 21
+        final_seq = torch.where(is_mask, 7, torch.argmax(seq_init, dim=-1))  # 7 为甘氨酸
+        bfacts = torch.ones_like(final_seq.squeeze())
+        bfacts[is_mask] = 0
+        out = f"{task['output_prefix']}_0.pdb"
+        tmp = f"{out}.{os.getpid()}.tmp"
+        writepdb(tmp, final_xyz[:, :4], final_seq, sampler.binderlen, chain_idx=sampler.chain_idx, bfacts=bfacts)
+        os.replace(tmp, out)
+        return out
+
+class FakeModel:
+    """CPU 假模型：加载一次靶点 PDB，每个任务写出 靶点链 A + 长度为 length 的直线 binder 链 B。"""
+    def __init__(self, target_pdb, delay=0.0):
+        with open(target_pdb) as f:
+            self.target_lines = [l for l in f if l.startswith("ATOM")]
+        self.delay = delay
+
+    def run(self, task):
+        rng = random.Random(int(task["seed"]))
+        time.sleep(self.delay)
+        if task.get("fail"):
+            raise RuntimeError(f"fake failure for {task['task_id']}")
+        lines = []
+        serial = 0
+        for l in self.target_lines:
+            serial += 1
+            lines.append(f"{l[:6]}{serial:5d}{l[11:21]}A{l[22:]}")
+        x0, y0, z0 = (rng.uniform(-20, 20) for _ in range(3))
+        for i in range(int(task["length"])):
+            for name, el, dx in (("N", "N", 0.0), ("CA", "C", 1.46), ("C", "C", 2.0), ("O", "O", 2.6)):
+                serial += 1
+                lines.append("ATOM  %5d  %-3s GLY B%4d    %8.3f%8.3f%8.3f  1.00  0.00           %s\n"
+                             % (serial, name, i + 1, x0 + 3.8 * i + dx, y0, z0, el))
+        out = f"{task['output_prefix']}_0.pdb"
+        tmp = f"{out}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.writelines(lines)
+            f.write("END\n")
+        os.replace(tmp, out)
+        return out
+
+def worker_main(slot, gpu, args, task_q, result_q):
+    if gpu != "":
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu)
+    P = load_params(args.params)
+    target_pdb = args.target_pdb
+    t0 = time.time()
+    try:
+        if args.fake_model:
+            model = FakeModel(target_pdb, delay=args.fake_delay)
+        else:
+            model = RFdiffusionModel(P["paths"]["rfdiffusion3_repo"], base_overrides(P, target_pdb))
+    except Exception:
+        result_q.put({"event": "load_failed", "slot": slot, "gpu": gpu, "error": traceback.format_exc(limit=3)})
+        result_q.put({"event": "exit", "slot": slot})
+        return
+    result_q.put({"event": "ready", "slot": slot, "gpu": gpu, "load_s": round(time.time() - t0, 2)})
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        t1 = time.time()
+        status, out, err = "ok", None, None
+        for attempt in (1, 2):  # 与原脚本一致：失败重试一次
+            try:
+                out = model.run(task)
+                status, err = "ok", None
+                break
+            except Exception:
+                status, err = "failed", traceback.format_exc(limit=3)
+        result_q.put({"event": "done", "slot": slot, "gpu": gpu, "task_id": task["task_id"], "status": status,
+                      "output": out, "error": err, "seconds": round(time.time() - t1, 2)})
+    result_q.put({"event": "exit", "slot": slot})
+
+def gpu_slots(P, slots=None):
+    """GPU 槽位：compute.gpus × rfdd3.persistent_slots_per_gpu（缺省回退到 compute.max_concurrent_rf3）；
+    无 GPU 时单个 CPU 槽位。每个槽位常驻一份模型，显存占用随槽位数线性增长。"""
+    gpus = [str(g) for g in (P.get("compute", {}).get("gpus") or [])]
+    per_gpu = int(P.get("rfdd3", {}).get("persistent_slots_per_gpu") or P.get("compute", {}).get("max_concurrent_rf3", 1) or 1)
+    out = [g for g in gpus for _ in range(per_gpu)] or [""]
+    return out[:slots] if slots else out
+
+def run_pool(args, tasks, ledger=None):
+    P = load_params(args.params)
+    slots = gpu_slots(P, args.slots)
+    ctx = mp.get_context("spawn")
+    task_q, result_q = ctx.Queue(), ctx.Queue()
+    by_id = {t["task_id"]: t for t in tasks}
+    procs = [ctx.Process(target=worker_main, args=(i, g, args, task_q, result_q), daemon=True) for i, g in enumerate(slots)]
+    for p in procs:
+        p.start()
+    for t in tasks:
+        task_q.put(t)
+    for _ in procs:
+        task_q.put(None)
+
+    log = open(args.log, "a") if args.log else sys.stdout
+    n_ok = n_fail = exited = 0
+    while exited < len(procs):
+        try:
+            r = result_q.get(timeout=5)
+        except Exception:
+            if not any(p.is_alive() for p in procs):
+                break
+            continue
+        if r["event"] == "ready":
+            print(f"[INFO] worker slot {r['slot']} (GPU '{r['gpu']}') ready, model load {r['load_s']}s", file=log, flush=True)
+        elif r["event"] == "done":
+            if r["status"] == "ok":
+                n_ok += 1
+                if ledger is not None:
+                    ledger.record(r["task_id"], by_id[r["task_id"]].get("input_hash", ""), [r["output"]])
+                print(f"[OK] {r['task_id']} -> {r['output']} ({r['seconds']}s, slot {r['slot']})", file=log, flush=True)
+            else:
+                n_fail += 1
+                print(f"[WARN] {r['task_id']} failed on slot {r['slot']}:\n{r['error']}", file=log, flush=True)
+        elif r["event"] == "load_failed":
+            print(f"[ERROR] worker slot {r['slot']} (GPU '{r['gpu']}') could not load model:\n{r['error']}", file=log, flush=True)
+        elif r["event"] == "exit":
+            exited += 1
+    for p in procs:
+        p.join(timeout=10)
+    lost = len(tasks) - n_ok - n_fail
+    if lost:
+        # 所有槽位都已退出但队列未清空（模型加载失败或进程崩溃）
+        print(f"[ERROR] {lost} tasks were not executed: no live workers left", file=log, flush=True)
+        n_fail += lost
+    print(f"[OK] persistent workers finished: ok={n_ok}, failed={n_fail}, slots={len(slots)}", file=log, flush=True)
+    return n_fail
+
+def parse_args():
+    p = argparse.ArgumentParser(description="常驻 RFdiffusion3 worker 池：模型每槽位加载一次，按队列执行设计任务")
+    p.add_argument("--params", required=True, help="config/params.yaml")
+    p.add_argument("--tasks", required=True, help="任务 JSONL")
+    p.add_argument("--target_pdb", required=True, help="靶点 PDB（mettl1_target.pdb）")
+    p.add_argument("--log", default=None, help="追加写入的日志文件（默认 stdout）")
+    p.add_argument("--ledger", default=None, help="完成记录 JSONL：已完成的任务跳过，新完成的任务追加记录")
+    p.add_argument("--slots", type=int, default=None, help="限制 worker 槽位数")
+    p.add_argument("--fake_model", action="store_true", help="使用 CPU 假模型（测试队列逻辑）")
+    p.add_argument("--fake_delay", type=float, default=0.0, help="假模型每个任务的耗时（秒）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    with open(args.tasks) as f:
+        tasks = [json.loads(l) for l in f if l.strip()]
+    ledger = Ledger(args.ledger) if args.ledger else None
+    if ledger is not None:
+        n_all = len(tasks)
+        tasks = [t for t in tasks if not ledger.done(t["task_id"], t.get("input_hash", ""))]
+        print(f"[INFO] ledger {args.ledger}: {n_all - len(tasks)} / {n_all} tasks already complete")
+    if not tasks:
+        print("[INFO] no pending tasks")
+        return
+    sys.exit(1 if run_pool(args, tasks, ledger) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# scripts/run_campaign.py
+# 多靶点 campaign：为 campaign.targets 中每个靶点生成一份派生配置，输出按靶点命名空间隔离
+#   <work_dir>/<name>/{targets,rfdiffusion3_raw,mpnn_seqs,rf3_models}，<reports_dir>/<name>/
+# 阶段 1/2、6 为 CPU 阶段，在进程池中对所有靶点并行；GPU 阶段 3/4/5 放入一个跨靶点共享队列
+# （task_queue.py，<work_dir>/campaign/gpu_queue.sqlite，task_id 为 <靶点>/stage<N>），由一组 GPU worker 领取：
+#   某靶点 CPU 前处理完成即入队其第一个 GPU 阶段，GPU 阶段完成后入队下一个，全部完成后阶段 6 交给 CPU 进程池；
+#   GPU 不必等待其他靶点的 CPU 前处理，也不必等最慢的靶点跑完同一阶段。
+#   campaign.gpu_workers > 1 时 GPU 列表（compute.gpus，为空时探测）切成同样多组，每个 worker 只用自己那组
+#   （每个靶点为每组各写一份 compute.gpus 不同的派生配置）。
+# tmp_root 保持共享，链匹配缓存和结构缓存跨靶点复用。
+import os, sys, copy, json, time, argparse, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from task_queue import TaskQueue
+
+try:
+    import yaml
+except Exception:
+    yaml = None
+
+STAGE_CMDS = {
+    1: ["python", "scripts/01_prepare_interface.py", "--params"],
+    2: ["python", "scripts/02_select_hotspots.py", "--config"],
+    3: ["bash", "scripts/03_run_rfdiffusion3.sh"],
+    4: ["bash", "scripts/04_run_proteinmpnn.sh"],
+    5: ["bash", "scripts/05_run_rf3.sh"],
+    6: ["python", "scripts/06_rank_designs.py", "--params"],
+}
+CPU_STAGES = (1, 2, 6)
+GPU_STAGES = (3, 4, 5)
+# work_dir/campaign 是汇总目录，靶点不能同名
+RESERVED_NAMES = ("campaign",)
+# GPU worker 是本进程内的线程，不会崩溃后留下租约等他人接手；租约只需长于一个阶段的运行时间
+GPU_LEASE_S = 30 * 86400
+GPU_POLL_S = 10  # 队列暂空时的等待上限（有任务入队时立即唤醒）
+
+def load_yaml(path):
+    if yaml is None:
+        print("[ERROR] 需要 PyYAML，请先安装：python -m pip install pyyaml", file=sys.stderr)
+        sys.exit(1)
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+def deep_update(dst, src):
+    for k, v in src.items():
+        if isinstance(v, dict) and isinstance(dst.get(k), dict):
+            deep_update(dst[k], v)
+        else:
+            dst[k] = v
+    return dst
+
+def derive_params(P, target):
+    """靶点 -> 派生配置：输入结构替换为该靶点，输出目录加上靶点名前缀；target.params 可覆盖任意键。"""
+    name = target["name"]
+    Q = copy.deepcopy(P)
+    Q.pop("campaign", None)
+    root = os.path.join(P["paths"]["work_dir"], name)
+    Q["project"]["name"] = name
+    Q["paths"].update(
+        work_dir=root,
+        targets_dir=os.path.join(root, "targets"),
+        reports_dir=os.path.join(P["paths"]["reports_dir"], name),
+        mettl1_pdb=target["mettl1_pdb"],
+        complex_pdb=target["complex_pdb"],
+        reference_complex_for_mask=target.get("reference_complex_for_mask", target["complex_pdb"]),
+    )
+    return deep_update(Q, target.get("params", {}))
+
+def run_stage(stage, name, params_path, log_dir):
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"stage{stage}.log")
+    t0 = time.time()
+    with open(log_path, "w") as log:
+        rc = subprocess.call(STAGE_CMDS[stage] + [params_path], stdout=log, stderr=subprocess.STDOUT)
+    dt = time.time() - t0
+    tag = "OK" if rc == 0 else "ERROR"
+    print(f"[{tag}] stage {stage} target={name} rc={rc} {dt:.1f}s log={log_path}", flush=True)
+    return rc
+
+def gpu_groups(P, n):
+    """GPU 列表切成 n 组（每个 GPU worker 一组）；n == 1 或找不到 GPU 时不固定 GPU，返回 [None] * n。"""
+    if n <= 1:
+        return [None]
+    gpus = [str(g) for g in (P.get("compute") or {}).get("gpus") or []]
+    if not gpus and os.environ.get("CUDA_VISIBLE_DEVICES"):
+        gpus = [g for g in os.environ["CUDA_VISIBLE_DEVICES"].split(",") if g]
+    if not gpus:
+        try:
+            out = subprocess.run(["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+                                 capture_output=True, text=True).stdout
+        except OSError:
+            out = ""
+        gpus = [l.strip() for l in out.splitlines() if l.strip().isdigit()]
+    if not gpus:
+        print(f"[WARN] campaign: no GPUs found; {n} GPU workers share the stage scripts' own GPU selection", file=sys.stderr)
+        return [None] * n
+    if len(gpus) < n:
+        print(f"[WARN] campaign: {n} GPU workers but only {len(gpus)} GPUs; using {len(gpus)} workers", file=sys.stderr)
+        n = len(gpus)
+    return [gpus[i::n] for i in range(n)]
+
+def run_cpu_stages(stages, name, params_path, log_dir):
+    for st in stages:
+        rc = run_stage(st, name, params_path, log_dir)
+        if rc != 0:
+            return st, rc
+    return None, 0
+
+def parse_args():
+    p = argparse.ArgumentParser(description="多靶点 campaign：CPU 阶段进程池并行，GPU 阶段跨靶点共享一个任务队列")
+    p.add_argument("--params", default="config/params.yaml", help="含 campaign.targets 的 YAML 配置")
+    p.add_argument("--stages", default="1,2,3,4,5,6", help="要运行的阶段，逗号分隔")
+    p.add_argument("--targets", default=None, help="只运行指定靶点（逗号分隔的 name）")
+    p.add_argument("--cpu_workers", type=int, default=None, help="CPU 阶段并行进程数（默认 campaign.cpu_workers 或 CPU 核数）")
+    p.add_argument("--gpu_workers", type=int, default=None, help="GPU 阶段并行数，各占一组 GPU（默认 campaign.gpu_workers 或 1）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    P = load_yaml(args.params)
+    camp = P.get("campaign") or {}
+    targets = camp.get("targets") or []
+    if args.targets:
+        keep = set(args.targets.split(","))
+        targets = [t for t in targets if t["name"] in keep]
+    if not targets:
+        print(f"[ERROR] {args.params} 中没有 campaign.targets", file=sys.stderr)
+        sys.exit(1)
+    names = [t["name"] for t in targets]
+    if len(set(names)) != len(names):
+        print("[ERROR] campaign.targets 中的 name 必须唯一", file=sys.stderr)
+        sys.exit(1)
+    bad = [n for n in names if n in RESERVED_NAMES or os.sep in n]
+    if bad:
+        print(f"[ERROR] campaign.targets 中的 name 不能为 {'/'.join(RESERVED_NAMES)} 或含 {os.sep}：{', '.join(bad)}", file=sys.stderr)
+        sys.exit(1)
+    stages = sorted(int(x) for x in args.stages.split(",") if x.strip())
+    cpu_workers = args.cpu_workers or camp.get("cpu_workers") or os.cpu_count() or 1
+    groups = gpu_groups(P, args.gpu_workers or camp.get("gpu_workers") or 1)
+
+    camp_dir = os.path.join(P["paths"]["work_dir"], "campaign")
+    os.makedirs(camp_dir, exist_ok=True)
+    plan = {}
+    for t in targets:
+        Q = derive_params(P, t)
+        os.makedirs(Q["paths"]["work_dir"], exist_ok=True)
+        ppath = os.path.join(camp_dir, f"{t['name']}.params.yaml")
+        with open(ppath, "w") as f:
+            yaml.safe_dump(Q, f, sort_keys=False, allow_unicode=True)
+        gpu_params = []
+        for i, g in enumerate(groups):
+            if g is None:
+                gpu_params.append(ppath)
+                continue
+            Q.setdefault("compute", {})["gpus"] = g
+            gpu_params.append(os.path.join(camp_dir, f"{t['name']}.gpu{i}.params.yaml"))
+            with open(gpu_params[-1], "w") as f:
+                yaml.safe_dump(Q, f, sort_keys=False, allow_unicode=True)
+        plan[t["name"]] = dict(params=ppath, gpu_params=gpu_params, log_dir=os.path.join(Q["paths"]["work_dir"], "logs"))
+    pinned = " ".join(",".join(g) for g in groups if g)
+    print(f"[INFO] campaign: {len(plan)} targets, stages={stages}, cpu_workers={cpu_workers}, "
+          f"gpu_workers={len(groups)}{f' (GPUs {pinned})' if pinned else ''}")
+
+    gpu_stages = [s for s in stages if s in GPU_STAGES]
+    post = [s for s in stages if s == 6]
+    db = os.path.join(camp_dir, "gpu_queue.sqlite")
+    q = TaskQueue(db)
+    q.init([], max_attempts=1)
+    failed, post_futs = {}, []
+    fed, wake = threading.Event(), threading.Event()
+    cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers)
+
+    def advance(q, n, after=None):
+        """靶点 n 完成 after 阶段（None 为 CPU 前处理）后：入队下一个 GPU 阶段；没有时把阶段 6 交给 CPU 进程池。"""
+        rest = [s for s in gpu_stages if after is None or s > after]
+        if rest:
+            q.add([(f"{n}/stage{rest[0]}", json.dumps(dict(target=n, stage=rest[0])))])
+            wake.set()
+        elif post:
+            post_futs.append((n, cpu_pool.submit(run_cpu_stages, post, n, plan[n]["params"], plan[n]["log_dir"])))
+
+    def gpu_worker(i):
+        wq, wid = TaskQueue(db), f"gpu_worker_{i}"
+        while True:
+            got = wq.claim(wid, GPU_LEASE_S)
+            if not got:
+                if fed.is_set() and wq.outstanding() == 0:
+                    return
+                wake.wait(GPU_POLL_S)
+                wake.clear()
+                continue
+            task_id, payload = got[0]
+            t = json.loads(payload)
+            n, st = t["target"], t["stage"]
+            try:
+                rc = run_stage(st, n, plan[n]["gpu_params"][i], plan[n]["log_dir"])
+            except Exception as e:
+                print(f"[ERROR] stage {st} target={n}: {e}", flush=True)
+                rc = -1
+            if rc == 0:
+                # 先入队下一阶段再记完成，队列不会在靶点的阶段之间短暂为空
+                advance(wq, n, st)
+                wq.done(task_id, wid)
+            else:
+                failed[n] = st
+                wq.fail(task_id, wid, f"rc={rc}")
+
+    workers = [threading.Thread(target=gpu_worker, args=(i,)) for i in range(len(groups))]
+    for w in workers:
+        w.start()
+    pre = [s for s in stages if s in (1, 2)]
+    if pre:
+        futs = {cpu_pool.submit(run_cpu_stages, pre, n, plan[n]["params"], plan[n]["log_dir"]): n for n in plan}
+        for fu in as_completed(futs):
+            n = futs[fu]
+            st, rc = fu.result()
+            if rc != 0:
+                failed[n] = st
+            else:
+                advance(q, n)
+    else:
+        for n in plan:
+            advance(q, n)
+    fed.set()
+    wake.set()
+    for w in workers:
+        w.join()
+    for n, fu in post_futs:
+        st, rc = fu.result()
+        if rc != 0:
+            failed[n] = st
+    cpu_pool.shutdown()
+
+    summary = {n: dict(params=plan[n]["params"], failed_stage=failed.get(n)) for n in plan}
+    with open(os.path.join(camp_dir, "campaign_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"[OK] campaign finished: {len(plan) - len(failed)}/{len(plan)} targets succeeded. Summary: {camp_dir}/campaign_summary.json")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
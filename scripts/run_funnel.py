@@ -0,0 +1,131 @@
+# scripts/run_funnel.py
+# 两档漏斗（第 3 阶段骨架生成之后）：
+#   initial : 04/05/06 初筛档，每个骨架 mpnn_num_seq_per_backbone_initial 条序列
+#   select  : 按骨架汇总 af2_ranked_initial.csv（通过数、最高分、平均分），取前 keep_backbone_top_fraction，
+#             上限 max_backbones_refine，写 <work_dir>/funnel/refine_backbones.txt 与 backbone_scores.csv
+#   refine  : 只对入围骨架运行 04/05/06 精筛档（mpnn_num_seq_per_backbone_refine 条序列，rf3.*.refine，filters.refine）
+# 用法：python scripts/run_funnel.py --params config/params.yaml [--steps initial,select,refine]
+import os, re, sys, csv, json, math, time, argparse, subprocess
+from resolve_params import load_params
+from index_backbones import load_manifest
+
+STEP_CMDS = {
+    "initial": [["bash", "scripts/04_run_proteinmpnn.sh", "{params}", "initial"],
+                ["bash", "scripts/05_run_rf3.sh", "{params}", "initial"],
+                ["python", "scripts/06_rank_designs.py", "--params", "{params}", "--stage", "initial"]],
+    "refine":  [["bash", "scripts/04_run_proteinmpnn.sh", "{params}", "refine"],
+                ["bash", "scripts/05_run_rf3.sh", "{params}", "refine"],
+                ["python", "scripts/06_rank_designs.py", "--params", "{params}", "--stage", "refine"]],
+}
+SAMPLE_RE = re.compile(r"_sample_[^/]+$")
+
+def run_cmds(step, params_path, log_dir):
+    os.makedirs(log_dir, exist_ok=True)
+    for i, cmd in enumerate(STEP_CMDS[step]):
+        cmd = [c.format(params=params_path) for c in cmd]
+        log_path = os.path.join(log_dir, f"funnel_{step}_{i + 4}.log")
+        t0 = time.time()
+        with open(log_path, "w") as log:
+            rc = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+        tag = "OK" if rc == 0 else "ERROR"
+        print(f"[{tag}] funnel {step}: {' '.join(cmd[:2])} rc={rc} {time.time() - t0:.1f}s log={log_path}", flush=True)
+        if rc != 0:
+            return rc
+    return 0
+
+def backbone_paths(work_dir):
+    """骨架唯一名 -> 骨架 PDB 路径。唯一名即第 4 阶段输出 <name>/seqs/<name>.fa 的 name（骨架清单的 name 列，
+    含组合目录；各组合下的 design_<k>_len<L>_0 同名），也是第 5 阶段样本名 <name>_sample_<id> 的前缀。
+    优先取第 4 阶段 ledger（task_id 为骨架路径，outputs 为 .fa），否则读骨架清单。"""
+    m = {}
+    ledger = os.path.join(work_dir, "mpnn_seqs", "ledger.jsonl")
+    if os.path.exists(ledger):
+        with open(ledger) as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                for fa in e.get("outputs", []):
+                    m[os.path.basename(fa)[:-3]] = e["task_id"]
+    for p, r in load_manifest(os.path.join(work_dir, "rfdiffusion3_raw")).items():
+        m.setdefault(r["name"], p)
+    return m
+
+def aggregate(ranked_csv, pred_dir):
+    """af2_ranked_initial.csv 的每行是一条序列的预测；按 <骨架唯一名>_sample_<id> 归并到骨架（每个唯一名对应一个 PDB）。"""
+    agg = {}
+    with open(ranked_csv) as f:
+        for r in csv.DictReader(f):
+            # design 列为原始 MPNN 样本名（第 6 阶段已把合并的重复序列展开到每个别名）
+            rel = r.get("design") or os.path.relpath(r["model_dir"], pred_dir).split(os.sep)[0]
+            bb = SAMPLE_RE.sub("", rel)
+            a = agg.setdefault(bb, dict(backbone=bb, n_models=0, n_pass=0, best_score=-math.inf, score_sum=0.0))
+            s = float(r["score"])
+            a["n_models"] += 1
+            a["n_pass"] += r["pass_initial"] == "True"
+            a["best_score"] = max(a["best_score"], s)
+            a["score_sum"] += s
+    for a in agg.values():
+        a["mean_score"] = round(a.pop("score_sum") / a["n_models"], 4)
+        a["best_score"] = round(a["best_score"], 4)
+    return sorted(agg.values(), key=lambda a: (-a["n_pass"], -a["best_score"], -a["mean_score"], a["backbone"]))
+
+def select(P):
+    work_dir = P["paths"]["work_dir"]
+    sc = P["scale"]
+    ranked_csv = os.path.join(P["paths"]["reports_dir"], "af2_ranked_initial.csv")
+    if not os.path.exists(ranked_csv):
+        print(f"[ERROR] {ranked_csv} not found; run the initial step first", file=sys.stderr)
+        return 1
+    rows = aggregate(ranked_csv, os.path.join(work_dir, "rf3_models", "predictions"))
+    paths = backbone_paths(work_dir)
+    n_keep = min(sc["max_backbones_refine"], math.ceil(sc["keep_backbone_top_fraction"] * len(rows)))
+    keep = []
+    for a in rows:
+        a["pdb"] = paths.get(a["backbone"], "")
+        a["selected"] = len(keep) < n_keep and bool(a["pdb"])
+        if len(keep) < n_keep and not a["pdb"]:
+            print(f"[WARN] funnel: backbone PDB for {a['backbone']} not found; skipped", file=sys.stderr)
+        if a["selected"]:
+            keep.append(a["pdb"])
+
+    fdir = os.path.join(work_dir, "funnel")
+    os.makedirs(fdir, exist_ok=True)
+    cols = ["backbone", "pdb", "n_models", "n_pass", "best_score", "mean_score", "selected"]
+    with open(os.path.join(fdir, "backbone_scores.csv.tmp"), "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=cols)
+        w.writeheader()
+        w.writerows(rows)
+    os.replace(os.path.join(fdir, "backbone_scores.csv.tmp"), os.path.join(fdir, "backbone_scores.csv"))
+    with open(os.path.join(fdir, "refine_backbones.txt.tmp"), "w") as f:
+        f.writelines(p + "\n" for p in keep)
+    os.replace(os.path.join(fdir, "refine_backbones.txt.tmp"), os.path.join(fdir, "refine_backbones.txt"))
+    print(f"[OK] funnel select: {len(keep)}/{len(rows)} backbones -> {fdir}/refine_backbones.txt "
+          f"(top {sc['keep_backbone_top_fraction']:.0%}, cap {sc['max_backbones_refine']})")
+    return 0 if keep else 1
+
+def parse_args():
+    p = argparse.ArgumentParser(description="两档漏斗：初筛全部骨架，按骨架汇总排名后只对入围骨架精筛")
+    p.add_argument("--params", default="config/params.yaml")
+    p.add_argument("--steps", default="initial,select,refine", help="要运行的步骤，逗号分隔（initial/select/refine）")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    P = load_params(args.params)
+    log_dir = os.path.join(P["paths"]["work_dir"], "logs")
+    for step in [s.strip() for s in args.steps.split(",") if s.strip()]:
+        if step == "select":
+            rc = select(P)
+        elif step in STEP_CMDS:
+            rc = run_cmds(step, args.params, log_dir)
+        else:
+            print(f"[ERROR] unknown step {step}", file=sys.stderr)
+            rc = 1
+        if rc != 0:
+            sys.exit(rc)
+    print("[OK] funnel finished")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# scripts/seq_store.py
+# 打包序列库（ffindex 格式，与 data/templates 下的 pdb70_a3m.ffdata/.ffindex 相同）：第 5 阶段的全部任务 FASTA 存为
+#   <prefix>.ffdata  : 各条记录依次拼接，每条以 \0 结尾
+#   <prefix>.ffindex : 每行 "name\toffset\tlength"（length 含结尾的 \0），按 name 排序
+# 取代原先每个 MPNN 样本一个 .fa 的 fasta_all/ 目录（10 万级样本时共享文件系统上的 inode 与目录列举开销）。
+# 写入为流式追加，close 时写索引并原子替换；读取一次载入索引，之后按偏移随机访问（mmap）。
+#
+#   python scripts/seq_store.py get <prefix> <name> [<name> ...]   : 依次打印各条记录（拼成多条目 FASTA）
+#   python scripts/seq_store.py list <prefix>                      : 打印全部 name
+import os, sys, mmap, argparse
+
+class SeqStoreWriter:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.data = open(f"{prefix}.ffdata.tmp", "wb")
+        self.index = {}
+        self.offset = 0
+
+    def add(self, name, text):
+        if name in self.index:
+            raise KeyError(f"duplicate entry {name}")
+        b = text.encode() + b"\0"
+        self.data.write(b)
+        self.index[name] = (self.offset, len(b))
+        self.offset += len(b)
+
+    def close(self):
+        self.data.close()
+        with open(f"{self.prefix}.ffindex.tmp", "w") as f:
+            for name in sorted(self.index):
+                off, n = self.index[name]
+                f.write(f"{name}\t{off}\t{n}\n")
+        os.replace(f"{self.prefix}.ffdata.tmp", f"{self.prefix}.ffdata")
+        os.replace(f"{self.prefix}.ffindex.tmp", f"{self.prefix}.ffindex")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.data.close()
+
+class SeqStore:
+    def __init__(self, prefix):
+        self.index = {}
+        with open(f"{prefix}.ffindex") as f:
+            for line in f:
+                name, off, n = line.rstrip("\n").split("\t")
+                self.index[name] = (int(off), int(n))
+        self._f = open(f"{prefix}.ffdata", "rb")
+        # 空文件不能 mmap
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if self.index else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return sorted(self.index)
+
+    def get(self, name):
+        off, n = self.index[name]
+        return self._mm[off:off + n - 1].decode()
+
+def main():
+    ap = argparse.ArgumentParser(description="打包序列库（ffdata/ffindex）读取")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("get"); p.add_argument("prefix"); p.add_argument("names", nargs="+")
+    p = sub.add_parser("list"); p.add_argument("prefix")
+    args = ap.parse_args()
+    store = SeqStore(args.prefix)
+    if args.cmd == "get":
+        missing = [n for n in args.names if n not in store]
+        if missing:
+            print(f"[ERROR] not in {args.prefix}: {' '.join(missing)}", file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.write("".join(store.get(n) for n in args.names))
+    else:
+        sys.stdout.write("".join(n + "\n" for n in store.names()))
+
+if __name__ == "__main__":
+    main()
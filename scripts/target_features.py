@@ -0,0 +1,172 @@
+# scripts/target_features.py
+# 靶点特征缓存（target_features.enabled）：第 5 阶段所有复合物共用同一条 METTL1 链，靶点的 MSA 与模板检索每个战役只算一次。
+# 缓存目录 <cache_root>/<key>/，key = sha1(靶点序列, 模板集指纹, MSA 来源)，内容：
+#   target.fa    : 靶点序列
+#   target.a3m   : 靶点 MSA（msa_source 为空时为单序列；"colabfold" 时由 colabfold_batch --msa-only 计算；或复制给定的 .a3m）
+#   target.hhr   : 靶点对模板库（<templates_dir>/pdb70）的 hhsearch 结果（有 hhsearch 且使用模板时）
+#   meta.json    : 键的组成与各文件；complete 标记存在才视为可用
+# 先在临时目录构建再 rename（文件锁防止多个进程同时构建），完成后文件设为只读，各 worker 只读加载。
+#   AF2  : 每个任务的输入改为 colabfold 复合物 a3m（靶点 MSA 作为非配对行 + binder 单序列），colabfold 不再为靶点重新建 MSA
+#   RF3  : 缓存目录经环境变量 RF3_TARGET_FEATURES 与 rf3_worker.py 的 load_model(target_features=...) 传给 RF3
+#
+#   python scripts/target_features.py build --params P --target_fa mettl1_seq.fa          （打印缓存目录）
+#   python scripts/target_features.py complex --cache DIR --store S --out_dir D <name> ... （写出 D/<name>.a3m）
+import os, sys, json, glob, fcntl, shutil, hashlib, argparse, subprocess, tempfile
+from utils import file_sha1
+from seq_store import SeqStore
+
+VERSION = 1
+DEFAULT_CACHE_DIR = "./outputs/tmp/target_features"
+
+def cache_root(P):
+    """缓存根目录：target_features.cache_dir > paths.tmp_root/target_features（战役内各靶点共享）> 默认值。"""
+    tf = P.get("target_features", {})
+    if tf.get("cache_dir"):
+        return tf["cache_dir"]
+    tmp_root = P.get("paths", {}).get("tmp_root")
+    return os.path.join(tmp_root, "target_features") if tmp_root else DEFAULT_CACHE_DIR
+
+def template_fingerprint(templates_dir):
+    """模板集指纹：目录下各文件的相对路径、大小与 mtime（不读内容，pdb70 可达数 GB）。"""
+    items = []
+    if templates_dir and os.path.isdir(templates_dir):
+        for root, _, files in os.walk(templates_dir):
+            for f in files:
+                p = os.path.join(root, f)
+                st = os.stat(p)
+                items.append((os.path.relpath(p, templates_dir), st.st_size, st.st_mtime_ns))
+    return hashlib.sha1(json.dumps(sorted(items)).encode()).hexdigest()
+
+def cache_key(target_seq, templates_fp, msa_source):
+    src = msa_source
+    if msa_source and os.path.isfile(msa_source):
+        src = f"file:{file_sha1(msa_source)}"
+    return hashlib.sha1(json.dumps([VERSION, target_seq, templates_fp, src]).encode()).hexdigest()
+
+def compute_msa(target_fa, msa_source, work):
+    """返回 a3m 文本。"""
+    if not msa_source:
+        with open(target_fa) as f:
+            return f.read()
+    if os.path.isfile(msa_source):
+        with open(msa_source) as f:
+            return f.read()
+    if msa_source == "colabfold":
+        exe = ["colabfold_batch"] if shutil.which("colabfold_batch") else [sys.executable, "-m", "colabfold.batch"]
+        out = os.path.join(work, "msa")
+        subprocess.run(exe + ["--msa-only", target_fa, out], check=True)
+        a3ms = sorted(glob.glob(os.path.join(out, "*.a3m")))
+        if not a3ms:
+            raise RuntimeError(f"colabfold --msa-only produced no a3m in {out}")
+        with open(a3ms[0]) as f:
+            return f.read()
+    raise ValueError(f"unknown target_features.msa_source {msa_source!r} (expected '', 'colabfold' or an .a3m path)")
+
+def search_templates(a3m, templates_dir, out_hhr):
+    """hhsearch 靶点 MSA 对 <templates_dir>/pdb70；没有 hhsearch 或模板库时跳过。"""
+    db = os.path.join(templates_dir or "", "pdb70")
+    if not shutil.which("hhsearch") or not os.path.exists(f"{db}_a3m.ffindex"):
+        print(f"[WARN] hhsearch or {db}_a3m.ffindex not available; template hits not cached", file=sys.stderr)
+        return False
+    subprocess.run(["hhsearch", "-i", a3m, "-d", db, "-o", out_hhr, "-cpu", "4", "-maxseq", "1000000"],
+                   check=True, stdout=subprocess.DEVNULL)
+    return True
+
+def build(target_seq, root, templates_dir, msa_source="", use_templates=True):
+    tfp = template_fingerprint(templates_dir) if use_templates else ""
+    key = cache_key(target_seq, tfp, msa_source)
+    final = os.path.join(root, key)
+    if os.path.exists(os.path.join(final, "complete")):
+        return final, False
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, f"{key}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(os.path.join(final, "complete")):
+            return final, False
+        shutil.rmtree(final, ignore_errors=True)
+        work = tempfile.mkdtemp(prefix=f"{key}.", dir=root)
+        try:
+            target_fa = os.path.join(work, "target.fa")
+            with open(target_fa, "w") as f:
+                f.write(f">METTL1\n{target_seq}\n")
+            with open(os.path.join(work, "target.a3m"), "w") as f:
+                f.write(compute_msa(target_fa, msa_source, work))
+            shutil.rmtree(os.path.join(work, "msa"), ignore_errors=True)
+            hhr = use_templates and search_templates(os.path.join(work, "target.a3m"), templates_dir,
+                                                     os.path.join(work, "target.hhr"))
+            meta = dict(version=VERSION, target_len=len(target_seq), msa_source=msa_source, templates_dir=templates_dir,
+                        templates_fingerprint=tfp, files=sorted(os.listdir(work)), template_hits=bool(hhr))
+            with open(os.path.join(work, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=1)
+            for p in os.listdir(work):
+                os.chmod(os.path.join(work, p), 0o444)
+            open(os.path.join(work, "complete"), "w").close()
+            os.chmod(work, 0o755)  # mkdtemp 建的目录仅属主可读
+            os.replace(work, final)
+        except BaseException:
+            shutil.rmtree(work, ignore_errors=True)
+            raise
+    return final, True
+
+def read_a3m(path):
+    """(header, 序列) 列表。"""
+    out, header, chunks = [], None, []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith(">"):
+                if header is not None:
+                    out.append((header, "".join(chunks)))
+                header, chunks = line[1:], []
+            else:
+                chunks.append(line.strip())
+    if header is not None:
+        out.append((header, "".join(chunks)))
+    return out
+
+def complex_a3m(target_msa, target_seq, binder):
+    """colabfold 复合物 a3m：首行 #长度\\t拷贝数，配对行只有查询本身，之后为各链非配对行（其余链位置补 '-'）。"""
+    lt, lb = len(target_seq), len(binder)
+    lines = [f"#{lt},{lb}\t1,1", ">101\t102", target_seq + binder, ">101", target_seq + "-" * lb]
+    for header, seq in target_msa[1:]:
+        lines += [f">{header}", seq + "-" * lb]
+    lines += [">102", "-" * lt + binder]
+    return "\n".join(lines) + "\n"
+
+def write_complex_inputs(cache_dir, store, out_dir, names):
+    target_msa = read_a3m(os.path.join(cache_dir, "target.a3m"))
+    target_seq = target_msa[0][1]
+    st = SeqStore(store)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in names:
+        seq = "".join(l for l in st.get(name).splitlines() if not l.startswith(">"))
+        t, _, binder = seq.partition(":")
+        if t != target_seq:
+            raise ValueError(f"{name}: target sequence differs from cached target ({cache_dir})")
+        with open(os.path.join(out_dir, f"{name}.a3m"), "w") as f:
+            f.write(complex_a3m(target_msa, target_seq, binder))
+
+def main():
+    ap = argparse.ArgumentParser(description="靶点特征缓存：靶点 MSA / 模板检索每个战役只计算一次")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build"); b.add_argument("--params", required=True); b.add_argument("--target_fa", required=True)
+    c = sub.add_parser("complex"); c.add_argument("--cache", required=True); c.add_argument("--store", required=True)
+    c.add_argument("--out_dir", required=True); c.add_argument("names", nargs="+")
+    args = ap.parse_args()
+    if args.cmd == "build":
+        from resolve_params import load_params
+        P = load_params(args.params)
+        with open(args.target_fa) as f:
+            seq = "".join(l.strip() for l in f if not l.startswith(">"))
+        tf = P.get("target_features", {})
+        use_templates = bool(P.get("project", {}).get("use_template", True))
+        d, built = build(seq, cache_root(P), P["paths"].get("templates_dir"), tf.get("msa_source", ""), use_templates)
+        print(f"[{'OK' if built else 'INFO'}] target features {'built' if built else 'reused'}: {d}", file=sys.stderr)
+        print(d)
+    else:
+        write_complex_inputs(args.cache, args.store, args.out_dir, args.names)
+
+if __name__ == "__main__":
+    main()
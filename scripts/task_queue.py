@@ -0,0 +1,335 @@
+# scripts/task_queue.py
+# 第 5 阶段共享任务队列（SQLite）：worker 从同一张表中逐个领取任务，直到队列为空，不再预先按 i % TOTAL_WORKERS 静态分配。
+# run_campaign.py 也用它作多靶点 GPU 阶段（3/4/5）的跨靶点共享队列。
+# 领取在 BEGIN IMMEDIATE 事务内完成（同一时刻只有一个写者），每次领取带租约（lease_until）；
+# worker 崩溃后租约过期，任务由其他 worker 重新领取；超过 max_attempts 次的任务记为 failed。
+# 长度分桶（--bucket_width > 0）：按复合物总长度分桶，桶内按长度升序；worker 优先继续领取上一个任务所在的桶，
+# 桶取完后换到没有其他 worker 在处理、剩余任务最多的桶。这样同一 worker 的连续任务形状相近，编译/padding 可复用；
+# 每次换桶或启动新的预测进程（--new_process）计一次编译，report 给出编译复用率（1 - 编译次数/任务数）。
+# 显存准入（init --gpu_budget，见 gpu_scheduler.py）：领取时带 --gpu 的 worker 只拿估计峰值显存不超过该 GPU 剩余预算的任务，
+# 每个 worker 按其租约中任务的最大估计值占用预算；done --peak_mb 上报观测峰值并重新拟合显存模型。
+#
+#   python scripts/task_queue.py init  <db> [--max_attempts N] [--bucket_width W] : 从 stdin 读 "task_id\tpayload[\tlength]"，重建队列
+#          [--gpu_budget GPU=MiB ...] [--mem_model "a b c"] [--mem_margin M] [--mem_model_file F]
+#   python scripts/task_queue.py add   <db>                                 : 从 stdin 读同样格式的任务，追加到队列末尾（不清空）
+#   python scripts/task_queue.py claim <db> <worker> [--lease S] [--wait] [--batch N] [--new_process] [--gpu GPU]
+#                                                     : 每行打印 "task_id\tpayload"（最多 N 个，同一桶）；队列已空时无输出
+#   python scripts/task_queue.py renew <db> <task_id> <worker> [--lease S]     : 返回码 0 续约成功，2 租约已不属于该 worker（完成或被接手）
+#   python scripts/task_queue.py heartbeat <db> <worker> <task_id>... [--lease S] : 每 1/3 租约期续约一次，直到任务全部不再由该 worker 持有
+#                                                     （或被 kill）；数据库忙 / 锁超时等临时错误只告警，下一轮重试
+#   python scripts/task_queue.py done  <db> <task_id> <worker> [--peak_mb MiB]
+#   python scripts/task_queue.py fail  <db> <task_id> <worker> [message]
+#   python scripts/task_queue.py stats <db>
+#   python scripts/task_queue.py report <db>                              : 每个 worker 的任务数、编译次数与复用率；各 GPU 的预算与显存峰值
+#   python scripts/task_queue.py save_mem_model <db> <file>               : 保存修正后的显存模型（下次 init --mem_model_file 作为先验）
+import os, sys, json, time, sqlite3, argparse, threading
+from gpu_scheduler import MemModel, parse_coeffs, DEFAULT_COEFFS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id     TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    ord         INTEGER NOT NULL,
+    length      INTEGER,
+    bucket      INTEGER NOT NULL DEFAULT 0,
+    status      TEXT NOT NULL DEFAULT 'pending',   -- pending / leased / done / failed
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    updated     REAL,
+    gpu         TEXT,             -- 显存准入：领取时所在 GPU 与预留的估计峰值（MiB）
+    mem_mb      REAL,
+    peak_mb     REAL              -- 观测峰值
+);
+CREATE INDEX IF NOT EXISTS tasks_status_ord ON tasks (status, ord);
+CREATE INDEX IF NOT EXISTS tasks_bucket_ord ON tasks (bucket, ord);
+CREATE TABLE IF NOT EXISTS workers (
+    worker      TEXT PRIMARY KEY,
+    bucket      INTEGER,          -- 上一次领取的桶
+    n_tasks     INTEGER NOT NULL DEFAULT 0,
+    n_claims    INTEGER NOT NULL DEFAULT 0,
+    n_compiles  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS gpus (gpu TEXT PRIMARY KEY, budget_mb REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+class TaskQueue:
+    def __init__(self, path, timeout=120.0):
+        self.path = path
+        # 共享文件系统上不用 WAL（需要共享内存）；isolation_level=None 以便手动控制事务
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def mem_model(self):
+        d = self._meta("mem_model")
+        return MemModel.from_dict(json.loads(d)) if d else None
+
+    def init(self, tasks, max_attempts=2, bucket_width=0, gpu_budgets=None, mem_model=None):
+        """tasks: [(task_id, payload[, length])]；bucket_width > 0 时按 (长度桶, 长度, 原顺序) 入队，否则按给定顺序。
+        gpu_budgets: {gpu: 预算 MiB}，与 mem_model（MemModel）一起启用显存准入。已有内容（含 worker 统计）全部清空。"""
+        rows = []
+        for i, t in enumerate(tasks):
+            length = int(t[2]) if len(t) > 2 and t[2] else None
+            bucket = length // bucket_width if bucket_width > 0 and length is not None else 0
+            rows.append((t[0], t[1], length, bucket, i))
+        if bucket_width > 0:
+            rows.sort(key=lambda r: (r[3], r[2] if r[2] is not None else 0, r[4]))
+        c = self.conn
+        c.executescript("DROP TABLE IF EXISTS tasks; DROP TABLE IF EXISTS workers; DROP TABLE IF EXISTS gpus;" + SCHEMA)
+        c.execute("BEGIN IMMEDIATE")
+        c.executemany("INSERT OR REPLACE INTO tasks (task_id, payload, length, bucket, ord, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                      [(tid, payload, length, bucket, k, time.time()) for k, (tid, payload, length, bucket, _) in enumerate(rows)])
+        c.execute("INSERT OR REPLACE INTO meta VALUES ('max_attempts', ?)", (str(max_attempts),))
+        c.execute("INSERT OR REPLACE INTO meta VALUES ('bucket_width', ?)", (str(bucket_width),))
+        c.execute("DELETE FROM meta WHERE key = 'mem_model'")
+        if gpu_budgets and mem_model:
+            c.executemany("INSERT INTO gpus VALUES (?, ?)", [(str(g), float(b)) for g, b in gpu_budgets.items()])
+            c.execute("INSERT INTO meta VALUES ('mem_model', ?)", (json.dumps(mem_model.to_dict()),))
+        c.execute("COMMIT")
+
+    def add(self, tasks):
+        """追加任务（不清空队列与统计），排在已有任务之后；task_id 已存在时忽略。tasks 格式同 init。"""
+        c = self.conn
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            start = c.execute("SELECT COALESCE(MAX(ord), -1) + 1 FROM tasks").fetchone()[0]
+            bucket_width = int(self._meta("bucket_width", 0))
+            rows = []
+            for k, t in enumerate(tasks):
+                length = int(t[2]) if len(t) > 2 and t[2] else None
+                bucket = length // bucket_width if bucket_width > 0 and length is not None else 0
+                rows.append((t[0], t[1], length, bucket, start + k, time.time()))
+            c.executemany("INSERT OR IGNORE INTO tasks (task_id, payload, length, bucket, ord, updated) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+    def gpu_free(self, gpu, now=None):
+        """(预算, 已预留) MiB；gpu 未登记时返回 None。每个 worker 按其租约中任务的最大估计值占用（批内任务依次运行）。"""
+        b = self.conn.execute("SELECT budget_mb FROM gpus WHERE gpu = ?", (str(gpu),)).fetchone()
+        if b is None:
+            return None
+        used = self.conn.execute("SELECT COALESCE(SUM(m), 0) FROM (SELECT MAX(mem_mb) AS m FROM tasks "
+                                 "WHERE status = 'leased' AND lease_until >= ? AND gpu = ? GROUP BY worker)",
+                                 (now or time.time(), str(gpu))).fetchone()[0]
+        return b[0], used
+
+    def claim(self, worker, lease_s=900.0, batch=1, new_process=False, gpu=None):
+        """领取最多 batch 个同一长度桶的任务（待处理或租约已过期），返回 [(task_id, payload)]；没有可领取的任务时返回 []。
+        优先 worker 上一次的桶；否则换到没有其他 worker 在处理、剩余任务最多的桶。
+        gpu 已登记预算时只领取估计峰值不超过剩余预算的任务（该 GPU 上没有运行中的任务时不限）。"""
+        c = self.conn
+        max_attempts = int(self._meta("max_attempts", 2))
+        now = time.time()
+        avail = "(status = 'pending' OR (status = 'leased' AND lease_until < ?))"
+        args = (now,)
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # 租约过期且已用完重试次数的任务直接记为 failed
+            c.execute("UPDATE tasks SET status = 'failed', last_error = 'lease expired', updated = ? "
+                      "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, max_attempts))
+            model = self.mem_model() if gpu is not None else None
+            budget = self.gpu_free(gpu, now) if model else None
+            est = None
+            if budget:
+                a, b_, c_ = model.coeffs
+                est = f"(({a!r}) + ({b_!r}) * COALESCE(length, 0) + ({c_!r}) * COALESCE(length, 0) * COALESCE(length, 0)) * {model.margin!r}"
+                if budget[1] > 0:
+                    avail += f" AND {est} <= ?"
+                    args = (now, budget[0] - budget[1])
+            w = c.execute("SELECT bucket FROM workers WHERE worker = ?", (worker,)).fetchone()
+            bucket = None
+            if w and c.execute(f"SELECT 1 FROM tasks WHERE {avail} AND bucket = ? LIMIT 1", args + (w[0],)).fetchone():
+                bucket = w[0]
+            if bucket is None:
+                b = c.execute(f"SELECT bucket FROM tasks WHERE {avail} GROUP BY bucket "
+                              "ORDER BY bucket IN (SELECT bucket FROM workers WHERE worker != ? AND bucket IS NOT NULL), "
+                              "COUNT(*) DESC, MIN(ord) LIMIT 1", args + (worker,)).fetchone()
+                bucket = b[0] if b else None
+            rows = []
+            if bucket is not None:
+                rows = c.execute(f"SELECT task_id, payload, attempts, {est or 'NULL'} FROM tasks WHERE {avail} AND bucket = ? "
+                                 "ORDER BY ord LIMIT ?", args + (bucket, max(1, batch))).fetchall()
+                # 重试的任务单独领取，避免一个坏任务连累同批的其它任务
+                rows = rows[:1] if rows[0][2] > 0 else [r for r in rows if r[2] == 0]
+                c.executemany("UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?, "
+                              "gpu = ?, mem_mb = ? WHERE task_id = ?",
+                              [(worker, now + lease_s, now, None if gpu is None else str(gpu), r[3], r[0]) for r in rows])
+                # 编译计数：换桶（或首次领取），或本批在新的预测进程中运行
+                compile_ = int(new_process or not w or w[0] != bucket)
+                c.execute("INSERT INTO workers (worker, bucket, n_tasks, n_claims, n_compiles) VALUES (?, ?, ?, 1, ?) "
+                          "ON CONFLICT(worker) DO UPDATE SET bucket = excluded.bucket, n_tasks = n_tasks + excluded.n_tasks, "
+                          "n_claims = n_claims + 1, n_compiles = n_compiles + excluded.n_compiles",
+                          (worker, bucket, len(rows), compile_))
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return [tuple(r[:2]) for r in rows]
+
+    def outstanding(self):
+        """仍可能产生新任务的数量：待处理 + 租约中。"""
+        return self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def renew(self, task_id, worker, lease_s=900.0):
+        now = time.time()
+        cur = self.conn.execute("UPDATE tasks SET lease_until = ?, updated = ? WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                                (now + lease_s, now, task_id, worker))
+        return cur.rowcount > 0
+
+    def done(self, task_id, worker, peak_mb=None):
+        """peak_mb：观测到的显存峰值（MiB），记录后按全部观测重新拟合显存模型。"""
+        # 租约过期后被他人重领的任务，原 worker 仍可能先完成；结果已写出，同样记为完成
+        c = self.conn
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("UPDATE tasks SET status = 'done', worker = ?, lease_until = NULL, updated = ?, "
+                      "peak_mb = COALESCE(?, peak_mb) WHERE task_id = ?", (worker, time.time(), peak_mb, task_id))
+            model = self.mem_model() if peak_mb else None
+            row = c.execute("SELECT length FROM tasks WHERE task_id = ?", (task_id,)).fetchone() if model else None
+            if row and row[0] is not None:
+                model.refit([(row[0], float(peak_mb))])
+                c.execute("UPDATE meta SET value = ? WHERE key = 'mem_model'", (json.dumps(model.to_dict()),))
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+    def fail(self, task_id, worker, message=""):
+        """失败：未用完重试次数则放回队列，否则记为 failed。"""
+        max_attempts = int(self._meta("max_attempts", 2))
+        self.conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                          "worker = ?, lease_until = NULL, last_error = ?, updated = ? WHERE task_id = ?",
+                          (max_attempts, worker, message, time.time(), task_id))
+
+    def stats(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def report(self):
+        """[(worker, 任务数, 领取次数, 编译次数)]，按 worker 排序。"""
+        return self.conn.execute("SELECT worker, n_tasks, n_claims, n_compiles FROM workers ORDER BY worker").fetchall()
+
+    def gpu_report(self):
+        """[(gpu, 预算, 完成任务数, 观测峰值数, 最大观测峰值)]；未启用显存准入时为空。"""
+        return self.conn.execute("SELECT g.gpu, g.budget_mb, COUNT(t.task_id), COUNT(t.peak_mb), MAX(t.peak_mb) FROM gpus g "
+                                 "LEFT JOIN tasks t ON t.gpu = g.gpu AND t.status = 'done' GROUP BY g.gpu ORDER BY g.gpu").fetchall()
+
+def heartbeat(db, worker, task_ids, lease_s=900.0, stop=None):
+    """租约续约循环，直到 stop 被置位或 task_ids 全部不再由 worker 持有（已完成或租约已被他人接手）。
+    续约本身出错（数据库忙、锁超时等）不停止，下一轮重试，避免一次临时错误让租约过期、任务被重复运行。"""
+    stop = stop or threading.Event()
+    q, live = None, list(task_ids)
+    while live and not stop.wait(max(1.0, lease_s / 3)):
+        try:
+            q = q or TaskQueue(db)
+            live = [t for t in live if q.renew(t, worker, lease_s)]
+        except sqlite3.Error as e:
+            print(f"[WARN] lease renewal for {worker} failed ({e}); retrying", file=sys.stderr, flush=True)
+
+def reuse_rate(n_tasks, n_compiles):
+    return 1.0 - n_compiles / n_tasks if n_tasks else 0.0
+
+def main():
+    ap = argparse.ArgumentParser(description="第 5 阶段共享任务队列（SQLite，带租约）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("init"); p.add_argument("db"); p.add_argument("--max_attempts", type=int, default=2)
+    p.add_argument("--bucket_width", type=int, default=0, help="按复合物总长度分桶的宽度（残基数，0 为不分桶）")
+    p.add_argument("--gpu_budget", action="append", default=[], help="GPU=预算 MiB（可重复）；给出时启用显存准入")
+    p.add_argument("--mem_model", default=" ".join(map(str, DEFAULT_COEFFS)), help="峰值显存先验系数 \"a b c\"（MiB，a + b*L + c*L^2）")
+    p.add_argument("--mem_margin", type=float, default=1.15, help="估计值的安全系数")
+    p.add_argument("--mem_model_file", default=None, help="上次运行保存的显存模型（存在时取代 --mem_model 作为先验）")
+    p = sub.add_parser("add"); p.add_argument("db")
+    p = sub.add_parser("claim"); p.add_argument("db"); p.add_argument("worker")
+    p.add_argument("--lease", type=float, default=900.0)
+    p.add_argument("--wait", action="store_true", help="队列中还有他人租约中的任务时等待（以便接手过期租约），而不是直接退出")
+    p.add_argument("--poll", type=float, default=30.0)
+    p.add_argument("--batch", type=int, default=1, help="一次最多领取的同桶任务数")
+    p.add_argument("--new_process", action="store_true", help="本批在新启动的预测进程中运行（计一次编译）")
+    p.add_argument("--gpu", default=None, help="worker 所在 GPU（显存准入）")
+    p = sub.add_parser("renew"); p.add_argument("db"); p.add_argument("task_id"); p.add_argument("worker")
+    p.add_argument("--lease", type=float, default=900.0)
+    p = sub.add_parser("heartbeat"); p.add_argument("db"); p.add_argument("worker"); p.add_argument("task_ids", nargs="+")
+    p.add_argument("--lease", type=float, default=900.0)
+    p = sub.add_parser("done"); p.add_argument("db"); p.add_argument("task_id"); p.add_argument("worker")
+    p.add_argument("--peak_mb", type=float, default=None, help="观测到的显存峰值（MiB）")
+    p = sub.add_parser("fail"); p.add_argument("db"); p.add_argument("task_id"); p.add_argument("worker"); p.add_argument("message", nargs="?", default="")
+    p = sub.add_parser("stats"); p.add_argument("db")
+    p = sub.add_parser("report"); p.add_argument("db")
+    p = sub.add_parser("save_mem_model"); p.add_argument("db"); p.add_argument("file")
+    args = ap.parse_args()
+
+    if args.cmd == "heartbeat":
+        heartbeat(args.db, args.worker, args.task_ids, args.lease)
+        return
+    q = TaskQueue(args.db)
+    if args.cmd == "init":
+        tasks = [tuple(l.rstrip("\n").split("\t")) for l in sys.stdin if l.strip()]
+        budgets = dict(b.split("=", 1) for b in args.gpu_budget)
+        model = None
+        if budgets:
+            if args.mem_model_file and os.path.exists(args.mem_model_file):
+                model = MemModel.load(args.mem_model_file)
+                model.margin = args.mem_margin
+            else:
+                model = MemModel(parse_coeffs(args.mem_model), args.mem_margin)
+        q.init(tasks, args.max_attempts, args.bucket_width, budgets, model)
+        n_buckets = q.conn.execute("SELECT COUNT(DISTINCT bucket) FROM tasks").fetchone()[0]
+        print(f"[INFO] queue {args.db}: {len(tasks)} tasks in {n_buckets} length bucket(s) (width {args.bucket_width})", file=sys.stderr)
+        if model:
+            a, b, c = model.coeffs
+            print(f"[INFO] memory admission on GPU(s) {' '.join(f'{g}={b_}MiB' for g, b_ in budgets.items())}; "
+                  f"peak_mb = ({a:.0f} + {b:.3g}*L + {c:.3g}*L^2) * {model.margin} ({len(model.obs)} prior observations)", file=sys.stderr)
+    elif args.cmd == "add":
+        q.add([tuple(l.rstrip("\n").split("\t")) for l in sys.stdin if l.strip()])
+    elif args.cmd == "claim":
+        while True:
+            ts = q.claim(args.worker, args.lease, args.batch, args.new_process, args.gpu)
+            if ts:
+                for t in ts:
+                    print(f"{t[0]}\t{t[1]}")
+                break
+            if not args.wait or q.outstanding() == 0:
+                break
+            time.sleep(args.poll)
+    elif args.cmd == "renew":
+        sys.exit(0 if q.renew(args.task_id, args.worker, args.lease) else 2)
+    elif args.cmd == "done":
+        q.done(args.task_id, args.worker, args.peak_mb)
+    elif args.cmd == "fail":
+        q.fail(args.task_id, args.worker, args.message)
+    elif args.cmd == "stats":
+        line = " ".join(f"{k}={v}" for k, v in sorted(q.stats().items()))
+        # 不分桶时所有任务同桶，编译次数无意义
+        if int(q._meta("bucket_width", 0)) > 0:
+            rows = q.report()
+            n_tasks, n_compiles = sum(r[1] for r in rows), sum(r[3] for r in rows)
+            line += f" compiles={n_compiles} compile_reuse={reuse_rate(n_tasks, n_compiles):.1%}"
+        model = q.mem_model()
+        if model:
+            line += f" mem_model={','.join(f'{x:.4g}' for x in model.coeffs)} mem_obs={len(model.obs)}"
+        print(line)
+    elif args.cmd == "report":
+        bucketed = int(q._meta("bucket_width", 0)) > 0
+        print("worker\ttasks\tclaims\tcompiles\tcompile_reuse")
+        for w, n_tasks, n_claims, n_compiles in q.report():
+            print(f"{w}\t{n_tasks}\t{n_claims}\t{n_compiles if bucketed else 'NA'}\t"
+                  f"{f'{reuse_rate(n_tasks, n_compiles):.3f}' if bucketed else 'NA'}")
+        gpus = q.gpu_report()
+        if gpus:
+            print("gpu\tbudget_mb\tdone\tpeaks_observed\tmax_peak_mb")
+            for g, budget, n_done, n_obs, max_peak in gpus:
+                print(f"{g}\t{budget:.0f}\t{n_done}\t{n_obs}\t{'NA' if max_peak is None else f'{max_peak:.0f}'}")
+    elif args.cmd == "save_mem_model":
+        model = q.mem_model()
+        if model:
+            model.save(args.file)
+
+if __name__ == "__main__":
+    main()
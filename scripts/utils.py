@@ -1,9 +1,10 @@
 # scripts/utils.py
 # 与你提供的版本一致，保持接口；仅确保依赖齐全
-import os, json, math, numpy as np
-from Bio.PDB import PDBParser, PPBuilder, PDBIO, Select
+import os, json, math, hashlib, numpy as np
+from collections import Counter
+from Bio.PDB import PDBParser, PPBuilder, Select
 import freesasa
-from scipy.spatial import KDTree
+from scipy.spatial import cKDTree
 
 def load_structure(pdb_path, structure_id="S"):
     parser = PDBParser(QUIET=True)
@@ -16,22 +17,78 @@ def chain_seq(chain):
         seq += str(pp.get_sequence())
     return seq
 
-def best_chain_match(struct_mettl1, struct_complex, min_identity=0.25):
+def _seq_hash(seq):
+    return hashlib.sha1(seq.encode()).hexdigest()[:16]
+
+def _kmer_set(seq, k=3):
+    return {seq[i:i + k] for i in range(len(seq) - k + 1)}
+
+def _identity_upper_bound(seq_a, seq_b):
+    """globalxx 得分即最长公共子序列长度，不会超过两条序列氨基酸组成的逐类最小值之和。"""
+    ca, cb = Counter(seq_a), Counter(seq_b)
+    return sum(min(n, cb[aa]) for aa, n in ca.items()) / max(len(seq_a), len(seq_b))
+
+def _load_json_cache(path):
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+def _save_json_cache(path, cache):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+def best_chain_match(struct_mettl1, struct_complex, min_identity=0.25, cache_path=None):
+    """在复合物中找与目标单体最匹配的链。
+    组成上界剪枝 + 3-mer 相似度排序，只对可能胜出的链做 score-only 全局比对；
+    cache_path 给出时，(目标序列哈希, 链序列哈希) -> identity 持久化到磁盘，重复运行直接命中。"""
     target_chain = list(struct_mettl1.get_chains())[0]
     seq_t = chain_seq(target_chain)
+    cands = [(ch, chain_seq(ch)) for ch in struct_complex.get_chains()]
+    cands = [(ch, seq_c) for ch, seq_c in cands if seq_c and seq_t]
+
+    cache = _load_json_cache(cache_path)
+    ht = _seq_hash(seq_t)
+    kmers_t = _kmer_set(seq_t)
+
+    def kmer_sim(seq_c):
+        kc = _kmer_set(seq_c)
+        return len(kmers_t & kc) / max(1, min(len(kmers_t), len(kc)))
+
+    scored = []
+    for ch, seq_c in cands:
+        key = f"{ht}:{_seq_hash(seq_c)}"
+        if key in cache:
+            scored.append((cache[key], cache[key], ch, key, seq_c))
+        else:
+            ub = _identity_upper_bound(seq_t, seq_c)
+            if ub >= min_identity:
+                scored.append((ub, kmer_sim(seq_c), ch, key, seq_c))
+
+    aligner = None
     best = (None, 0.0)
-    from Bio import pairwise2
-    for ch in struct_complex.get_chains():
-        seq_c = chain_seq(ch)
-        if len(seq_c) == 0 or len(seq_t) == 0:
-            continue
-        alns = pairwise2.align.globalxx(seq_t, seq_c, one_alignment_only=True, score_only=False)
-        if not alns:
+    dirty = False
+    # 先比对 k-mer 最像的链；上界已不可能超过当前最优时直接跳过
+    for ub, _, ch, key, seq_c in sorted(scored, key=lambda x: (x[1], x[0]), reverse=True):
+        if ub <= best[1]:
             continue
-        aln = alns[0]
-        identity = aln[2] / max(len(seq_t), len(seq_c))
+        if key in cache:
+            identity = cache[key]
+        else:
+            if aligner is None:
+                from Bio.Align import PairwiseAligner
+                aligner = PairwiseAligner(mode="global", match_score=1, mismatch_score=0, gap_score=0)
+            identity = aligner.score(seq_t, seq_c) / max(len(seq_t), len(seq_c))
+            cache[key] = identity; dirty = True
         if identity > best[1]:
             best = (ch, identity)
+    if cache_path and dirty:
+        _save_json_cache(cache_path, cache)
     if best[0] is None or best[1] < min_identity:
         raise RuntimeError("无法在复合物中识别与 METTL1(3CKK) 匹配的链，请手动指定。")
     return best[0], best[1]
@@ -45,47 +102,206 @@ def residue_center(residue):
         return None
     return np.mean(np.array(coords), axis=0)
 
-def contact_pairs(chainA, chainB, cutoff=5.0):
-    pairs = []
-    atomsB = [a for res in chainB.get_residues() if res.id[0] == ' ' for a in res.get_atoms() if a.element != 'H']
-    if len(atomsB)==0:
-        return pairs
-    coordsB = np.array([a.coord for a in atomsB])
-    treeB = KDTree(coordsB)
-    resB_list = [a.get_parent() for a in atomsB]
-    for resA in chainA.get_residues():
-        if resA.id[0] != ' ':
-            continue
-        atomsA = [a for a in resA.get_atoms() if a.element != 'H']
-        if not atomsA: continue
-        coordsA = np.array([a.coord for a in atomsA])
-        min_d = float('inf'); closest_resB = None
-        for coord in coordsA:
-            dists, idxs = treeB.query(coord, k=1)
-            if dists < min_d:
-                min_d = dists; closest_resB = resB_list[idxs]
-            if min_d < cutoff:
-                break
-        if min_d < cutoff:
-            pairs.append((resA, closest_resB, min_d))
-    return pairs
+class ChainAtoms:
+    """链的数组化表示：重原子坐标 + 原子所属残基下标；KDTree 按需构建一次。
+    standard_only=False 时保留 HETATM 残基（排名脚本的 clash 统计沿用该口径）。"""
+    def __init__(self, chain, standard_only=True):
+        self.chain_id = chain.id
+        self.residues = [r for r in chain.get_residues() if r.id[0] == ' ' or not standard_only]
+        coords, res_index = [], []
+        for i, res in enumerate(self.residues):
+            for a in res.get_atoms():
+                if a.element != 'H':
+                    coords.append(a.coord); res_index.append(i)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.res_index = np.asarray(res_index, dtype=np.int64)
+        self._tree = None
+
+    @classmethod
+    def from_arrays(cls, sa, chain_id, standard_only=True):
+        """由缓存的 StructArrays 构建，residues 为结构内残基下标（不需要 Bio.PDB 对象）。"""
+        obj = cls.__new__(cls)
+        obj.chain_id = chain_id
+        m = sa.chain_mask(chain_id, standard_only) & sa.heavy_mask()
+        res_ids, obj.res_index = np.unique(sa.res_index[m], return_inverse=True)
+        obj.residues = list(res_ids)
+        obj.coords = np.asarray(sa.coords[m], dtype=np.float64).reshape(-1, 3)
+        obj._tree = None
+        return obj
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = cKDTree(self.coords)
+        return self._tree
+
+    def __len__(self):
+        return len(self.coords)
+
+def residue_contacts(atomsA, atomsB, cutoff=5.0):
+    """两条链的残基级接触表（树对树稀疏距离矩阵）。
+    返回 (ia, ib, dmin)：每个接触残基对一行，dmin 为两残基重原子最小距离（< cutoff）。"""
+    empty = (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0))
+    if len(atomsA) == 0 or len(atomsB) == 0:
+        return empty
+    sdm = atomsA.tree.sparse_distance_matrix(atomsB.tree, cutoff, output_type='ndarray')
+    sdm = sdm[sdm['v'] < cutoff]
+    if len(sdm) == 0:
+        return empty
+    ia = atomsA.res_index[sdm['i']]; ib = atomsB.res_index[sdm['j']]; d = sdm['v']
+    key = ia * len(atomsB.residues) + ib
+    order = np.lexsort((d, key))
+    first = np.r_[True, key[order][1:] != key[order][:-1]]
+    sel = order[first]
+    return ia[sel], ib[sel], d[sel]
+
+def closest_partners(ia, ib, dmin):
+    """接触表 -> 每个 A 残基只保留最近的 B 残基，按 A 残基顺序返回 (ia, ib, dmin)。"""
+    if len(ia) == 0:
+        return ia, ib, dmin
+    order = np.lexsort((dmin, ia))
+    first = np.r_[True, ia[order][1:] != ia[order][:-1]]
+    sel = order[first]
+    return ia[sel], ib[sel], dmin[sel]
+
+def contact_table(chains, cutoff=5.0, pairs=None):
+    """所有链只数组化一次，批量回答链对的残基接触。
+    pairs 为 [(idA, idB), ...]，缺省为全部无序链对；返回 ({id: ChainAtoms}, {(idA, idB): (ia, ib, dmin)})。"""
+    atoms = {ch.id: ChainAtoms(ch) for ch in chains}
+    if pairs is None:
+        ids = list(atoms)
+        pairs = [(a, b) for i, a in enumerate(ids) for b in ids[i + 1:]]
+    table = {(a, b): residue_contacts(atoms[a], atoms[b], cutoff) for a, b in pairs}
+    return atoms, table
+
+def contact_pairs(chainA, chainB, cutoff=5.0, atomsA=None, atomsB=None):
+    """兼容旧接口：[(resA, 最近的resB, min_d)]，每个接触的 A 残基一条。"""
+    if atomsA is None: atomsA = ChainAtoms(chainA)
+    if atomsB is None: atomsB = ChainAtoms(chainB)
+    ia, ib, d = closest_partners(*residue_contacts(atomsA, atomsB, cutoff))
+    return [(atomsA.residues[i], atomsB.residues[j], float(x)) for i, j, x in zip(ia, ib, d)]
+
+def nearest_distances(query_coords, ref):
+    """批量最近邻：query_coords 每个点到 ref（ChainAtoms 或坐标数组）的最近距离，一次树查询完成。"""
+    query_coords = np.asarray(query_coords, dtype=np.float64).reshape(-1, 3)
+    if len(query_coords) == 0 or len(ref) == 0:
+        return np.full(len(query_coords), np.inf)
+    tree = ref.tree if isinstance(ref, ChainAtoms) else cKDTree(np.asarray(ref, dtype=np.float64))
+    d, _ = tree.query(query_coords, k=1)
+    return d
+
+# freesasa 对未知残基按元素猜半径，这里沿用同一组数值
+_ELEMENT_RADII = {'C': 1.70, 'N': 1.55, 'O': 1.52, 'S': 1.80, 'P': 1.80, 'SE': 1.90}
+_sasa_classifier = None
+
+def _atom_radius(resname, atomname, element):
+    global _sasa_classifier
+    if _sasa_classifier is None:
+        _sasa_classifier = freesasa.Classifier()
+    r = _sasa_classifier.radius(resname, atomname)
+    if r <= 0:
+        r = _sasa_classifier.radius('ANY', atomname)
+    if r <= 0:
+        r = _ELEMENT_RADII.get(element.upper(), 1.80)
+    return r
+
+def sasa_inputs(chains):
+    """链 -> freesasa 坐标接口的输入数组：coords[N,3]、radii[N]、原子链号[N]、原子残基号[N]。
+    口径与 freesasa.Structure 默认一致：只取标准残基重原子；残基号为 freesasa 的 "%4d%c" 格式。"""
+    coords, radii, atom_chain, atom_res = [], [], [], []
+    for ch in chains:
+        for res in ch.get_residues():
+            if res.id[0] != ' ':
+                continue
+            resn = f"{res.id[1]:>4}{res.id[2]}"
+            for a in res.get_atoms():
+                if a.element in ('H', 'D'):
+                    continue
+                coords.append(a.coord)
+                radii.append(_atom_radius(res.get_resname(), a.get_id(), a.element))
+                atom_chain.append(ch.id); atom_res.append(resn)
+    return (np.asarray(coords, dtype=np.float64).reshape(-1, 3), np.asarray(radii, dtype=np.float64),
+            np.asarray(atom_chain), np.asarray(atom_res))
+
+def sasa_inputs_from_arrays(sa, chain_ids=None):
+    """StructArrays 版本的 sasa_inputs，口径相同；chain_ids 限定参与计算的链。"""
+    m = sa.heavy_mask() & ~sa.res_hetero[sa.res_index]
+    if chain_ids is not None:
+        m &= np.isin(sa.chain_id, list(chain_ids))
+    ridx = sa.res_index[m]
+    radius_of = {}
+    radii = np.empty(int(m.sum()))
+    for k, (rn, an, el) in enumerate(zip(sa.res_name[ridx], sa.atom_name[m], sa.element[m])):
+        key = (rn, an, el)
+        if key not in radius_of:
+            radius_of[key] = _atom_radius(str(rn), str(an), str(el))
+        radii[k] = radius_of[key]
+    atom_res = np.array([f"{n:>4}{c}" for n, c in zip(sa.res_seq[ridx], sa.res_icode[ridx])])
+    return np.asarray(sa.coords[m], dtype=np.float64), radii, np.asarray(sa.chain_id[m]), atom_res
+
+def atom_sasa(coords, radii):
+    """freesasa 坐标接口：直接由坐标和半径数组得到每原子 SASA，不落盘。"""
+    if len(coords) == 0:
+        return np.zeros(0)
+    result = freesasa.calcCoord(np.ascontiguousarray(coords, dtype=np.float64).ravel(), radii)
+    return np.array([result.atomArea(i) for i in range(len(radii))])
+
+class SasaResult:
+    """一次调用得到的复合物 / 各链单独 / ΔSASA（均为每原子数组，可按残基或链汇总）。"""
+    def __init__(self, complex_area, isolated_area, atom_chain, atom_res):
+        self.complex = complex_area
+        self.isolated = isolated_area
+        self.delta = isolated_area - complex_area
+        self.atom_chain = atom_chain
+        self.atom_res = atom_res
+
+    def by_residue(self, which="complex"):
+        """{(chain, resn): 面积}，which 取 complex / isolated / delta。"""
+        area = getattr(self, which)
+        out = {}
+        for ch, resn, a in zip(self.atom_chain, self.atom_res, area):
+            key = (str(ch), str(resn))
+            out[key] = out.get(key, 0.0) + float(a)
+        return out
+
+    def chain_total(self, chain_id, which="isolated"):
+        return float(getattr(self, which)[self.atom_chain == chain_id].sum())
+
+    def buried_area(self, chain_a, chain_b):
+        """两链界面 BSA：(SASA_a + SASA_b - SASA_complex) / 2。"""
+        return (self.chain_total(chain_a) + self.chain_total(chain_b) - float(self.complex.sum())) / 2.0
+
+def sasa_delta(coords, radii, atom_chain, atom_res, chain_ids=None):
+    """复合物 SASA + 各链单独 SASA（chain_ids 缺省为全部链）一次算完。"""
+    complex_area = atom_sasa(coords, radii)
+    isolated_area = complex_area.copy()
+    for cid in (np.unique(atom_chain) if chain_ids is None else chain_ids):
+        m = atom_chain == cid
+        if m.any():
+            isolated_area[m] = atom_sasa(coords[m], radii[m])
+    return SasaResult(complex_area, isolated_area, atom_chain, atom_res)
+
+def structure_sasa(struct, chain_ids=None):
+    """Bio.PDB 结构（只取第一个 model，与 freesasa 读文件一致）-> SasaResult。"""
+    model = next(iter(struct)) if struct.level == 'S' else struct
+    return sasa_delta(*sasa_inputs(list(model.get_chains())), chain_ids=chain_ids)
 
 def sasa_by_chain(struct):
-    io = PDBIO()
-    tmp = "tmp_for_sasa.pdb"
-    io.set_structure(struct)
-    io.save(tmp)
-    fs = freesasa.Structure(tmp)
-    result = freesasa.calc(fs)
-    res_sasa = {}
-    for i in range(fs.nAtoms()):
-        ch = fs.chainLabel(i)
-        resn = fs.residueNumber(i)
-        area = result.atomArea(i)
-        key = (ch, resn)
-        res_sasa[key] = res_sasa.get(key, 0.0) + area
-    os.remove(tmp)
-    return res_sasa
+    """兼容旧接口：{(chain, resn): 复合物中每残基 SASA}，不再写临时 PDB。"""
+    return structure_sasa(struct, chain_ids=[]).by_residue("complex")
+
+def _sasa_file_worker(args):
+    pdb_path, chain_ids = args
+    return structure_sasa(load_structure(pdb_path), chain_ids=chain_ids)
+
+def sasa_batch(pdb_paths, chain_ids=None, processes=None):
+    """批量模式：进程池内各自解析并在内存中计算，没有共享临时文件，可多进程/多目录并行。"""
+    tasks = [(p, chain_ids) for p in pdb_paths]
+    if processes == 1 or len(tasks) <= 1:
+        return [_sasa_file_worker(t) for t in tasks]
+    from multiprocessing import Pool
+    with Pool(processes) as pool:
+        return pool.map(_sasa_file_worker, tasks, chunksize=max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1))))
 
 def to_reskey(res):
     ch = res.get_parent().id
@@ -97,3 +313,177 @@ class ChainSelect(Select):
         self.chain_ids = set(chain_ids)
     def accept_chain(self, chain):
         return chain.id in self.chain_ids
+
+# ---------------------------------------------------------------------------
+# 解析结构缓存：每个 PDB/CIF 只用 Bio.PDB 解析一次，按文件内容哈希存成 .npz，
+# 之后各阶段脚本通过 cached_structure() 惰性、内存映射地读取数组。
+# ---------------------------------------------------------------------------
+DEFAULT_STRUCT_CACHE_DIR = "./outputs/tmp/struct_cache"
+
+def struct_cache_dir(P=None):
+    """缓存目录：环境变量 STRUCT_CACHE_DIR > paths.tmp_root/struct_cache > 默认值。"""
+    if os.environ.get("STRUCT_CACHE_DIR"):
+        return os.environ["STRUCT_CACHE_DIR"]
+    tmp_root = (P or {}).get("paths", {}).get("tmp_root")
+    return os.path.join(tmp_root, "struct_cache") if tmp_root else DEFAULT_STRUCT_CACHE_DIR
+
+def file_sha1(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def structure_to_arrays(struct):
+    """Bio.PDB 结构（第一个 model）-> 原子级 / 残基级数组字典。"""
+    model = next(iter(struct)) if struct.level == 'S' else struct
+    coords, element, atom_name, bfactor, res_index, atom_chain = [], [], [], [], [], []
+    res_chain, res_seq, res_icode, res_name, res_hetero = [], [], [], [], []
+    for ch in model:
+        for res in ch:
+            ri = len(res_seq)
+            res_chain.append(ch.id); res_seq.append(res.id[1]); res_icode.append(res.id[2])
+            res_name.append(res.get_resname()); res_hetero.append(res.id[0] != ' ')
+            for a in res.get_atoms():
+                coords.append(a.coord); element.append(a.element); atom_name.append(a.get_id())
+                bfactor.append(a.get_bfactor()); res_index.append(ri); atom_chain.append(ch.id)
+    return dict(
+        coords=np.asarray(coords, dtype=np.float32).reshape(-1, 3),
+        element=np.asarray(element, dtype="U2"), atom_name=np.asarray(atom_name, dtype="U4"),
+        bfactor=np.asarray(bfactor, dtype=np.float32), res_index=np.asarray(res_index, dtype=np.int32),
+        chain_id=np.asarray(atom_chain, dtype="U4"),
+        res_chain=np.asarray(res_chain, dtype="U4"), res_seq=np.asarray(res_seq, dtype=np.int32),
+        res_icode=np.asarray(res_icode, dtype="U1"), res_name=np.asarray(res_name, dtype="U3"),
+        res_hetero=np.asarray(res_hetero, dtype=bool),
+    )
+
+def _npz_member(path, info):
+    """把未压缩 .npz 中的一个成员直接内存映射（空数组或压缩成员回退为普通读取）。"""
+    import struct as _struct, zipfile
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        name_len, extra_len = _struct.unpack("<HH", f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+    if info.compress_type != zipfile.ZIP_STORED or int(np.prod(shape)) == 0 or dtype.hasobject:
+        with zipfile.ZipFile(path) as zf, zf.open(info) as fm:
+            return np.lib.format.read_array(fm)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran else "C")
+
+class StructArrays:
+    """缓存结构的只读视图：字段在首次访问时才从 .npz 内存映射。
+    原子级：coords, element, atom_name, bfactor, res_index, chain_id
+    残基级：res_chain, res_seq, res_icode, res_name, res_hetero"""
+    def __init__(self, npz_path, source=None):
+        self.npz_path = npz_path
+        self.source = source
+        self._members = None
+        self._arrays = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._arrays:
+            if self._members is None:
+                import zipfile
+                with zipfile.ZipFile(self.npz_path) as zf:
+                    self._members = {i.filename[:-4]: i for i in zf.infolist() if i.filename.endswith(".npy")}
+            if name not in self._members:
+                raise AttributeError(name)
+            self._arrays[name] = _npz_member(self.npz_path, self._members[name])
+        return self._arrays[name]
+
+    def chain_ids(self):
+        """按文件中出现顺序的链号列表。"""
+        ids, first = np.unique(self.res_chain, return_index=True)
+        return [str(ids[i]) for i in np.argsort(first)]
+
+    def heavy_mask(self):
+        return ~np.isin(self.element, ("H", "D"))
+
+    def chain_mask(self, chain_id, standard_only=True):
+        m = self.chain_id == chain_id
+        if standard_only:
+            m &= ~self.res_hetero[self.res_index]
+        return m
+
+    def residue_mask(self, chain_id, standard_only=True):
+        m = self.res_chain == chain_id
+        if standard_only:
+            m &= ~self.res_hetero
+        return m
+
+    def residue_count(self, chain_id, standard_only=True):
+        return int(self.residue_mask(chain_id, standard_only).sum())
+
+    def atom_coords(self, chain_id, atom_name="CA", standard_only=True):
+        m = self.chain_mask(chain_id, standard_only) & (self.atom_name == atom_name)
+        return np.asarray(self.coords[m], dtype=np.float64)
+
+    def segments(self, chain_id):
+        """标准残基编号的连续区段 [(start, end), ...]。"""
+        nums = sorted(set(int(x) for x in self.res_seq[self.residue_mask(chain_id)]))
+        segs = []
+        for n in nums:
+            if segs and n == segs[-1][1] + 1:
+                segs[-1][1] = n
+            else:
+                segs.append([n, n])
+        return [tuple(x) for x in segs]
+
+    def sequence(self, chain_id):
+        """单字母序列（含修饰氨基酸，MSE/SEC/PYL 特殊映射，无法映射记为 X）。"""
+        from Bio.PDB.Polypeptide import is_aa
+        from Bio.SeqUtils import seq1
+        custom_map = {"MSE": "M", "SEC": "U", "PYL": "O"}
+        out = []
+        for rn in self.res_name[self.res_chain == chain_id]:
+            rn = str(rn).strip()
+            if not is_aa(rn, standard=False):
+                continue
+            try:
+                out.append(seq1(rn, custom_map=custom_map))
+            except KeyError:
+                out.append("X")
+        return "".join(out)
+
+def cached_structure(path, cache_dir=None):
+    """统一入口：按内容哈希命中 .npz 缓存，未命中时解析一次并原子写入缓存。"""
+    cache_dir = cache_dir or struct_cache_dir()
+    npz_path = os.path.join(cache_dir, f"{file_sha1(path)}.npz")
+    if not os.path.exists(npz_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        if path.lower().endswith((".cif", ".mmcif")):
+            from Bio.PDB import MMCIFParser
+            struct = MMCIFParser(QUIET=True).get_structure("S", path)
+        else:
+            struct = load_structure(path)
+        tmp = f"{npz_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **structure_to_arrays(struct))
+        os.replace(tmp, npz_path)
+    return StructArrays(npz_path, source=path)
+
+# ---------------------------------------------------------------------------
+# 批量刚体叠合
+# ---------------------------------------------------------------------------
+def kabsch_batch(mobile, ref):
+    """批量 Kabsch：mobile (n, m, 3) 逐个叠合到 ref (m, 3)。
+    返回 (R, t)，叠合后坐标为 x @ R[i].T + t[i]（对同一结构中的任意点适用）。"""
+    mobile = np.asarray(mobile, dtype=np.float64)
+    ref = np.asarray(ref, dtype=np.float64)
+    pc = mobile.mean(axis=1)
+    qc = ref.mean(axis=0)
+    H = np.einsum("nmi,mj->nij", mobile - pc[:, None, :], ref - qc)
+    U, _, Vt = np.linalg.svd(H)
+    V = np.swapaxes(Vt, 1, 2)
+    Ut = np.swapaxes(U, 1, 2)
+    d = np.sign(np.linalg.det(V @ Ut))
+    D = np.tile(np.eye(3), (len(mobile), 1, 1))
+    D[:, 2, 2] = d
+    R = V @ D @ Ut
+    t = qc - np.einsum("nij,nj->ni", R, pc)
+    return R, t
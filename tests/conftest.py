@@ -0,0 +1,5 @@
+# tests/conftest.py
+# scripts/ 下的模块互相以平级方式 import（from utils import ...），测试同样把 scripts/ 放进 sys.path
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,35 @@
+# tests/test_kabsch.py
+# utils.kabsch_batch：批量叠合恢复已知的旋转 + 平移，镜像输入只给出真旋转
+import numpy as np
+
+from utils import kabsch_batch
+
+def random_rotation(rng):
+    q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    return q * np.sign(np.linalg.det(q))
+
+def test_recovers_known_superposition():
+    rng = np.random.default_rng(0)
+    ref = rng.normal(size=(20, 3)) * 5
+    Rs = [random_rotation(rng) for _ in range(4)]
+    ts = rng.normal(size=(4, 3)) * 10
+    # mobile_i = (ref - t_i) @ R_i，叠合回 ref 需要 R = R_i.T
+    mobile = np.stack([(ref - t) @ R for R, t in zip(Rs, ts)])
+    R, t = kabsch_batch(mobile, ref)
+    for i in range(4):
+        assert np.allclose(mobile[i] @ R[i].T + t[i], ref, atol=1e-8)
+        assert np.isclose(np.linalg.det(R[i]), 1.0)
+
+def test_reflection_gives_proper_rotation():
+    rng = np.random.default_rng(1)
+    ref = rng.normal(size=(15, 3))
+    mirrored = ref * np.array([1, 1, -1])
+    R, t = kabsch_batch(mirrored[None], ref)
+    assert np.isclose(np.linalg.det(R[0]), 1.0)
+    # 镜像无法由旋转叠合，残差必然大于 0
+    assert np.sqrt(((mirrored @ R[0].T + t[0] - ref) ** 2).sum(-1).mean()) > 0.1
+
+def test_identity():
+    ref = np.arange(12, dtype=float).reshape(4, 3) ** 1.5
+    R, t = kabsch_batch(np.stack([ref, ref]), ref)
+    assert np.allclose(R, np.eye(3)) and np.allclose(t, 0, atol=1e-8)
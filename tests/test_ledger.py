@@ -0,0 +1,85 @@
+# tests/test_ledger.py
+# ledger.py：完成判定（task_id + input_hash + 输出存在）/ 不完整行容错 / CLI pending 与 pending-files
+import os, subprocess, sys
+
+from ledger import Ledger, input_hash, file_input_hash
+
+LEDGER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "ledger.py")
+
+def touch(p, text="x"):
+    with open(p, "w") as f:
+        f.write(text)
+    return str(p)
+
+def test_input_hash_is_stable():
+    assert input_hash({"a": 1, "b": [2, 3]}, "k") == input_hash({"b": [2, 3], "a": 1}, "k")
+    assert input_hash(1, 2) != input_hash(2, 1)
+
+def test_record_then_done(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "sub" / "ledger.jsonl")
+    Ledger(path).record("t0", "h0", [out])
+    L = Ledger(path)
+    assert L.done("t0", "h0")
+    assert not L.done("t1", "h0")
+
+def test_changed_input_is_pending(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "ledger.jsonl")
+    Ledger(path).record("t0", "h0", [out])
+    assert not Ledger(path).done("t0", "h1")
+
+def test_missing_output_is_pending(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "ledger.jsonl")
+    Ledger(path).record("t0", "h0", [out])
+    os.remove(out)
+    assert not Ledger(path).done("t0", "h0")
+
+def test_latest_record_wins(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "ledger.jsonl")
+    L = Ledger(path)
+    L.record("t0", "h0", [out])
+    L.record("t0", "h1", [out])
+    assert Ledger(path).done("t0", "h1")
+    assert not Ledger(path).done("t0", "h0")
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "ledger.jsonl")
+    Ledger(path).record("t0", "h0", [out])
+    with open(path, "a") as f:
+        f.write('{"task_id": "t1", "input_ha')
+    L = Ledger(path)
+    assert L.done("t0", "h0")
+    assert "t1" not in L.entries
+
+def test_file_input_hash_depends_on_key_and_content(tmp_path):
+    p = touch(tmp_path / "a.pdb", "ATOM")
+    h = file_input_hash(p, "k")
+    assert h == file_input_hash(p, "k")
+    assert h != file_input_hash(p, "k2")
+    touch(p, "ATOM2")
+    assert h != file_input_hash(p, "k")
+
+def run(*args, stdin=None):
+    return subprocess.run([sys.executable, LEDGER_PY, *args], input=stdin, capture_output=True, text=True, check=True)
+
+def test_cli_pending(tmp_path):
+    out = touch(tmp_path / "out.pdb")
+    path = str(tmp_path / "ledger.jsonl")
+    tasks = touch(tmp_path / "tasks.tsv", "t0\tx\th0\nt1\ty\th1\n")
+    run("record", path, "t0", "h0", out)
+    r = run("pending", path, tasks)
+    assert r.stdout == "t1\ty\th1\n"
+    assert "1 tasks already complete" in r.stderr
+
+def test_cli_pending_files(tmp_path):
+    a = touch(tmp_path / "a.pdb", "A")
+    b = touch(tmp_path / "b.pdb", "B")
+    path = str(tmp_path / "ledger.jsonl")
+    run("record", path, a, file_input_hash(a, "k"), a)
+    assert run("pending-files", path, "k", a, b).stdout == f"{b}\t{file_input_hash(b, 'k')}\n"
+    # 未给文件时从 stdin 读取；key 变化后全部重做
+    assert run("pending-files", path, "k2", stdin=f"{a}\n{b}\n").stdout.count("\n") == 2
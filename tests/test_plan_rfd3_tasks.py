@@ -0,0 +1,40 @@
+# tests/test_plan_rfd3_tasks.py
+# plan_rfd3_tasks.compile_plan：清单可复现，种子 / 长度只取决于 task_id 与 k，context 变化只影响 input_hash
+import zlib
+
+from plan_rfd3_tasks import compile_plan, design_length
+
+HOTSETS = [{"hotspot_res_str": "A:12,A:15", "hotspot_count": 2}, {"hotspot_res_str": "A:40", "hotspot_count": 1}]
+LENBINS = [{"min": 60, "max": 80}, {"min": 90, "max": 90}]
+
+def plan(**kw):
+    args = dict(hotsets=HOTSETS, lenbins=LENBINS, per_combo=3, batch_id=1, outdir="/out", segments="A1-100", context={"model": "m"})
+    args.update(kw)
+    return compile_plan(**args)
+
+def test_plan_is_deterministic():
+    assert plan() == plan()
+    assert len(plan()) == 2 * 2 * 3
+    assert len({t["task_id"] for t in plan()}) == 12
+
+def test_seed_and_length_per_task():
+    for t in plan():
+        assert t["seed"] == zlib.crc32(t["task_id"].encode()) & 0x7FFFFFFF
+        k = int(t["task_id"].rsplit("_", 1)[1])
+        lmin, lmax = map(int, t["combo"].rsplit("_len-", 1)[1].split("-"))
+        assert t["length"] == design_length(k, lmin, lmax)
+        assert lmin <= t["length"] <= lmax
+        assert t["contig"] == f"[A1-100/0 {t['length']}-{t['length']}/0]"
+        assert t["output_prefix"] == f"/out/{t['combo']}/design_{k}_len{t['length']}"
+
+def test_growing_per_combo_keeps_existing_tasks():
+    small = {t["task_id"]: t for t in plan()}
+    for t in plan(per_combo=5):
+        if t["task_id"] in small:
+            assert t == small[t["task_id"]]
+
+def test_context_only_changes_input_hash():
+    a, b = plan(), plan(context={"model": "m2"})
+    for x, y in zip(a, b):
+        assert x["input_hash"] != y["input_hash"]
+        assert {k: v for k, v in x.items() if k != "input_hash"} == {k: v for k, v in y.items() if k != "input_hash"}
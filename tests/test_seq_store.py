@@ -0,0 +1,75 @@
+# tests/test_seq_store.py
+# seq_store.py：写入 / 读取往返、索引排序、重复 name、空库、异常时不落盘、CLI get
+import os, subprocess, sys
+
+import pytest
+
+from seq_store import SeqStore, SeqStoreWriter
+
+SEQ_STORE_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "seq_store.py")
+
+RECORDS = {"b_design_1": ">b_design_1\nMKV\n", "a_design_0": ">a_design_0\nACDEFG\nHIK\n", "c_design_2": ">c_design_2\nW\n"}
+
+@pytest.fixture
+def prefix(tmp_path):
+    p = str(tmp_path / "tasks")
+    with SeqStoreWriter(p) as w:
+        for name, text in RECORDS.items():
+            w.add(name, text)
+    return p
+
+def test_round_trip(prefix):
+    store = SeqStore(prefix)
+    assert len(store) == 3
+    for name, text in RECORDS.items():
+        assert name in store
+        assert store.get(name) == text
+    assert "missing" not in store
+
+def test_index_is_sorted_with_terminators(prefix):
+    with open(f"{prefix}.ffindex") as f:
+        rows = [l.rstrip("\n").split("\t") for l in f]
+    assert [r[0] for r in rows] == sorted(RECORDS)
+    with open(f"{prefix}.ffdata", "rb") as f:
+        data = f.read()
+    for name, off, n in rows:
+        off, n = int(off), int(n)
+        assert data[off + n - 1:off + n] == b"\0"
+        assert data[off:off + n - 1].decode() == RECORDS[name]
+    assert not os.path.exists(f"{prefix}.ffdata.tmp")
+    assert not os.path.exists(f"{prefix}.ffindex.tmp")
+
+def test_names_sorted(prefix):
+    assert SeqStore(prefix).names() == sorted(RECORDS)
+
+def test_duplicate_name_raises(tmp_path):
+    w = SeqStoreWriter(str(tmp_path / "dup"))
+    w.add("x", ">x\nA\n")
+    with pytest.raises(KeyError):
+        w.add("x", ">x\nC\n")
+    w.close()
+    assert SeqStore(str(tmp_path / "dup")).get("x") == ">x\nA\n"
+
+def test_empty_store(tmp_path):
+    p = str(tmp_path / "empty")
+    SeqStoreWriter(p).close()
+    store = SeqStore(p)
+    assert len(store) == 0
+    assert store.names() == []
+
+def test_exception_keeps_previous_store(prefix):
+    # 中途出错时不替换已有的库
+    with pytest.raises(RuntimeError):
+        with SeqStoreWriter(prefix) as w:
+            w.add("z", ">z\nA\n")
+            raise RuntimeError("boom")
+    store = SeqStore(prefix)
+    assert store.names() == sorted(RECORDS)
+    assert "z" not in store
+
+def test_cli_get(prefix):
+    r = subprocess.run([sys.executable, SEQ_STORE_PY, "get", prefix, "c_design_2", "a_design_0"],
+                       capture_output=True, text=True, check=True)
+    assert r.stdout == RECORDS["c_design_2"] + RECORDS["a_design_0"]
+    r = subprocess.run([sys.executable, SEQ_STORE_PY, "get", prefix, "nope"], capture_output=True, text=True)
+    assert r.returncode == 1 and "nope" in r.stderr
@@ -0,0 +1,148 @@
+# tests/test_task_queue.py
+# task_queue.py：领取 / 租约过期重领 / 续约 / 失败重试 / 分桶批量领取 / 追加任务 / 显存准入 / 续约心跳
+import sqlite3, threading, time
+
+import pytest
+
+import task_queue
+from task_queue import TaskQueue, heartbeat
+from gpu_scheduler import MemModel
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+def make_queue(db, n=3, **kw):
+    q = TaskQueue(db)
+    q.init([(f"t{i}", f"p{i}") for i in range(n)], **kw)
+    return q
+
+def test_claim_in_order_until_empty(db):
+    q = make_queue(db)
+    got = [q.claim("w0") for _ in range(4)]
+    assert got == [[("t0", "p0")], [("t1", "p1")], [("t2", "p2")], []]
+    assert q.stats() == {"leased": 3}
+    assert q.outstanding() == 3
+
+def test_done_is_final(db):
+    q = make_queue(db, n=1)
+    (tid, _), = q.claim("w0")
+    q.done(tid, "w0")
+    assert q.stats() == {"done": 1}
+    assert q.outstanding() == 0
+    assert q.claim("w1") == []
+
+def test_expired_lease_is_reclaimed(db):
+    q = make_queue(db, n=1, max_attempts=2)
+    assert q.claim("w0", lease_s=0.5) == [("t0", "p0")]
+    assert q.claim("w1") == []
+    time.sleep(0.6)
+    assert q.claim("w1") == [("t0", "p0")]
+    row = q.conn.execute("SELECT worker, attempts FROM tasks").fetchone()
+    assert row == ("w1", 2)
+
+def test_expired_lease_after_last_attempt_fails(db):
+    q = make_queue(db, n=1, max_attempts=1)
+    q.claim("w0", lease_s=0.5)
+    time.sleep(0.6)
+    assert q.claim("w1") == []
+    assert q.stats() == {"failed": 1}
+
+def test_renew_only_by_owner(db):
+    q = make_queue(db, n=1)
+    q.claim("w0", lease_s=0.5)
+    assert q.renew("t0", "w0", lease_s=60)
+    assert not q.renew("t0", "w1", lease_s=60)
+    time.sleep(0.6)
+    assert q.claim("w1") == []  # 续约后未过期
+
+def test_renew_after_done_is_lost(db):
+    q = make_queue(db, n=1)
+    q.claim("w0")
+    q.done("t0", "w0")
+    assert not q.renew("t0", "w0")
+
+def test_fail_requeues_until_max_attempts(db):
+    q = make_queue(db, n=1, max_attempts=2)
+    q.claim("w0")
+    q.fail("t0", "w0", "boom")
+    assert q.stats() == {"pending": 1}
+    q.claim("w0")
+    q.fail("t0", "w0", "boom again")
+    assert q.stats() == {"failed": 1}
+    assert q.conn.execute("SELECT last_error FROM tasks").fetchone()[0] == "boom again"
+
+def test_batch_claim_stays_in_one_bucket(db):
+    q = TaskQueue(db)
+    # 宽度 10：长度 5/7 在桶 0，12/15/18 在桶 1；剩余任务最多的桶优先
+    q.init([("a", "", 12), ("b", "", 5), ("c", "", 15), ("d", "", 7), ("e", "", 18)], bucket_width=10)
+    assert [t for t, _ in q.claim("w0", batch=10)] == ["a", "c", "e"]
+    assert [t for t, _ in q.claim("w0", batch=10)] == ["b", "d"]
+    assert q.report() == [("w0", 5, 2, 2)]  # 两次换桶，各计一次编译
+
+def test_retried_task_is_claimed_alone(db):
+    q = make_queue(db, n=3, max_attempts=3)
+    (tid, _), = q.claim("w0")
+    q.fail(tid, "w0")
+    assert q.claim("w1", batch=3) == [("t0", "p0")]
+    assert [t for t, _ in q.claim("w1", batch=3)] == ["t1", "t2"]
+
+def test_add_appends_without_reset(db):
+    q = make_queue(db, n=1)
+    q.claim("w0")
+    q.done("t0", "w0")
+    q.add([("t1", "p1"), ("t0", "dup")])
+    assert q.stats() == {"done": 1, "pending": 1}
+    assert q.claim("w0") == [("t1", "p1")]
+    assert q.report()[0][1] == 2  # worker 统计保留
+
+def test_memory_admission(db):
+    q = TaskQueue(db)
+    # 模型：peak = 1000 * L（MiB），预算 2500：两个 L=1 可以同时运行，第三个要等
+    q.init([("a", "", 1), ("b", "", 1), ("c", "", 1), ("big", "", 5)], gpu_budgets={"0": 2500},
+           mem_model=MemModel((0, 1000, 0), margin=1.0))
+    assert [t for t, _ in q.claim("w0", gpu="0")] == ["a"]
+    assert [t for t, _ in q.claim("w1", gpu="0")] == ["b"]
+    assert q.claim("w2", gpu="0") == []
+    q.done("a", "w0")
+    assert [t for t, _ in q.claim("w2", gpu="0")] == ["c"]
+    q.done("b", "w1"); q.done("c", "w2")
+    # GPU 空闲时超出预算的任务也放行（独占）
+    assert [t for t, _ in q.claim("w0", gpu="0")] == ["big"]
+
+def test_done_peak_refits_model(db):
+    q = TaskQueue(db)
+    q.init([("a", "", 10)], gpu_budgets={"0": 1e6}, mem_model=MemModel((0, 1, 0), margin=1.0))
+    q.claim("w0", gpu="0")
+    q.done("a", "w0", peak_mb=100.0)
+    assert q.mem_model().predict(10) == pytest.approx(100.0)
+
+def test_heartbeat_stops_when_task_lost(db):
+    q = make_queue(db, n=1)
+    q.claim("w0", lease_s=60)
+    q.done("t0", "w0")
+    t = threading.Thread(target=heartbeat, args=(db, "w0", ["t0"], 3.0))
+    t.start()
+    t.join(5)
+    assert not t.is_alive()
+
+def test_heartbeat_survives_transient_errors(db, monkeypatch):
+    q = make_queue(db, n=1)
+    q.claim("w0", lease_s=60)
+    calls = []
+    renew = TaskQueue.renew
+    def flaky(self, *a, **kw):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return renew(self, *a, **kw)
+    monkeypatch.setattr(task_queue.TaskQueue, "renew", flaky)
+    stop = threading.Event()
+    t = threading.Thread(target=heartbeat, args=(db, "w0", ["t0"], 3.0, stop))
+    t.start()
+    time.sleep(2.5)
+    stop.set()
+    t.join(5)
+    assert len(calls) >= 2  # 第一次出错后继续续约
+    # 心跳按自己的 lease_s（3 s）续约，覆盖了原来 60 s 的租约
+    assert q.conn.execute("SELECT lease_until FROM tasks").fetchone()[0] < time.time() + 10